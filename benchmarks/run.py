@@ -0,0 +1,208 @@
+"""Throughput benchmarks for dset's operations.
+
+Each operation runs as its own `python -m dset` process over a synthetic
+dataset, with the LLM operations talking to dset's bundled mock OpenAI
+server, and is measured for entries per second, request latency (p50/p99,
+both as seen by the server and as timed by a client over a kept-alive
+connection, so transport stalls the server can't see still show up) and peak
+RSS. Save a run with --output and compare a
+later one against it with --baseline to catch regressions:
+
+    python benchmarks/run.py --rows 10000,1000000 --output baseline.json
+    python benchmarks/run.py --rows 10000,1000000 --baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import requests
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'src'))
+
+from dset.mock_server import MockServer, LATENCY_DISTRIBUTIONS, DEFAULT_LATENCY_DISTRIBUTION, percentile  # noqa: E402
+
+OPERATIONS = ('filter', 'ask', 'merge', 'split', 'gen')
+LLM_OPERATIONS = {'filter', 'ask', 'gen'}
+DEFAULT_ROWS = '10000'
+DEFAULT_CONCURRENCY = 32
+DEFAULT_TOLERANCE = 0.2
+PROBE_REQUESTS = 100  # Requests timed at the client after each LLM operation
+
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet", "kilo", "lima")
+
+def write_dataset(path: Path, rows: int, seed: int):
+    # People with a few typed fields and some free text, written once and reused
+    if path.exists():
+        return
+    rng = random.Random(seed)
+    temporary = path.with_suffix('.tmp')
+    with open(temporary, 'w') as f:
+        for i in range(rows):
+            f.write(json.dumps({
+                "id": i,
+                "name": f"Person {rng.randrange(10 ** 6)}",
+                "age": rng.randint(1, 99),
+                "email": f"user{i}@example.com" if rng.random() < 0.9 else None,
+                "tags": rng.sample(WORDS, rng.randint(0, 3)),
+                "bio": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))
+            }) + "\n")
+    os.replace(temporary, path)
+
+def commands(operation: str, dataset: Path, rows: int, output: Path, concurrency: int, entries_per_request: int) -> List[str]:
+    llm = ['--concurrency', str(concurrency), '--entries-per-request', str(entries_per_request)]
+    if operation == 'filter':
+        return ['filter', str(dataset), str(output), 'Is this person an adult?'] + llm
+    if operation == 'ask':
+        return ['ask', str(dataset), 'Does this person have a valid email address?', '--reasons-output', str(output / 'reasons.jsonl')] + llm
+    if operation == 'merge':
+        # The dataset merged with itself: every entry of the second copy is a duplicate
+        return ['merge', f"{dataset},{dataset}", str(output / 'merged.jsonl')]
+    if operation == 'split':
+        return ['split', str(dataset), str(output / 'part'), '--max-lines', str(max(rows // 10, 1))]
+    if operation == 'gen':
+        return ['gen', str(output / 'generated.jsonl'), 'People with a name and an age', str(rows),
+                '--concurrency', str(concurrency)]
+    raise ValueError(f"Unknown operation {operation!r}")
+
+def run(command: List[str], env: Dict[str, str]) -> Dict[str, Any]:
+    # Wall time and peak RSS of one dset process
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, '-m', 'dset'] + command, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    seconds = time.monotonic() - started
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return {"seconds": seconds, "peak_rss_mib": rss / 2 ** 20, "returncode": process.returncode, "stderr": stderr.decode(errors='replace')}
+
+def probe(server: MockServer, requests_count: int = PROBE_REQUESTS) -> Dict[str, Optional[float]]:
+    # Round-trip times of plain questions sent one at a time over one
+    # connection, from the request going out to the whole response read
+    latencies = []
+    with requests.Session() as session:
+        for i in range(requests_count):
+            started = time.monotonic()
+            response = session.post(f"{server.url}/chat/completions", json={
+                "model": "benchmark", "messages": [{"role": "user", "content": f"Is probe {i} answered?"}]
+            })
+            response.content
+            if response.status_code == 200:
+                latencies.append(time.monotonic() - started)
+    return {"p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99)}
+
+def milliseconds(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+def benchmark(operation: str, rows: int, args, server: MockServer, data_dir: Path) -> Dict[str, Any]:
+    dataset = data_dir / f"people-{rows}.jsonl"
+    write_dataset(dataset, rows, args.seed)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT / 'src'), os.environ.get('PYTHONPATH')])),
+               OPENAI_API_KEY='benchmark')
+    options = ['--no-cache', '--base-url', server.url, '--pool-size', str(args.concurrency)]
+
+    with tempfile.TemporaryDirectory(dir=data_dir) as output:
+        server.reset_stats()
+        result = run(options + commands(operation, dataset, rows, Path(output), args.concurrency, args.entries_per_request), env)
+    # ask exits with 1 when the answer isn't yes for every entry
+    if result["returncode"] not in ((0, 1) if operation == 'ask' else (0,)):
+        raise RuntimeError(f"{operation} on {rows} rows failed:\n{result['stderr']}")
+
+    stats = server.stats() if operation in LLM_OPERATIONS else {}
+    client = probe(server) if operation in LLM_OPERATIONS else {}
+    entries = 2 * rows if operation == 'merge' else rows
+    return {
+        "operation": operation,
+        "rows": rows,
+        "seconds": round(result["seconds"], 3),
+        "entries_per_sec": round(entries / result["seconds"], 1),
+        "requests": stats.get("requests"),
+        "p50_ms": milliseconds(stats.get("p50")),
+        "p99_ms": milliseconds(stats.get("p99")),
+        "client_p50_ms": milliseconds(client.get("p50")),
+        "client_p99_ms": milliseconds(client.get("p99")),
+        "peak_rss_mib": round(result["peak_rss_mib"], 1)
+    }
+
+def print_results(results: List[Dict[str, Any]]):
+    columns = ("operation", "rows", "seconds", "entries_per_sec", "requests", "p50_ms", "p99_ms", "client_p50_ms", "client_p99_ms",
+               "peak_rss_mib")
+    rows = [columns] + [tuple("-" if result[column] is None else str(result[column]) for column in columns) for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+def regressions(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    # Slower or larger than the baseline run by more than `tolerance`
+    previous = {(result["operation"], result["rows"]): result for result in baseline}
+    found = []
+    for result in results:
+        before = previous.get((result["operation"], result["rows"]))
+        if before is None:
+            continue
+        name = f"{result['operation']} on {result['rows']} rows"
+        if result["entries_per_sec"] < before["entries_per_sec"] * (1 - tolerance):
+            found.append(f"{name}: {result['entries_per_sec']} entries/sec, was {before['entries_per_sec']}")
+        if result["peak_rss_mib"] > before["peak_rss_mib"] * (1 + tolerance):
+            found.append(f"{name}: peak RSS {result['peak_rss_mib']} MiB, was {before['peak_rss_mib']}")
+    return found
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark dset operations against a mock OpenAI server')
+    parser.add_argument('--operations', default=','.join(OPERATIONS), help='Comma-separated operations to run (default: %(default)s)')
+    parser.add_argument('--rows', default=DEFAULT_ROWS, help='Comma-separated dataset sizes, e.g. 10000,1000000,10000000 (default: %(default)s)')
+    parser.add_argument('--data-dir', default=None, help='Directory for the synthetic datasets, reused between runs (default: a temporary directory)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Requests in flight for LLM operations (default: %(default)s)')
+    parser.add_argument('--entries-per-request', type=int, default=1, help='Entries per request for filter and ask (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.02, help='Mean mock response delay in seconds (default: %(default)s)')
+    parser.add_argument('--latency-distribution', choices=LATENCY_DISTRIBUTIONS, default=DEFAULT_LATENCY_DISTRIBUTION,
+                        help='Distribution of mock response delays (default: %(default)s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of mock requests failed with a 500 (default: %(default)s)')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of mock requests refused with a 429 (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the datasets and the mock server (default: %(default)s)')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='Compare against the results in this JSON file and fail on regressions')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed throughput drop or memory growth against --baseline (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    operations = [operation.strip() for operation in args.operations.split(',') if operation.strip()]
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"Unknown operations: {', '.join(sorted(unknown))}")
+    sizes = [int(rows) for rows in args.rows.split(',')]
+
+    results = []
+    with contextlib.ExitStack() as stack:
+        data_dir = Path(args.data_dir) if args.data_dir else Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        data_dir.mkdir(parents=True, exist_ok=True)
+        server = stack.enter_context(MockServer(
+            latency=args.latency, distribution=args.latency_distribution, error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate, seed=args.seed
+        ))
+        for rows in sizes:
+            for operation in operations:
+                results.append(benchmark(operation, rows, args, server, data_dir))
+                print(f"{operation} on {rows} rows: {results[-1]['entries_per_sec']} entries/sec", file=sys.stderr)
+
+    print_results(results)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+    if args.baseline:
+        found = regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}")
+        return 1 if found else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import sys
 from dset.config import build_config
 
 def main():
@@ -5,7 +6,9 @@ def main():
     if not success:
         return
 
-    config.args.func(config)
+    # A failed assertion (or any operation reporting failure) exits non-zero for CI
+    if not config.args.func(config):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
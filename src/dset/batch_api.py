@@ -0,0 +1,97 @@
+import json
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Optional
+from dset.cache import make_cache_key
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# Requests are identified by a hash of their body plus an occurrence counter,
+# so identical requests (e.g. repeated `gen` prompts) still get unique
+# custom_ids, and ingesting results doesn't depend on the order in which the
+# operation issues its requests the second time around.
+def make_custom_id(key: str, occurrence: int) -> str:
+    return f"{key}-{occurrence}"
+
+def parse_custom_id(custom_id: str):
+    key, _, occurrence = custom_id.rpartition('-')
+    return key, int(occurrence)
+
+def manifest_path(requests_path) -> Path:
+    requests_path = Path(requests_path)
+    return requests_path.with_name(requests_path.name + ".manifest.json")
+
+class BatchRequestWriter:
+    def __init__(self, path, operation: str, args: Dict[str, Any]):
+        self.path = Path(path)
+        self.operation = operation
+        self.args = args
+        self.count = 0
+        self._occurrences = defaultdict(int)
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'w')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.file:
+            self.file.close()
+        if exc_type is None:
+            with open(manifest_path(self.path), 'w') as manifest_file:
+                json.dump({"operation": self.operation, "args": self.args, "requests": self.count}, manifest_file, default=str)
+
+    def write(self, body: Dict[str, Any]):
+        if not self.file:
+            raise RuntimeError("BatchRequestWriter must be used as a context manager")
+        key = make_cache_key(body)
+        custom_id = make_custom_id(key, self._occurrences[key])
+        self._occurrences[key] += 1
+        json.dump({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}, self.file)
+        self.file.write('\n')
+        self.count += 1
+
+def read_manifest(requests_path) -> Dict[str, Any]:
+    with open(manifest_path(requests_path), 'r') as manifest_file:
+        return json.load(manifest_file)
+
+class BatchResults:
+    def __init__(self):
+        self._contents = defaultdict(dict)
+        self._occurrences = defaultdict(int)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path) -> 'BatchResults':
+        results = cls()
+        with open(path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    continue
+                key, occurrence = parse_custom_id(record["custom_id"])
+                content = response["body"]["choices"][0]["message"]["content"]
+                results._contents[key][occurrence] = content
+        return results
+
+    def __len__(self):
+        return sum(len(contents) for contents in self._contents.values())
+
+    def pop(self, body: Dict[str, Any]) -> Optional[str]:
+        key = make_cache_key(body)
+        with self._lock:
+            occurrence = self._occurrences[key]
+            self._occurrences[key] += 1
+            contents = self._contents.get(key)
+            content = contents.pop(occurrence, None) if contents else None
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return content
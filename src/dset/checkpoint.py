@@ -0,0 +1,45 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+DEFAULT_CHECKPOINT_INTERVAL = 1000  # Number of entries between checkpoints
+
+def checkpoint_path(output_path) -> Path:
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.name + ".checkpoint.json")
+
+class Checkpoint:
+    def __init__(self, output_path, input_path, interval: int = DEFAULT_CHECKPOINT_INTERVAL):
+        self.path = checkpoint_path(output_path)
+        self.input_path = str(input_path)
+        self.interval = interval
+        self._pending = 0
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not self.path.exists():
+            return None
+        with open(self.path, 'r') as f:
+            state = json.load(f)
+        if state.get('input') != self.input_path:
+            raise ValueError(f"Checkpoint {self.path} was written for input {state.get('input')}, not {self.input_path}")
+        return state
+
+    def due(self) -> bool:
+        self._pending += 1
+        return self._pending >= self.interval
+
+    def save(self, state: Dict[str, Any]):
+        # Write to a temporary file and rename over the old checkpoint, so a
+        # crash mid-write never leaves a truncated checkpoint behind.
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(state, input=self.input_path), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._pending = 0
+
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
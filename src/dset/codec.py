@@ -0,0 +1,82 @@
+import re
+import json
+import math
+from typing import Any, Union
+
+# Use the fastest JSON library available, falling back to the stdlib. All
+# backends produce compact UTF-8 output so datasets look the same whichever
+# one wrote them.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+_DECODE_ERRORS = (ValueError,) + ((msgspec.DecodeError,) if msgspec is not None else ())
+
+if orjson is not None:
+    BACKEND = 'orjson'
+elif msgspec is not None:
+    BACKEND = 'msgspec'
+else:
+    BACKEND = 'json'
+
+def _stdlib_dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys).encode('utf-8')
+
+# Integers this long may not fit in 64 bits, which orjson and msgspec would
+# turn into floats; matches inside strings or floats just take the slow path.
+_LONG_NUMBER = re.compile(rb'\d{19}')
+_LONG_NUMBER_TEXT = re.compile(r'\d{19}')
+
+def loads(data: Union[bytes, str]) -> Any:
+    # The fast parsers are lossy for big integers and reject NaN and
+    # Infinity, so those lines go to the stdlib parser like everything
+    # else they can't handle.
+    if orjson is not None or msgspec is not None:
+        if not (_LONG_NUMBER_TEXT if isinstance(data, str) else _LONG_NUMBER).search(data):
+            try:
+                if orjson is not None:
+                    return orjson.loads(data)
+                return msgspec.json.decode(data)
+            except _DECODE_ERRORS:
+                pass
+    return json.loads(data)
+
+def _has_non_finite(obj: Any) -> bool:
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite(value) for value in obj)
+    return False
+
+def _fast_dumps(obj: Any, sort_keys: bool) -> bytes:
+    # orjson and msgspec reject a few things the stdlib accepts (non-string
+    # keys, integers over 64 bits) and write NaN and Infinity as null, so
+    # fall back rather than fail or lose them. Only output containing a null
+    # needs checking for the latter.
+    try:
+        if orjson is not None:
+            encoded = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+        elif msgspec is not None:
+            encoded = msgspec.json.encode(obj, order='sorted' if sort_keys else None)
+        else:
+            encoded = None
+        if encoded is not None and not (b'null' in encoded and _has_non_finite(obj)):
+            return encoded
+    except (TypeError, OverflowError):
+        pass
+    return _stdlib_dumps(obj, sort_keys=sort_keys)
+
+def dumps(obj: Any) -> bytes:
+    return _fast_dumps(obj, sort_keys=False)
+
+def dumps_canonical(obj: Any) -> bytes:
+    # Key-order independent encoding, used to compare and hash entries
+    return _fast_dumps(obj, sort_keys=True)
@@ -0,0 +1,68 @@
+import gzip
+import io
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+NONE = 'none'
+COMPRESSION_CHOICES = [NONE, GZIP, ZSTD]
+
+SUFFIXES = {GZIP: '.gz', ZSTD: '.zst'}
+MAGIC = {GZIP: b'\x1f\x8b', ZSTD: b'\x28\xb5\x2f\xfd'}
+DEFAULT_LEVELS = {GZIP: 6, ZSTD: 3}
+
+DATASET_PATTERNS = ['*.jsonl'] + [f'*.jsonl{suffix}' for suffix in SUFFIXES.values()]
+
+def compression_for_name(path) -> Optional[str]:
+    suffix = Path(path).suffix
+    for compression, compression_suffix in SUFFIXES.items():
+        if suffix == compression_suffix:
+            return compression
+    return None
+
+def detect(path) -> Optional[str]:
+    compression = compression_for_name(path)
+    if compression:
+        return compression
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    for compression, magic in MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+def with_suffix(name: str, compression: Optional[str]) -> str:
+    return name + SUFFIXES.get(compression, '')
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("Reading or writing .zst datasets requires the 'zstandard' package")
+
+def open_read(path, compression: Optional[str] = None) -> BinaryIO:
+    # Returns a buffered binary stream of the decompressed data
+    compression = compression or detect(path)
+    if compression == GZIP:
+        return gzip.open(path, 'rb')
+    if compression == ZSTD:
+        _require_zstandard()
+        raw = open(path, 'rb')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True))
+    return open(path, 'rb')
+
+def open_write(path, mode: str = 'wb', level: Optional[int] = None, threads: int = 0) -> BinaryIO:
+    # Compression is chosen by the file extension. `threads` only applies to
+    # zstd, which can compress on several cores.
+    compression = compression_for_name(path)
+    if compression == GZIP:
+        return gzip.open(path, mode, compresslevel=level if level is not None else DEFAULT_LEVELS[GZIP])
+    if compression == ZSTD:
+        _require_zstandard()
+        compressor = zstandard.ZstdCompressor(level=level if level is not None else DEFAULT_LEVELS[ZSTD], threads=threads)
+        return compressor.stream_writer(open(path, mode), closefd=True)
+    return open(path, mode)
@@ -3,59 +3,213 @@ import sys
 import os
 from dataclasses import dataclass
 from typing import Tuple, Optional
-from dset.operations import filter_operation, merge_operation, split_operation, ask_operation, assert_operation, generate_operation, batch_operation
+from dset.operations import filter_operation, merge_operation, split_operation, ask_operation, assert_operation, generate_operation, batch_operation, ingest_operation, index_operation, gather_operation, DEFAULT_ENTRIES_PER_REQUEST, DEFAULT_CONFIDENCE_THRESHOLD, DEFAULT_ENTRIES_PER_GENERATION, DEFAULT_REASONS_OUTPUT
+from dset.executor import DEFAULT_CONCURRENCY
+from dset.checkpoint import DEFAULT_CHECKPOINT_INTERVAL
+from dset.dataset import DEFAULT_WORKERS
+from dset.compression import COMPRESSION_CHOICES, NONE
+from dset.dedup import DEFAULT_MEMORY_BUDGET
+from dset.neardup import DEFAULT_THRESHOLD, DEFAULT_NUM_PERM, DEFAULT_SHINGLE_SIZE
+from dset.summarizer import SUMMARIZE_CHOICES, SUMMARIZE_NO
+from dset.predicate import Predicate, PredicateError
+from dset.cache import ResponseCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE, DEFAULT_MAX_AGE
+from dset.openai_api import OpenAIClient, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT
+from dset.pipeline import StepStreams
+from dset.sampling import DEFAULT_MAX_FAILURE_RATE, DEFAULT_CONFIDENCE
+from dset.ratelimit import RateLimiter, RetryPolicy, DEFAULT_MAX_RETRIES
+from dset.workqueue import parse_shard, DEFAULT_CHUNK_SIZE, DEFAULT_LEASE_TIMEOUT
 
 @dataclass
 class Config:
     args: argparse.Namespace
     smart_model: str
     fast_model: str
+    cache: Optional[ResponseCache] = None
+    client: Optional[OpenAIClient] = None
+    streams: Optional[StepStreams] = None  # In-memory inputs and outputs of a `batch` pipeline step
+
+    def __post_init__(self):
+        if self.client is None:
+            self.client = OpenAIClient.from_env(cache=self.cache)
+
+def where_expression(text: str) -> str:
+    # Checked up front so typos fail before any request is made; the
+    # expression itself stays a string so it can be saved in batch manifests.
+    try:
+        Predicate(text)
+    except PredicateError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+def shard_spec(text: str) -> str:
+    try:
+        parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+def add_llm_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--fields', default=None,
+                        help="Comma-separated fields to read and show the model, or 'auto' for the fields named in the prompt (default: all fields)")
+    parser.add_argument('--exclude-fields', default=None,
+                        help='Comma-separated fields to leave out of the prompt, e.g. ids or embeddings')
+    parser.add_argument('--strip-whitespace', action='store_true',
+                        help='Collapse runs of whitespace in string values shown to the model')
+    parser.add_argument('--max-value-tokens', type=int, default=None,
+                        help='Truncate string values shown to the model to this many tokens')
+    parser.add_argument('--token-report', action='store_true',
+                        help='Print the projected prompt tokens of the run and exit without calling the API')
+    parser.add_argument('--where', type=where_expression, default=None, metavar='EXPR',
+                        help="Only send entries matching this expression to the model, e.g. \"age >= 18 and has(email)\"")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'Maximum number of LLM requests to keep in flight (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--entries-per-request', type=int, default=DEFAULT_ENTRIES_PER_REQUEST,
+                        help=f'Number of entries to classify in a single LLM request (default: {DEFAULT_ENTRIES_PER_REQUEST})')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream single-entry answers and decide on the first line; filter stops generation there since it needs no reasons')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Answer with the fast model first and re-ask the smart model only for answers below --confidence-threshold')
+    parser.add_argument('--confidence-threshold', type=float, default=DEFAULT_CONFIDENCE_THRESHOLD,
+                        help=f'Lowest fast-model confidence accepted without escalating in --cascade mode (default: {DEFAULT_CONFIDENCE_THRESHOLD})')
+    parser.add_argument('--checkpoint-interval', type=int, default=DEFAULT_CHECKPOINT_INTERVAL,
+                        help=f'Number of entries between progress checkpoints, 0 to disable (default: {DEFAULT_CHECKPOINT_INTERVAL})')
+    parser.add_argument('--resume', action='store_true', help='Resume an interrupted run from its last checkpoint')
+    parser.add_argument('--shard', type=shard_spec, default=None, metavar='I/N',
+                        help='Process only the I-th of N contiguous parts of the input, counting from 0; outputs get a .shard-I-of-N suffix')
+    parser.add_argument('--work-dir', default=None, metavar='DIR',
+                        help='Claim input chunks from a work queue in this shared directory instead of processing the whole input; see `dset gather`')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Entries per work queue chunk (default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--lease-timeout', type=float, default=DEFAULT_LEASE_TIMEOUT,
+                        help=f'Seconds before the chunk of an unresponsive worker is taken over (default: {DEFAULT_LEASE_TIMEOUT:g})')
+    add_batch_export_argument(parser)
+
+def add_reader_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Number of processes used to read and parse input files (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--unordered', action='store_true',
+                        help='With --workers, emit entries as soon as each part of the input is parsed instead of in input order')
+
+def add_batch_export_argument(parser: argparse.ArgumentParser):
+    parser.add_argument('--batch-export', metavar='REQUESTS_FILE',
+                        help='Write the LLM requests to an OpenAI Batch API input file instead of calling the API; complete the run later with `dset ingest`')
 
 def build_config() -> Tuple[bool, Optional[Config]]:
     parser = argparse.ArgumentParser(description="DSET: Dataset Processing Operations")
     parser.add_argument('--version', action='version', version='%(prog)s 0.1.0')
+    parser.add_argument('--cache-dir', default=str(DEFAULT_CACHE_DIR), help=f'Directory for the LLM response cache (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the LLM response cache')
+    parser.add_argument('--cache-max-size', type=int, default=DEFAULT_MAX_SIZE // (1024 * 1024), help='Maximum size of the response cache in MiB (default: %(default)s)')
+    parser.add_argument('--cache-max-age', type=float, default=DEFAULT_MAX_AGE / (24 * 60 * 60), help='Maximum age of cached responses in days (default: %(default)s)')
+    parser.add_argument('--base-url', default=None, help='Base URL of the OpenAI-compatible API (default: $OPENAI_BASE_URL or the OpenAI API)')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE, help='Maximum number of pooled HTTP connections (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='HTTP request timeout in seconds (default: %(default)s)')
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES, help='Retries for rate-limited, failed or dropped requests before giving up (default: %(default)s)')
+    parser.add_argument('--requests-per-minute', type=int, default=None, help="Request budget shared by all workers (default: learned from the API's rate-limit headers)")
+    parser.add_argument('--tokens-per-minute', type=int, default=None, help="Token budget shared by all workers (default: learned from the API's rate-limit headers)")
+
+    parser.add_argument('--compression', choices=COMPRESSION_CHOICES, default=NONE,
+                        help='Compression for output files named by dset, e.g. filtered.jsonl.gz (default: %(default)s); explicit output file names are compressed according to their .gz/.zst extension')
+    parser.add_argument('--compression-level', type=int, default=None, help='Compression level for gzip/zstd outputs')
+    parser.add_argument('--compression-threads', type=int, default=0, help='Number of threads for zstd compression (default: %(default)s)')
 
     subparsers = parser.add_subparsers(dest='operation', help='Operation to perform on the dataset', required=True)
 
     # Filter subcommand
     filter_parser = subparsers.add_parser('filter', help='Filter the dataset and create a new dataset')
-    filter_parser.add_argument('input', help='Input dataset file or directory')
-    filter_parser.add_argument('output', help='Output dataset file or directory')
+    filter_parser.add_argument('input_path', metavar='input', help='Input dataset file or directory')
+    filter_parser.add_argument('output_path', metavar='output', help='Output dataset file or directory')
     filter_parser.add_argument('raw_user_prompt', help='Raw user prompt for filtering entries')
+    add_llm_arguments(filter_parser)
     filter_parser.set_defaults(func=filter_operation)
 
     # Merge subcommand
     merge_parser = subparsers.add_parser('merge', help='Merge datasets into a new dataset')
-    merge_parser.add_argument('input', help='Input dataset files or directories (comma-separated)')
-    merge_parser.add_argument('output', help='Output dataset file or directory')
+    merge_parser.add_argument('input_path', metavar='input', help='Input dataset files or directories (comma-separated)')
+    merge_parser.add_argument('output_path', metavar='output', help='Output dataset file or directory')
+    merge_parser.add_argument('--dedup-memory', type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+                              help='Memory budget in MiB for duplicate detection before spilling to disk (default: %(default)s)')
+    merge_parser.add_argument('--spill-dir', default=None, help='Directory for the on-disk duplicate index (default: system temp directory)')
+    merge_parser.add_argument('--bloom', action='store_true', help='Check a Bloom filter before looking up spilled entries on disk')
+    merge_parser.add_argument('--near-dup', action='store_true', help='Also drop near-duplicate entries using MinHash LSH')
+    merge_parser.add_argument('--near-dup-fields', default=None, help='Comma-separated fields to compare for near-duplicates (default: all fields)')
+    merge_parser.add_argument('--near-dup-threshold', type=float, default=DEFAULT_THRESHOLD,
+                              help='Estimated Jaccard similarity above which entries are near-duplicates (default: %(default)s)')
+    merge_parser.add_argument('--num-perm', type=int, default=DEFAULT_NUM_PERM, help='Number of MinHash permutations (default: %(default)s)')
+    merge_parser.add_argument('--shingle-size', type=int, default=DEFAULT_SHINGLE_SIZE, help='Number of words per shingle (default: %(default)s)')
+    add_reader_arguments(merge_parser)
     merge_parser.set_defaults(func=merge_operation)
 
     # Split subcommand
     split_parser = subparsers.add_parser('split', help='Split a dataset into multiple new datasets based on maximum size')
-    split_parser.add_argument('input', help='Input dataset file or directory')
-    split_parser.add_argument('output', help='Output dataset files or directory prefix')
-    split_parser.add_argument('max_size', type=int, help='Maximum size of each split file in bytes')
+    split_parser.add_argument('input_path', metavar='input', help='Input dataset file or directory')
+    split_parser.add_argument('output_path', metavar='output', help='Output dataset files or directory prefix')
+    split_parser.add_argument('max_size', type=int, nargs='?', default=None, help='Maximum size of each split file in bytes')
+    split_parser.add_argument('--max-lines', type=int, default=None, help='Split into files of at most this many lines instead')
+    split_parser.add_argument('--shards', type=int, default=None, help='Split into this many files of roughly equal size instead')
+    split_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                              help=f'Number of output files to write concurrently (default: {DEFAULT_WORKERS})')
     split_parser.set_defaults(func=split_operation)
 
     # Ask subcommand
     ask_parser = subparsers.add_parser('ask', help='Ask a question about the dataset')
-    ask_parser.add_argument('input', help='Input dataset file or directory')
+    ask_parser.add_argument('input_path', metavar='input', help='Input dataset file or directory')
     ask_parser.add_argument('raw_user_prompt', metavar='user_prompt', help='Question to ask about the dataset')
+    ask_parser.add_argument('--reasons-output', default=DEFAULT_REASONS_OUTPUT, help=f'File to write per-entry answers and reasons to (default: {DEFAULT_REASONS_OUTPUT})')
+    ask_parser.add_argument('--summarize', choices=SUMMARIZE_CHOICES, default=SUMMARIZE_NO,
+                             help='Which reasons to summarize: all answers, only "no" answers, or none (default: %(default)s)')
+    add_llm_arguments(ask_parser)
     ask_parser.set_defaults(func=ask_operation)
 
     # Assert subcommand
     assert_parser = subparsers.add_parser('assert', help='Assert a condition about the dataset')
-    assert_parser.add_argument('input', help='Input dataset file or directory')
+    assert_parser.add_argument('input_path', metavar='input', help='Input dataset file or directory')
     assert_parser.add_argument('raw_user_prompt', metavar='user_prompt', help='Condition to assert about the dataset')
+    assert_parser.add_argument('--reasons-output', default=DEFAULT_REASONS_OUTPUT, help=f'File to write per-entry answers and reasons to (default: {DEFAULT_REASONS_OUTPUT})')
+    assert_parser.add_argument('--summarize', choices=SUMMARIZE_CHOICES, default=SUMMARIZE_NO,
+                             help='Which reasons to summarize: all answers, only "no" answers, or none (default: %(default)s)')
+    assert_parser.add_argument('--fail-fast', action='store_true', help='Stop at the first entry the condition is not true for')
+    assert_parser.add_argument('--sample', type=int, default=None, metavar='N',
+                               help='Check at most N randomly sampled entries, stopping once the failure rate is bounded')
+    assert_parser.add_argument('--stratify', default=None, metavar='FIELD',
+                               help='With --sample, sample every value of FIELD in proportion to its frequency')
+    assert_parser.add_argument('--max-failure-rate', type=float, default=DEFAULT_MAX_FAILURE_RATE,
+                               help='With --sample, the largest share of failing entries that still passes (default: %(default)s)')
+    assert_parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE,
+                               help='With --sample, the confidence level of the decision (default: %(default)s)')
+    assert_parser.add_argument('--seed', type=int, default=None, help='Random seed for --sample')
+    add_llm_arguments(assert_parser)
     assert_parser.set_defaults(func=assert_operation)
 
     # Generate subcommand
     gen_parser = subparsers.add_parser('gen', help='Generate a dataset of jsonl entries')
-    gen_parser.add_argument('output', help='Output dataset file')
+    gen_parser.add_argument('output_path', metavar='output', help='Output dataset file')
     gen_parser.add_argument('raw_user_prompt', metavar='user_prompt', help='Prompt for generating entries')
     gen_parser.add_argument('num_entries', type=int, help='Number of entries to generate')
+    gen_parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                            help=f'Maximum number of LLM requests to keep in flight (default: {DEFAULT_CONCURRENCY})')
+    gen_parser.add_argument('--entries-per-request', type=int, default=DEFAULT_ENTRIES_PER_GENERATION,
+                            help=f'Number of entries to generate in a single LLM request (default: {DEFAULT_ENTRIES_PER_GENERATION})')
+    add_batch_export_argument(gen_parser)
     gen_parser.set_defaults(func=generate_operation)
 
+    # Index subcommand
+    index_parser = subparsers.add_parser('index', help='Build the .idx line-offset sidecars of a JSONL dataset')
+    index_parser.add_argument('input_path', metavar='input', help='Input dataset file or directory')
+    index_parser.set_defaults(func=index_operation)
+
+    # Gather subcommand
+    gather_parser = subparsers.add_parser('gather', help='Merge the outputs of --shard runs or a --work-dir queue in input order')
+    gather_parser.add_argument('source', help='Work queue directory, or the output path the shards were written for')
+    gather_parser.add_argument('output_path', metavar='output', help='Output dataset file')
+    gather_parser.set_defaults(func=gather_operation)
+
+    # Ingest subcommand
+    ingest_parser = subparsers.add_parser('ingest', help='Complete an operation exported with --batch-export from a Batch API results file')
+    ingest_parser.add_argument('requests_file', help='Batch requests file written by --batch-export')
+    ingest_parser.add_argument('results_file', help='Batch API output file')
+    ingest_parser.set_defaults(func=ingest_operation)
+
     # Batch subcommand
     batch_parser = subparsers.add_parser('batch', help='Execute a batch of operations from a YAML file')
     batch_parser.add_argument('yaml_file', help='YAML file containing batch operations')
@@ -70,7 +224,25 @@ def build_config() -> Tuple[bool, Optional[Config]]:
         args = parser.parse_args()
         smart_model = os.environ.get("OPENAI_SMART_MODEL", "gpt-4")
         fast_model = os.environ.get("OPENAI_FAST_MODEL", "gpt-3.5-turbo")
-        return True, Config(args=args, smart_model=smart_model, fast_model=fast_model)
+        cache = None
+        if not args.no_cache:
+            cache = ResponseCache(
+                args.cache_dir,
+                max_size=args.cache_max_size * 1024 * 1024,
+                max_age=args.cache_max_age * 24 * 60 * 60
+            )
+        client_options = {}
+        if args.base_url:
+            client_options['base_url'] = args.base_url
+        client = OpenAIClient.from_env(
+            pool_size=max(args.pool_size, getattr(args, 'concurrency', DEFAULT_CONCURRENCY)),
+            timeout=args.timeout,
+            cache=cache,
+            rate_limiter=RateLimiter(args.requests_per_minute, args.tokens_per_minute),
+            retry_policy=RetryPolicy(max_retries=args.max_retries),
+            **client_options
+        )
+        return True, Config(args=args, smart_model=smart_model, fast_model=fast_model, cache=cache, client=client)
     except SystemExit:
         # This catches the SystemExit raised by argparse when --help or --version is used
         return False, None
@@ -1,71 +1,315 @@
-import json
+import os
+import sys
+import bisect
+import random
+import itertools
 from pathlib import Path
-from typing import Any, Dict, Iterator, Callable
+from typing import Any, BinaryIO, Dict, Iterator, Callable, List, NamedTuple, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from dset import codec, compression, parquet
+from dset.index import LineIndex
+from dset.executor import DEFAULT_CONCURRENCY, map_ordered, map_unordered
+
+Position = Tuple[str, int]  # (file path, byte offset of the next unread line)
+
+DEFAULT_WORKERS = 1
+RANGE_SIZE = 8 * 1024 * 1024  # Bytes of input handed to a reader process at a time
+
+class Record(NamedTuple):
+    path: str
+    offset: int  # Byte offset just past this entry's line
+    entry: Dict[str, Any]
+    line: Optional[bytes]  # The line exactly as read, so unmodified entries can be written back without re-encoding
+    source: Any = None  # (record batch, row index) for rows of columnar files, which have no line
+
+def _project(entry: Dict[str, Any], columns: Optional[List[str]]) -> Dict[str, Any]:
+    if columns is None:
+        return entry
+    return {column: entry[column] for column in columns if column in entry}
+
+def _full_entry(record: Record) -> Dict[str, Any]:
+    if record.source is not None:
+        batch, index = record.source
+        return batch.slice(index, 1).to_pylist()[0]
+    if record.line is not None:
+        return codec.loads(record.line)
+    return record.entry
+
+def _read_range(task: Tuple[str, int, int, Optional[List[str]]]) -> List[Record]:
+    # A line belongs to the range that contains its first byte, so every
+    # range starts reading after the first newline at or past `start - 1`.
+    # Compressed and Parquet files are always read whole, as a single range.
+    file_path, start, end, columns = task
+    if parquet.is_parquet(file_path):
+        return [Record(file_path, row, entry, None, (batch, index))
+                for row, entry, batch, index in parquet.read_rows(file_path, columns)]
+
+    records = []
+    with compression.open_read(file_path) as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        offset = f.tell()
+        while offset < end:
+            line = f.readline()
+            if not line:
+                break
+            offset += len(line)
+            records.append(Record(file_path, offset, _project(codec.loads(line), columns), line))
+    return records
 
 class ReadableDataSet:
-    def __init__(self, path):
+    def __init__(self, path, workers: int = DEFAULT_WORKERS, ordered: bool = True, columns: Optional[List[str]] = None,
+                 keep_index: bool = False):
         self.path = Path(path)
+        self.workers = workers
+        self.ordered = ordered
+        # Fields to materialize in each record's entry; None means all of them
+        self.columns = columns
+        # Whether to write the line indexes to .idx sidecars next to the files
+        self.keep_index = keep_index
+        self._indexes = None
+        self._starts = None
 
-    def process(self, processor: Callable[[Dict[str, Any]], Any]) -> Iterator[Any]:
-        if self.path.is_dir():
-            yield from self._process_directory(processor)
+    def __bool__(self) -> bool:
+        # Datasets have a length, but an empty one is still a dataset
+        return True
+
+    def indexable(self) -> bool:
+        return all(not compression.detect(path) and not parquet.is_parquet(path) for path in self.files())
+
+    def _line_indexes(self) -> List[LineIndex]:
+        # Built in memory (or loaded from existing .idx sidecars) on first
+        # use; only plain JSONL files have stable line offsets.
+        if self._indexes is None:
+            if not self.indexable():
+                raise ValueError(f"Only uncompressed JSONL datasets can be indexed: {self.path}")
+            self._indexes = [LineIndex.load(path, self.keep_index) for path in self.files()]
+            self._starts = list(itertools.accumulate((len(index) for index in self._indexes), initial=0))
+        return self._indexes
+
+    def __len__(self) -> int:
+        self._line_indexes()
+        return self._starts[-1]
+
+    def record_at(self, position: int, handles: Optional[Dict[Path, BinaryIO]] = None) -> Record:
+        # `handles` keeps files open across calls that read many lines
+        indexes = self._line_indexes()
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("dataset index out of range")
+        file_number = bisect.bisect_right(self._starts, position) - 1
+        index = indexes[file_number]
+        start, end = index.span(position - self._starts[file_number])
+        if handles is None:
+            with open(index.path, 'rb') as f:
+                line = os.pread(f.fileno(), end - start, start)
         else:
-            yield from self._process_file(processor)
+            if index.path not in handles:
+                handles[index.path] = open(index.path, 'rb')
+            line = os.pread(handles[index.path].fileno(), end - start, start)
+        return Record(str(index.path), end, _project(codec.loads(line), self.columns), line)
+
+    def line_number(self, position: Position) -> int:
+        # The index of the line a `records(start=position)` call resumes at
+        indexes = self._line_indexes()
+        path, offset = position
+        for file_number, index in enumerate(indexes):
+            if str(index.path) == str(path):
+                return self._starts[file_number] + bisect.bisect_left(index.offsets, offset)
+        raise ValueError(f"{path} is not part of {self.path}")
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [record.entry for record in self.slice(*key.indices(len(self)))]
+        return self.record_at(key).entry
+
+    def slice(self, start: int, stop: int, step: int = 1) -> Iterator[Record]:
+        # Contiguous slices are read sequentially from the first line's offset
+        if step != 1:
+            for position in range(start, stop, step):
+                yield self.record_at(position)
+            return
+        if start >= stop:
+            return
+        first = self.record_at(start)
+        yield first
+        remaining = stop - start - 1
+        for record in self.records(start=(first.path, first.offset)):
+            if remaining <= 0:
+                return
+            yield record
+            remaining -= 1
 
-    def _process_directory(self, processor: Callable[[Dict[str, Any]], Any]) -> Iterator[Any]:
-        for file_path in self.path.glob('*.jsonl'):
-            yield from self._process_file(processor, file_path)
+    def shard(self, number: int, count: int) -> Iterator[Record]:
+        # The `number`th of `count` contiguous, nearly equal parts
+        total = len(self)
+        return self.slice(total * number // count, total * (number + 1) // count)
 
-    def _process_file(self, processor: Callable[[Dict[str, Any]], Any], file_path=None) -> Iterator[Any]:
-        path = file_path or self.path
-        with open(path, 'r') as f:
+    def sample(self, size: int, rng: Optional[random.Random] = None) -> List[Record]:
+        # A uniform random sample without replacement, read in file order
+        positions = sorted((rng or random).sample(range(len(self)), min(size, len(self))))
+        handles: Dict[Path, BinaryIO] = {}
+        try:
+            return [self.record_at(position, handles) for position in positions]
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+    def process(self, processor: Callable[[Dict[str, Any]], Any], concurrency: int = DEFAULT_CONCURRENCY) -> Iterator[Any]:
+        yield from map_ordered(processor, self.entries(), concurrency)
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        for record in self.records():
+            yield record.entry
+
+    def files(self) -> List[Path]:
+        if self.path.is_dir():
+            patterns = compression.DATASET_PATTERNS + [f'*{parquet.SUFFIX}']
+            return sorted(path for pattern in patterns for path in self.path.glob(pattern))
+        return [self.path]
+
+    def field_names(self) -> List[str]:
+        for file_path in self.files():
+            if parquet.is_parquet(file_path):
+                return parquet.field_names(file_path)
+            for record in self._process_file(file_path):
+                return list(record.entry.keys())
+        return []
+
+    def records(self, start: Optional[Position] = None) -> Iterator[Record]:
+        if self.workers > 1 and start is None:
+            yield from self._parallel_records()
+            return
+
+        files = self.files()
+        if start is not None:
+            start_file, start_offset = start
+            # Skip files that were completely processed before `start`
+            paths = [str(path) for path in files]
+            if start_file in paths:
+                files = files[paths.index(start_file):]
+        for file_path in files:
+            offset = start_offset if start is not None and str(file_path) == start_file else 0
+            yield from self._process_file(file_path, offset)
+
+    def _ranges(self) -> Iterator[Tuple[str, int, int, Optional[List[str]]]]:
+        for file_path in self.files():
+            if parquet.is_parquet(file_path) or compression.detect(file_path):
+                yield str(file_path), 0, sys.maxsize, self.columns
+                continue
+            size = file_path.stat().st_size
+            for start in range(0, size, RANGE_SIZE):
+                yield str(file_path), start, min(start + RANGE_SIZE, size), self.columns
+
+    def _parallel_records(self) -> Iterator[Record]:
+        # Fan files, and byte ranges of large files, out to a process pool so
+        # JSON parsing uses every core. Unordered mode yields whichever range
+        # finishes first.
+        map_ranges = map_ordered if self.ordered else map_unordered
+        for records in map_ranges(_read_range, self._ranges(), self.workers, ProcessPoolExecutor):
+            yield from records
+
+    def _process_file(self, file_path, offset: int = 0) -> Iterator[Record]:
+        # Offsets count decompressed bytes for compressed files and rows for
+        # Parquet files
+        if parquet.is_parquet(file_path):
+            for row, entry, batch, index in parquet.read_rows(file_path, self.columns, skip=offset):
+                yield Record(str(file_path), row, entry, None, (batch, index))
+            return
+
+        with compression.open_read(file_path) as f:
+            if offset and f.seekable():
+                f.seek(offset)
+            elif offset:
+                # Decompressing streams can't seek, so read up to the offset
+                remaining = offset
+                while remaining > 0:
+                    skipped = len(f.read(min(remaining, RANGE_SIZE)))
+                    if not skipped:
+                        break
+                    remaining -= skipped
             for line in f:
-                entry = json.loads(line)
-                yield processor(entry)
+                offset += len(line)
+                yield Record(str(file_path), offset, _project(codec.loads(line), self.columns), line)
 
 class WriteableDataSet(ReadableDataSet):
-    def __init__(self, path):
+    def __init__(self, path, resume_at: Optional[int] = None, level: Optional[int] = None, threads: int = 0):
         super().__init__(path)
+        self.resume_at = resume_at
+        self.level = level
+        self.threads = threads
         self.file = None
+        self.sink = None
+
+    @property
+    def compressed(self) -> bool:
+        return compression.compression_for_name(self.path) is not None
+
+    @property
+    def columnar(self) -> bool:
+        return self.path.suffix == parquet.SUFFIX
 
     def __enter__(self):
-        self.file = open(self.path, 'w')
+        if self.columnar:
+            if self.resume_at is not None:
+                raise ValueError("Cannot resume writing into a Parquet dataset")
+            self.sink = parquet.ParquetSink(self.path)
+        elif self.resume_at is None:
+            self.file = compression.open_write(self.path, 'wb', self.level, self.threads)
+        else:
+            if self.compressed:
+                raise ValueError("Cannot resume writing into a compressed dataset")
+            # Drop anything written after the last checkpoint, then carry on from there
+            size = os.path.getsize(self.path)
+            if self.resume_at > size:
+                raise ValueError(f"Cannot resume {self.path} at byte {self.resume_at}, it only has {size} bytes")
+            os.truncate(self.path, self.resume_at)
+            self.file = open(self.path, 'ab')
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.sink:
+            self.sink.close()
         if self.file:
             self.file.close()
 
-    def write(self, entry: Dict[str, Any]):
-        if not self.file:
+    def _check_open(self):
+        if not self.file and not self.sink:
             raise RuntimeError("WriteableDataSet must be used as a context manager")
-        json.dump(entry, self.file)
-        self.file.write('\n')
 
-    def split(self, output_prefix, max_size):
-        if self.path.is_dir():
-            for file_path in self.path.glob('*.jsonl'):
-                self._split_file(file_path, output_prefix, max_size)
+    def write(self, entry: Dict[str, Any]):
+        self._check_open()
+        if self.sink:
+            self.sink.write_entry(entry)
+            return
+        self.file.write(codec.dumps(entry))
+        self.file.write(b'\n')
+
+    def write_raw(self, line: bytes):
+        self._check_open()
+        if self.sink:
+            self.sink.write_entry(codec.loads(line))
+            return
+        self.file.write(line)
+        if not line.endswith(b'\n'):
+            self.file.write(b'\n')
+
+    def write_record(self, record: Record):
+        # Writes the whole input row, even if the record's entry was projected
+        # to a few columns, copying it in its original form where possible.
+        self._check_open()
+        if self.sink and record.source is not None:
+            self.sink.write_slice(*record.source)
+        elif not self.sink and record.line is not None:
+            self.write_raw(record.line)
         else:
-            self._split_file(self.path, output_prefix, max_size)
-
-    def _split_file(self, file_path, output_prefix, max_size):
-        file_size = 0
-        file_count = 1
-        current_output = None
-
-        with open(file_path, 'r') as input_file:
-            for line in input_file:
-                if file_size == 0 or file_size >= max_size:
-                    if current_output:
-                        current_output.close()
-                    output_path = f"{output_prefix}_{file_count}.jsonl"
-                    current_output = open(output_path, 'w')
-                    file_size = 0
-                    file_count += 1
-
-                current_output.write(line)
-                file_size += len(line)
-
-        if current_output:
-            current_output.close()
+            self.write(_full_entry(record))
+
+    def sync(self) -> int:
+        if not self.file:
+            raise RuntimeError("Only plain JSONL datasets can be synced")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
@@ -0,0 +1,154 @@
+import hashlib
+import shutil
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024  # bytes
+HASH_SIZE = 16  # 128-bit digests make accidental collisions negligible
+BYTES_PER_HASH = 100  # Approximate cost of one digest in a Python set, object overhead included
+BLOOM_HASHES = 7
+BLOOM_SHARE = 4  # The Bloom filter gets 1/BLOOM_SHARE of the memory budget
+
+def digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).digest()
+
+class BloomFilter:
+    def __init__(self, size_bytes: int, hashes: int = BLOOM_HASHES):
+        self.bits = bytearray(max(size_bytes, 1))
+        self.size = len(self.bits) * 8
+        self.hashes = hashes
+
+    def _positions(self, key: bytes):
+        # Double hashing over the two halves of an already uniform digest
+        h1 = int.from_bytes(key[:8], 'little')
+        h2 = int.from_bytes(key[8:16], 'little') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: bytes):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class Deduplicator:
+    # Remembers 128-bit digests of everything it has seen. Digests live in
+    # an in-memory set until that outgrows the memory budget, then get
+    # spilled to an on-disk SQLite index. An optional Bloom filter answers
+    # "definitely new" without touching the disk once anything has spilled.
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET, spill_dir=None, bloom: bool = False):
+        self.memory_budget = memory_budget
+        self.bloom = BloomFilter(memory_budget // BLOOM_SHARE) if bloom else None
+        set_budget = memory_budget - (memory_budget // BLOOM_SHARE if bloom else 0)
+        self.max_in_memory = max(set_budget // BYTES_PER_HASH, 1)
+        self.spill_parent = spill_dir
+        self.spill_dir: Optional[Path] = None
+        self.index: Optional[sqlite3.Connection] = None
+        self.recent = set()
+        self.spilled = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _seen(self, key: bytes) -> bool:
+        if key in self.recent:
+            return True
+        if self.index is not None and (self.bloom is None or key in self.bloom):
+            return self.index.execute("SELECT 1 FROM hashes WHERE hash = ?", (key,)).fetchone() is not None
+        return False
+
+    def __contains__(self, data: bytes) -> bool:
+        return self._seen(digest(data))
+
+    def add(self, data: bytes) -> bool:
+        # Returns True if `data` has not been seen before
+        key = digest(data)
+        if self._seen(key):
+            return False
+
+        self.recent.add(key)
+        if self.bloom is not None:
+            self.bloom.add(key)
+        if len(self.recent) >= self.max_in_memory:
+            self._spill()
+        return True
+
+    def _spill(self):
+        if self.index is None:
+            self.spill_dir = Path(tempfile.mkdtemp(prefix="dset-dedup-", dir=self.spill_parent))
+            self.index = sqlite3.connect(str(self.spill_dir / "hashes.sqlite3"))
+            self.index.execute("PRAGMA journal_mode=OFF")
+            self.index.execute("PRAGMA synchronous=OFF")
+            self.index.execute("CREATE TABLE hashes (hash BLOB PRIMARY KEY) WITHOUT ROWID")
+        self.index.executemany("INSERT OR IGNORE INTO hashes (hash) VALUES (?)", ((key,) for key in self.recent))
+        self.index.commit()
+        self.spilled += len(self.recent)
+        self.recent.clear()
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+class SpillableMap:
+    # A bytes-to-bytes map with the same memory budget and SQLite spill as
+    # Deduplicator, for indexes that need a value per key.
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET, bytes_per_item: int = BYTES_PER_HASH, spill_dir=None):
+        self.max_in_memory = max(memory_budget // bytes_per_item, 1)
+        self.spill_parent = spill_dir
+        self.spill_dir: Optional[Path] = None
+        self.index: Optional[sqlite3.Connection] = None
+        self.recent = {}
+        self.spilled = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        value = self.recent.get(key)
+        if value is None and self.index is not None:
+            row = self.index.execute("SELECT value FROM items WHERE key = ?", (key,)).fetchone()
+            value = row[0] if row else None
+        return value
+
+    def setdefault(self, key: bytes, value: bytes) -> bytes:
+        # Stores `value` unless `key` is already present; returns the stored value
+        existing = self.get(key)
+        if existing is not None:
+            return existing
+        self.recent[key] = value
+        if len(self.recent) >= self.max_in_memory:
+            self._spill()
+        return value
+
+    def _spill(self):
+        if self.index is None:
+            self.spill_dir = Path(tempfile.mkdtemp(prefix="dset-dedup-", dir=self.spill_parent))
+            self.index = sqlite3.connect(str(self.spill_dir / "items.sqlite3"))
+            self.index.execute("PRAGMA journal_mode=OFF")
+            self.index.execute("PRAGMA synchronous=OFF")
+            self.index.execute("CREATE TABLE items (key BLOB PRIMARY KEY, value BLOB) WITHOUT ROWID")
+        self.index.executemany("INSERT OR IGNORE INTO items (key, value) VALUES (?, ?)", self.recent.items())
+        self.index.commit()
+        self.spilled += len(self.recent)
+        self.recent.clear()
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
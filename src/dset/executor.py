@@ -0,0 +1,69 @@
+from collections import deque
+from concurrent.futures import Executor, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, List, Type
+
+DEFAULT_CONCURRENCY = 1
+
+def map_ordered(func: Callable[[Any], Any], items: Iterable[Any], concurrency: int = DEFAULT_CONCURRENCY,
+                executor_class: Type[Executor] = ThreadPoolExecutor) -> Iterator[Any]:
+    # Keeps up to `concurrency` calls in flight on a thread pool and yields
+    # their results in input order. A small backlog of already-submitted work
+    # beyond the worker count keeps the pool busy while the head of the queue
+    # is still outstanding.
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    max_pending = concurrency * 2
+    pending = deque()
+
+    with executor_class(max_workers=concurrency) as executor:
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def map_unordered(func: Callable[[Any], Any], items: Iterable[Any], concurrency: int = DEFAULT_CONCURRENCY,
+                  executor_class: Type[Executor] = ThreadPoolExecutor) -> Iterator[Any]:
+    # Like map_ordered, but yields each result as soon as it is ready.
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    max_pending = concurrency * 2
+    pending = set()
+
+    with executor_class(max_workers=concurrency) as executor:
+        try:
+            for item in items:
+                pending.add(executor.submit(func, item))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
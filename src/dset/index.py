@@ -0,0 +1,104 @@
+import os
+import mmap
+import struct
+from array import array
+from pathlib import Path
+from typing import Tuple
+
+# Optional: NumPy finds newlines a chunk at a time instead of line by line,
+# and maps large indexes instead of reading them into memory
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SUFFIX = '.idx'
+MAGIC = b'DSETIDX1'
+HEADER = struct.Struct('<8sQqQ')  # magic, file size, file mtime in ns, number of lines
+SCAN_CHUNK = 64 * 1024 * 1024  # Bytes scanned for newlines at a time
+
+def index_path(path) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + SUFFIX)
+
+def _scan(path: Path, size: int):
+    # Start offsets of every line, followed by the file size, so line i is
+    # the bytes between offsets i and i + 1
+    if size == 0:
+        return np.zeros(1, dtype=np.uint64) if np is not None else array('Q', [0])
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if np is not None:
+            parts = [np.zeros(1, dtype=np.uint64)]
+            for start in range(0, size, SCAN_CHUNK):
+                chunk = np.frombuffer(data, dtype=np.uint8, count=min(SCAN_CHUNK, size - start), offset=start)
+                parts.append(np.flatnonzero(chunk == 0x0A).astype(np.uint64) + np.uint64(start + 1))
+                del chunk  # The map can't close while a view of it exists
+            offsets = np.concatenate(parts)
+            if offsets[-1] != size:
+                offsets = np.append(offsets, np.uint64(size))
+            return offsets
+
+        offsets = array('Q', [0])
+        position = data.find(b'\n')
+        while position != -1:
+            offsets.append(position + 1)
+            position = data.find(b'\n', position + 1)
+        if offsets[-1] != size:
+            offsets.append(size)
+        return offsets
+
+class LineIndex:
+    # Byte offsets of the lines of one JSONL file, optionally kept in a
+    # `<file>.idx` sidecar. The sidecar records the file's size and mtime and
+    # is ignored (or rebuilt) whenever either changes.
+    def __init__(self, path, offsets):
+        self.path = Path(path)
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def span(self, line: int) -> Tuple[int, int]:
+        return int(self.offsets[line]), int(self.offsets[line + 1])
+
+    @classmethod
+    def load(cls, path, persist: bool = False) -> 'LineIndex':
+        # Uses an up-to-date sidecar if there is one; otherwise scans the
+        # file, writing a new sidecar only if `persist` is set
+        path = Path(path)
+        stat = path.stat()
+        sidecar = index_path(path)
+        try:
+            with open(sidecar, 'rb') as f:
+                magic, size, mtime, count = HEADER.unpack(f.read(HEADER.size))
+                if magic == MAGIC and size == stat.st_size and mtime == stat.st_mtime_ns:
+                    if np is not None:
+                        return cls(path, np.memmap(sidecar, dtype='<u8', mode='r', offset=HEADER.size, shape=(count + 1,)))
+                    offsets = array('Q')
+                    offsets.frombytes(f.read(8 * (count + 1)))
+                    if len(offsets) == count + 1:
+                        return cls(path, offsets)
+        except (OSError, struct.error, ValueError):
+            pass
+        return cls.build(path, persist)
+
+    @classmethod
+    def build(cls, path, persist: bool = False) -> 'LineIndex':
+        path = Path(path)
+        stat = path.stat()
+        offsets = _scan(path, stat.st_size)
+        index = cls(path, offsets)
+        if not persist:
+            return index
+
+        sidecar = index_path(path)
+        temporary = sidecar.with_name(sidecar.name + '.tmp')
+        try:
+            with open(temporary, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, len(index)))
+                f.write(offsets.astype('<u8').tobytes() if np is not None else offsets.tobytes())
+            os.replace(temporary, sidecar)
+        except OSError:
+            # A read-only location just means the index isn't kept
+            pass
+        return index
@@ -0,0 +1,259 @@
+import re
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# A local OpenAI-compatible chat completions server for benchmarks and tests.
+# It answers every request shape dset sends (plain yes/no questions, batched
+# and confidence-scored answers, batched generation, streaming) after a
+# configurable delay, and fails a configurable share of requests with 500s
+# and 429s, so throughput can be measured end to end without an API key.
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+DEFAULT_LATENCY = 0.05  # Mean seconds before a response starts
+DEFAULT_LATENCY_DISTRIBUTION = 'lognormal'
+DEFAULT_LATENCY_SIGMA = 0.5  # Spread of the lognormal distribution
+DEFAULT_YES_RATE = 0.5  # Share of entries answered yes
+DEFAULT_RETRY_AFTER = 0.1  # Seconds sent in Retry-After with each 429
+DEFAULT_STREAM_CHUNK = 8  # Characters per streamed delta
+DEFAULT_STREAM_DELAY = 0.002  # Seconds between streamed deltas
+
+BATCH_ENTRY = re.compile(r'^\{"id":(\d+),"entry":', re.MULTILINE)
+GENERATE_COUNT = re.compile(r'Generate (\d+) different entries')
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    # Nearest-rank percentile of `values`
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(math.ceil(fraction * len(ordered)) - 1, 0))]
+
+class MockServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = DEFAULT_LATENCY,
+                 distribution: str = DEFAULT_LATENCY_DISTRIBUTION, sigma: float = DEFAULT_LATENCY_SIGMA,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = DEFAULT_RETRY_AFTER,
+                 yes_rate: float = DEFAULT_YES_RATE, stream_chunk: int = DEFAULT_STREAM_CHUNK,
+                 stream_delay: float = DEFAULT_STREAM_DELAY, seed: Optional[int] = None):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {distribution!r}")
+        self.latency = latency
+        self.distribution = distribution
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.yes_rate = yes_rate
+        self.stream_chunk = max(stream_chunk, 1)
+        self.stream_delay = stream_delay
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+            # Headers and body go out in separate writes, which Nagle's
+            # algorithm would hold back for the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client hung up between requests
+
+            def do_POST(self):
+                started = time.monotonic()
+                data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if not self.path.endswith('/chat/completions'):
+                    self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                status, delay = server._draw()
+                time.sleep(delay)
+                try:
+                    if status == 429:
+                        self.send_json(429, {"error": {"message": "Rate limit reached"}}, {"Retry-After": f"{server.retry_after:g}"})
+                    elif status != 200:
+                        self.send_json(status, {"error": {"message": "Mock server error"}})
+                    elif data.get("stream"):
+                        self.send_stream(server.reply(data))
+                    else:
+                        content = server.reply(data)
+                        self.send_json(200, {
+                            "object": "chat.completion",
+                            "model": data.get("model"),
+                            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                            "usage": server.usage(data, content)
+                        })
+                except (BrokenPipeError, ConnectionResetError):
+                    status = 499  # The client hung up, e.g. after an early stop
+                server._record(status, time.monotonic() - started)
+
+            def send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def send_event(self, data: str):
+                event = f"data: {data}\n\n".encode()
+                self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+                self.wfile.flush()
+
+            def send_stream(self, content: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for start in range(0, len(content), server.stream_chunk):
+                    self.send_event(json.dumps({"choices": [{"index": 0, "delta": {"content": content[start:start + server.stream_chunk]}}]}))
+                    time.sleep(server.stream_delay)
+                self.send_event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> 'MockServer':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _draw(self):
+        # The status and delay of one response
+        with self.lock:
+            roll = self.rng.random()
+            status = 429 if roll < self.rate_limit_rate else 500 if roll < self.rate_limit_rate + self.error_rate else 200
+            if self.distribution == 'fixed':
+                delay = self.latency
+            elif self.distribution == 'uniform':
+                delay = self.rng.uniform(0, 2 * self.latency)
+            elif self.distribution == 'exponential':
+                delay = self.rng.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+            else:
+                # Lognormal with the given mean, for the long tail real APIs show
+                delay = self.rng.lognormvariate(math.log(self.latency) - self.sigma ** 2 / 2, self.sigma) if self.latency > 0 else 0.0
+        return status, delay
+
+    def _record(self, status: int, seconds: float):
+        with self.lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 200:
+                self.latencies.append(seconds)
+
+    def reset_stats(self):
+        with self.lock:
+            self.statuses: Dict[int, int] = {}
+            self.latencies: List[float] = []
+
+    def stats(self) -> Dict[str, Any]:
+        # Request counts by status and the latency of successful responses,
+        # from the request arriving to the last byte sent
+        with self.lock:
+            return {
+                "requests": sum(self.statuses.values()),
+                "statuses": dict(self.statuses),
+                "p50": percentile(self.latencies, 0.5),
+                "p99": percentile(self.latencies, 0.99)
+            }
+
+    def _yes(self, text: str) -> bool:
+        # Stable per entry, so reruns and cascades agree with each other
+        digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') / 2 ** 64 < self.yes_rate
+
+    def reply(self, data: Dict[str, Any]) -> str:
+        question = data["messages"][-1]["content"]
+        schema = (data.get("response_format") or {}).get("json_schema", {}).get("name")
+        if schema in ('yes_no_answers', 'yes_no_answers_with_confidence'):
+            answers = []
+            for line in question.splitlines():
+                match = BATCH_ENTRY.match(line)
+                if match:
+                    answer = {"id": int(match.group(1)), "answer": self._yes(line[match.end():]), "reason": "Mock reason."}
+                    if schema == 'yes_no_answers_with_confidence':
+                        answer["confidence"] = 0.5 + self._yes(line) / 2
+                    answers.append(answer)
+            return json.dumps({"answers": answers})
+        if schema == 'generated_entries':
+            match = GENERATE_COUNT.search(question)
+            count = int(match.group(1)) if match else 1
+            rng = random.Random(data.get("seed"))
+            return json.dumps({"entries": [
+                {"id": rng.getrandbits(64), "name": f"Person {rng.randrange(10 ** 6)}", "age": rng.randint(1, 99)}
+                for _ in range(count)
+            ]})
+        if "generates JSON entries" in data["messages"][0]["content"]:
+            return json.dumps({"id": random.getrandbits(64), "name": "Person", "age": 30})
+        return ("Yes" if self._yes(question) else "No") + "\nMock reason."
+
+    def usage(self, data: Dict[str, Any], content: str) -> Dict[str, int]:
+        # Four characters per token, like dset's own estimate
+        prompt = sum(len(message["content"]) for message in data["messages"]) // 4
+        completion = len(content) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a mock OpenAI-compatible API for benchmarks and tests')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help='Mean seconds before each response (default: %(default)s)')
+    parser.add_argument('--latency-distribution', choices=LATENCY_DISTRIBUTIONS, default=DEFAULT_LATENCY_DISTRIBUTION,
+                        help='Distribution of response delays (default: %(default)s)')
+    parser.add_argument('--latency-sigma', type=float, default=DEFAULT_LATENCY_SIGMA, help='Spread of lognormal delays (default: %(default)s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests failed with a 500 (default: %(default)s)')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests refused with a 429 (default: %(default)s)')
+    parser.add_argument('--retry-after', type=float, default=DEFAULT_RETRY_AFTER, help='Retry-After seconds sent with 429s (default: %(default)s)')
+    parser.add_argument('--yes-rate', type=float, default=DEFAULT_YES_RATE, help='Share of entries answered yes (default: %(default)s)')
+    parser.add_argument('--stream-chunk', type=int, default=DEFAULT_STREAM_CHUNK, help='Characters per streamed delta (default: %(default)s)')
+    parser.add_argument('--stream-delay', type=float, default=DEFAULT_STREAM_DELAY, help='Seconds between streamed deltas (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for delays and failures')
+    args = parser.parse_args()
+
+    server = MockServer(
+        host=args.host, port=args.port, latency=args.latency, distribution=args.latency_distribution,
+        sigma=args.latency_sigma, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after, yes_rate=args.yes_rate, stream_chunk=args.stream_chunk,
+        stream_delay=args.stream_delay, seed=args.seed
+    )
+    print(f"Serving a mock OpenAI API at {server.url}; use --base-url {server.url}", file=sys.stderr)
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+
+if __name__ == "__main__":
+    main()
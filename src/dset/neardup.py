@@ -0,0 +1,141 @@
+import hashlib
+import random
+import re
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from dset import codec
+from dset.dedup import SpillableMap, BYTES_PER_HASH, DEFAULT_MEMORY_BUDGET, digest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 5  # words
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+SEED = 1
+
+WORD_RE = re.compile(r"\w+")
+
+def optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    # Pick the (bands, rows) split whose S-curve best separates pairs above
+    # and below the Jaccard threshold, weighting false positives and false
+    # negatives equally.
+    def integrate(f, a, b, steps=100):
+        width = (b - a) / steps
+        return sum(f(a + (i + 0.5) * width) for i in range(steps)) * width
+
+    best, best_error = (1, num_perm), float('inf')
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            false_positive = integrate(lambda s: 1 - (1 - s ** rows) ** bands, 0.0, threshold)
+            false_negative = integrate(lambda s: (1 - s ** rows) ** bands, threshold, 1.0)
+            if false_positive + false_negative < best_error:
+                best, best_error = (bands, rows), false_positive + false_negative
+    return best
+
+def shingles(text: str, size: int) -> List[int]:
+    # No words means nothing to compare, so no shingles
+    words = WORD_RE.findall(text.lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return [int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=4).digest(), 'little') for gram in set(grams)]
+
+class MinHasher:
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, seed: int = SEED):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.a = [rng.randrange(1, MAX_HASH) for _ in range(num_perm)]
+        self.b = [rng.randrange(0, MAX_HASH) for _ in range(num_perm)]
+        if np is not None:
+            self.a_array = np.array(self.a, dtype=np.uint64)[:, None]
+            self.b_array = np.array(self.b, dtype=np.uint64)[:, None]
+
+    def signature(self, hashes: Sequence[int]) -> List[int]:
+        # h(x) = ((a * x + b) mod p) & MAX_HASH for each permutation; a and x
+        # are both below 2**32, so the products fit in uint64 without overflow.
+        if np is not None:
+            values = np.array(hashes, dtype=np.uint64)[None, :]
+            permuted = ((self.a_array * values + self.b_array) % np.uint64(MERSENNE_PRIME)) & np.uint64(MAX_HASH)
+            return permuted.min(axis=1).tolist()
+        return [min(((a * x + b) % MERSENNE_PRIME) & MAX_HASH for x in hashes) for a, b in zip(self.a, self.b)]
+
+class NearDuplicateIndex:
+    # Streaming MinHash LSH: each kept entry's signature is stored and cut
+    # into bands, and each band remembers the first kept entry it came
+    # from. A new entry sharing a band with a kept one is only a candidate;
+    # it is dropped if the two signatures agree in at least `threshold` of
+    # their positions, the estimated Jaccard similarity. Both indexes are
+    # memory-bounded and spill to disk.
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = DEFAULT_NUM_PERM,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE, fields: Optional[List[str]] = None,
+                 memory_budget: int = DEFAULT_MEMORY_BUDGET, spill_dir=None):
+        self.hasher = MinHasher(num_perm)
+        self.threshold = threshold
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        self.shingle_size = shingle_size
+        self.fields = fields
+        self.buckets = SpillableMap(memory_budget // 2, BYTES_PER_HASH, spill_dir)
+        self.signatures = SpillableMap(memory_budget // 2, BYTES_PER_HASH + 4 * num_perm, spill_dir)
+        self.kept = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def text(self, entry: Dict[str, Any]) -> str:
+        fields = self.fields if self.fields else list(entry.keys())
+        parts = []
+        for field in fields:
+            value = entry.get(field)
+            if value is None:
+                continue
+            parts.append(value if isinstance(value, str) else codec.dumps(value).decode('utf-8'))
+        return "\n".join(parts)
+
+    def band_keys(self, signature: List[int]) -> List[bytes]:
+        keys = []
+        for band in range(self.bands):
+            values = signature[band * self.rows:(band + 1) * self.rows]
+            keys.append(digest(band.to_bytes(2, 'little') + b"".join(v.to_bytes(4, 'little') for v in values)))
+        return keys
+
+    def similarity(self, signature: List[int], stored: bytes) -> float:
+        other = array('I')
+        other.frombytes(stored)
+        return sum(a == b for a, b in zip(signature, other)) / len(signature)
+
+    def add(self, entry: Dict[str, Any]) -> bool:
+        # Returns True if the entry is not a near-duplicate of one already
+        # added. Entries without any text to compare are always kept.
+        hashes = shingles(self.text(entry), self.shingle_size)
+        if not hashes:
+            return True
+        signature = self.hasher.signature(hashes)
+        keys = self.band_keys(signature)
+        checked = set()
+        for key in keys:
+            candidate = self.buckets.get(key)
+            if candidate is None or candidate in checked:
+                continue
+            checked.add(candidate)
+            if self.similarity(signature, self.signatures.get(candidate)) >= self.threshold:
+                return False
+
+        entry_id = self.kept.to_bytes(8, 'little')
+        self.kept += 1
+        self.signatures.setdefault(entry_id, array('I', signature).tobytes())
+        for key in keys:
+            self.buckets.setdefault(key, entry_id)
+        return True
+
+    def close(self):
+        self.buckets.close()
+        self.signatures.close()
@@ -1,95 +1,351 @@
 import os
+import copy
+import time
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dset.cache import ResponseCache, make_cache_key
+from dset.prompt import format_entry
+from dset.ratelimit import RateLimiter, RetryPolicy, RETRY_STATUSES, estimate_request_tokens
 
-def ask_yes_no_question(config, question, smart: bool = False):
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        # Return a mock response for testing purposes
-        return {
-            "answer": True,
-            "reason": "This is a mock response for testing purposes."
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 120.0  # seconds
+
+YES_NO_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "yes_no_answers",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "answers": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "answer": {"type": "boolean"},
+                            "reason": {"type": "string"}
+                        },
+                        "required": ["id", "answer", "reason"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["answers"],
+            "additionalProperties": False
         }
+    }
+}
+
+# The same answers with a self-reported confidence, used to decide which
+# entries a cascade escalates from the fast model to the smart one.
+YES_NO_CONFIDENCE_RESPONSE_FORMAT = copy.deepcopy(YES_NO_BATCH_RESPONSE_FORMAT)
+YES_NO_CONFIDENCE_RESPONSE_FORMAT["json_schema"]["name"] = "yes_no_answers_with_confidence"
+_answer_schema = YES_NO_CONFIDENCE_RESPONSE_FORMAT["json_schema"]["schema"]["properties"]["answers"]["items"]
+_answer_schema["properties"]["confidence"] = {"type": "number"}
+_answer_schema["required"].append("confidence")
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
+# Arbitrary JSON objects can't be described in strict mode, so this schema
+# only pins down the envelope.
+GENERATE_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "generated_entries",
+        "strict": False,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "entries": {"type": "array", "items": {"type": "object"}}
+            },
+            "required": ["entries"]
+        }
     }
+}
+
+class OpenAIError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"OpenAI API returned status {status_code}")
+        self.status_code = status_code
+
+class OpenAIClient:
+    def __init__(self, api_key: Optional[str] = None, base_url: str = DEFAULT_BASE_URL,
+                 pool_size: int = DEFAULT_POOL_SIZE, timeout: float = DEFAULT_TIMEOUT,
+                 cache: Optional[ResponseCache] = None, rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.replay = None  # Optional BatchResults answering requests from a Batch API run
+
+        # One keep-alive pool shared by all worker threads, sized so that every
+        # in-flight request can reuse an established connection.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers["Content-Type"] = "application/json"
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'OpenAIClient':
+        kwargs.setdefault('api_key', os.environ.get("OPENAI_API_KEY"))
+        kwargs.setdefault('base_url', os.environ.get("OPENAI_BASE_URL", DEFAULT_BASE_URL))
+        return cls(**kwargs)
+
+    @property
+    def is_mock(self) -> bool:
+        # Local OpenAI-compatible servers usually don't need a key, so only
+        # fall back to canned responses when talking to the real API without
+        # one. Replayed batch results are real answers even without a key.
+        return not self.api_key and self.base_url == DEFAULT_BASE_URL and self.replay is None
+
+    def _lookup(self, data: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+        # Returns (cache key, stored result) from batch replay or the cache
+        if self.replay is not None:
+            replayed = self.replay.pop(data)
+            if replayed is not None:
+                return None, replayed
+
+        if self.cache is None:
+            return None, None
+        key = make_cache_key(data)
+        return key, self.cache.get(key)
 
-    model = config.smart_model if smart else config.fast_model
+    def chat_completion(self, data: Dict[str, Any]) -> str:
+        key, result = self._lookup(data)
+        if result is not None:
+            return result
+
+        estimated = estimate_request_tokens(data)
+        body = self._post_with_retries(data, estimated).json()
+        self.rate_limiter.settle(estimated, body.get("usage", {}).get("total_tokens"))
+        result = body["choices"][0]["message"]["content"]
+        if self.cache is not None:
+            self.cache.put(key, result)
+        return result
+
+    def stream_chat_completion(self, data: Dict[str, Any], stop: Optional[Callable[[str], bool]] = None) -> str:
+        # Streams the reply as server-sent events. `stop` is called with the
+        # text so far after every chunk; once it returns True the connection
+        # is closed, which ends generation on the server, and the partial
+        # text is returned. Only complete replies are cached, under the same
+        # key as the equivalent non-streaming request.
+        key, result = self._lookup(data)
+        if result is not None:
+            return result
+
+        response = self._post_with_retries({**data, "stream": True}, estimate_request_tokens(data), stream=True)
+        text = ""
+        complete = True
+        try:
+            for line in response.iter_lines(chunk_size=None):
+                if not line.startswith(b"data:"):
+                    continue
+                payload = line[len(b"data:"):].strip()
+                if payload == b"[DONE]":
+                    break
+                choices = json.loads(payload).get("choices") or []
+                if choices:
+                    text += choices[0].get("delta", {}).get("content") or ""
+                if stop is not None and stop(text):
+                    complete = False
+                    break
+        finally:
+            response.close()
+
+        if complete and self.cache is not None:
+            self.cache.put(key, text)
+        return text
+
+    def _post_with_retries(self, data: Dict[str, Any], estimated: int, stream: bool = False) -> requests.Response:
+        # Rate limits, server errors and dropped connections are retried with
+        # backoff; only once the retries are used up does the error reach the
+        # caller, so no entry is ever answered without a real response.
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(estimated)
+            try:
+                response = self.session.post(
+                    f"{self.base_url}/chat/completions",
+                    json=data,
+                    timeout=self.timeout,
+                    stream=stream
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.retry_policy.max_retries:
+                    raise
+                time.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+                continue
+
+            self.rate_limiter.update(response.headers)
+            if response.status_code == 200:
+                return response
 
-    data = {
-        "model": model,
+            response.close()
+            if response.status_code not in RETRY_STATUSES or attempt >= self.retry_policy.max_retries:
+                raise OpenAIError(response.status_code)
+            delay = self.retry_policy.delay(attempt, response.headers)
+            if response.status_code == 429:
+                self.rate_limiter.pause(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+def build_yes_no_request(config, question: str, smart: bool = False) -> Dict[str, Any]:
+    return {
+        "model": config.smart_model if smart else config.fast_model,
         "messages": [
             {"role": "system", "content": "You are a helpful assistant that answers yes/no questions and provides a brief explanation."},
             {"role": "user", "content": question}
         ]
     }
 
-    try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=data
-        )
-
-        if response.status_code == 200:
-            result = response.json()["choices"][0]["message"]["content"]
-            lines = result.strip().split('\n')
-            answer = lines[0].lower()
-            reason = ' '.join(lines[1:])
-
-            return {
-                "answer": "yes" in answer and "no" not in answer,
-                "reason": reason
-            }
-        else:
-            # Return a mock response for testing purposes
-            return {
-                "answer": True,
-                "reason": f"Mock response due to API error: {response.status_code}"
-            }
-    except requests.exceptions.RequestException:
+def build_yes_no_batch_request(config, question: str, entries: List[Dict[str, Any]], smart: bool = False,
+                               confidence: bool = False) -> Dict[str, Any]:
+    numbered = "\n".join(format_entry({"id": i, "entry": entry}) for i, entry in enumerate(entries))
+    instructions = "Answer separately for each of the following entries, identified by id"
+    if confidence:
+        instructions += ", and give your confidence in each answer from 0 (a guess) to 1 (certain)"
+    return {
+        "model": config.smart_model if smart else config.fast_model,
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant that answers a yes/no question about each of several JSON entries and provides a brief explanation for each."},
+            {"role": "user", "content": f"{question}\n\n{instructions}:\n{numbered}"}
+        ],
+        "response_format": YES_NO_CONFIDENCE_RESPONSE_FORMAT if confidence else YES_NO_BATCH_RESPONSE_FORMAT
+    }
+
+def build_generate_request(config, prompt: str, smart: bool = False) -> Dict[str, Any]:
+    return {
+        "model": config.smart_model if smart else config.fast_model,
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant that generates JSON entries based on prompts."},
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+def build_generate_batch_request(config, prompt: str, count: int, seed: int, smart: bool = False) -> Dict[str, Any]:
+    # Each call gets its own seed, so that calls with the same prompt are
+    # sampled (and cached) separately while a rerun repeats them exactly.
+    # A single entry is asked for as plain JSON, since models without
+    # structured outputs (like gpt-3.5-turbo and gpt-4) reject json_schema.
+    if count == 1:
+        data = build_generate_request(config, f"{prompt}\n\nGenerate one entry as a single JSON object.", smart)
+        data["seed"] = seed
+        return data
+    return {
+        "model": config.smart_model if smart else config.fast_model,
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant that generates varied, distinct JSON entries based on prompts."},
+            {"role": "user", "content": f"{prompt}\n\nGenerate {count} different entries."}
+        ],
+        "response_format": GENERATE_BATCH_RESPONSE_FORMAT,
+        "seed": seed
+    }
+
+def ask_yes_no_question(config, question, smart: bool = False):
+    if config.client.is_mock:
         # Return a mock response for testing purposes
         return {
             "answer": True,
-            "reason": "Mock response due to network error"
+            "reason": "This is a mock response for testing purposes."
         }
 
-def generate_text(config, prompt, smart: bool = False):
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        # Return a mock response for testing purposes
-        return json.dumps({"name": "John Doe", "age": 30})
+    data = build_yes_no_request(config, question, smart)
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
+    return parse_yes_no(config.client.chat_completion(data))
+
+def parse_yes_no(text: str) -> Dict[str, Any]:
+    lines = text.strip().split('\n')
+    answer = lines[0].lower()
+    return {
+        "answer": "yes" in answer and "no" not in answer,
+        "reason": ' '.join(lines[1:])
     }
 
-    model = config.smart_model if smart else config.fast_model
+def ask_yes_no_question_streaming(config, question, smart: bool = False, need_reason: bool = True):
+    # Like ask_yes_no_question, but the answer is settled as soon as the
+    # first line has arrived. Without `need_reason` the rest of the reply is
+    # never generated.
+    if config.client.is_mock:
+        return ask_yes_no_question(config, question, smart)
 
-    data = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant that generates JSON entries based on prompts."},
-            {"role": "user", "content": prompt}
-        ]
-    }
+    data = build_yes_no_request(config, question, smart)
+
+    def answered(text):
+        return not need_reason and '\n' in text.lstrip()
+
+    return parse_yes_no(config.client.stream_chat_completion(data, stop=answered))
+
+def ask_yes_no_batch(config, question: str, entries: List[Dict[str, Any]],
+                     single_question: Callable[[Dict[str, Any]], str], smart: bool = False,
+                     confidence: bool = False) -> List[Dict[str, Any]]:
+    # Packs several entries into one request and asks for one structured
+    # answer per entry id. If the model's reply can't be matched up with the
+    # entries, the batch is split in half and retried, down to one entry per
+    # request using the plain `single_question` prompt.
+    #
+    # With `confidence`, each answer also carries the model's confidence, so
+    # even single entries use the structured request. Answers from the plain
+    # prompt have no confidence and are reported as 0.
+    if len(entries) == 1 and not confidence:
+        return [ask_yes_no_question(config, single_question(entries[0]), smart)]
+
+    if config.client.is_mock:
+        # Return a mock response for testing purposes
+        mock = {"answer": True, "reason": "This is a mock response for testing purposes."}
+        if confidence:
+            mock["confidence"] = 1.0
+        return [dict(mock) for _ in entries]
+
+    data = build_yes_no_batch_request(config, question, entries, smart, confidence)
 
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=data
-        )
-
-        if response.status_code == 200:
-            result = response.json()["choices"][0]["message"]["content"]
-            return result
-        else:
-            # Return a mock response for testing purposes
-            return json.dumps({"name": "Jane Doe", "age": 25})
-    except requests.exceptions.RequestException:
+        result = config.client.chat_completion(data)
+        answers = {item["id"]: item for item in json.loads(result)["answers"]}
+        results = [{"answer": bool(answers[i]["answer"]), "reason": str(answers[i]["reason"])} for i in range(len(entries))]
+        if confidence:
+            for i, answer in enumerate(results):
+                answer["confidence"] = min(max(float(answers[i]["confidence"]), 0.0), 1.0)
+        return results
+    except (ValueError, KeyError, TypeError):
+        if len(entries) == 1:
+            return [dict(ask_yes_no_question(config, single_question(entries[0]), smart), confidence=0.0)]
+        middle = len(entries) // 2
+        return (ask_yes_no_batch(config, question, entries[:middle], single_question, smart, confidence) +
+                ask_yes_no_batch(config, question, entries[middle:], single_question, smart, confidence))
+
+def generate_text(config, prompt, smart: bool = False):
+    if config.client.is_mock:
         # Return a mock response for testing purposes
-        return json.dumps({"name": "Bob Smith", "age": 35})
+        return json.dumps({"name": "John Doe", "age": 30})
+
+    data = build_generate_request(config, prompt, smart)
+    return config.client.chat_completion(data)
+
+def generate_entries(config, prompt: str, count: int, seed: int, smart: bool = False) -> List[Dict[str, Any]]:
+    # Returns up to `count` entries; a reply that doesn't parse yields none
+    # rather than failing the run, and the caller asks again.
+    if config.client.is_mock:
+        # Return mock responses for testing purposes
+        return [{"name": "John Doe", "age": 30, "id": seed * 1_000_000 + i} for i in range(count)]
+
+    data = build_generate_batch_request(config, prompt, count, seed, smart)
+    result = config.client.chat_completion(data)
+    try:
+        entries = [json.loads(result)] if count == 1 else json.loads(result)["entries"]
+    except (ValueError, KeyError, TypeError):
+        return []
+    return [entry for entry in entries if isinstance(entry, dict)][:count] if isinstance(entries, list) else []
@@ -1,64 +1,347 @@
-import json
+import os
+import re
+import random
 import yaml
 import argparse
+import contextlib
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
-from dset.openai_api import ask_yes_no_question, generate_text
-from dset.dataset import ReadableDataSet, WriteableDataSet
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from dset.openai_api import ask_yes_no_question, ask_yes_no_question_streaming, ask_yes_no_batch, generate_entries, build_yes_no_request, build_yes_no_batch_request, build_generate_batch_request
+from dset.dataset import ReadableDataSet, WriteableDataSet, Position, Record, DEFAULT_WORKERS
 from dset.models import JsonLEntry
+from dset import codec, compression, parquet
+from dset.dedup import Deduplicator, DEFAULT_MEMORY_BUDGET
+from dset.splitter import split_files
+from dset.neardup import NearDuplicateIndex, DEFAULT_THRESHOLD, DEFAULT_NUM_PERM, DEFAULT_SHINGLE_SIZE
+from dset.executor import DEFAULT_CONCURRENCY, chunked, map_ordered, map_unordered
+from dset.checkpoint import Checkpoint, DEFAULT_CHECKPOINT_INTERVAL
+from dset.summarizer import ReasonSummarizer, SUMMARIZE_NO
+from dset.batch_api import BatchRequestWriter, BatchResults, read_manifest
+from dset.predicate import Predicate
+from dset.pipeline import StepStreams, StreamDataSet, TeeDataSet, plan_steps, connect_steps, OUTPUT_NAMES
+from dset.sampling import SequentialTest, reservoir_sample, DEFAULT_MAX_FAILURE_RATE, DEFAULT_CONFIDENCE
+from dset.prompt import EntryCompactor, count_request_tokens, counter_name, format_entry
+from dset.workqueue import WorkQueue, parse_shard, shard_path, shard_paths, DEFAULT_CHUNK_SIZE, DEFAULT_LEASE_TIMEOUT
 
-CHUNK_SIZE = 10  # Number of reasons to collect before summarizing
+DEFAULT_ENTRIES_PER_REQUEST = 1
+DEFAULT_CONFIDENCE_THRESHOLD = 0.8
+DEFAULT_ENTRIES_PER_GENERATION = 1
+DEFAULT_REASONS_OUTPUT = 'reasons.jsonl'
+STEP_DEFAULTS = {'reasons_output': DEFAULT_REASONS_OUTPUT}
 
-def summarize_reasons(config, reasons: List[str]) -> str:
-    prompt = f"Summarize the following reasons:\n\n" + "\n".join(reasons)
-    return generate_text(config, prompt)
+def open_output_dataset(config, output_path, resume_at: Optional[int] = None) -> WriteableDataSet:
+    options = {
+        "resume_at": resume_at,
+        "level": getattr(config.args, 'compression_level', None),
+        "threads": getattr(config.args, 'compression_threads', 0)
+    }
+    streams = config.streams.outputs_for(output_path) if config.streams else []
+    if streams:
+        return TeeDataSet(output_path, streams, **options)
+    return WriteableDataSet(output_path, **options)
 
-def update_summary(config, previous_summary: str, chunk_summary: str) -> str:
-    prompt = f"Combine and summarize these two summaries:\n\nPrevious summary: {previous_summary}\n\nNew chunk summary: {chunk_summary}"
-    return generate_text(config, prompt)
+def resolve_output_file(config, output_path, name: str) -> Path:
+    # An existing directory, or a path without an extension, gets a file
+    # named after the operation; anything else is the output file itself.
+    output_path = Path(output_path)
+    if output_path.is_dir() or not output_path.suffix:
+        output_path.mkdir(parents=True, exist_ok=True)
+        return output_path / default_output_name(config, name)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    return output_path
+
+def default_output_name(config, name: str) -> str:
+    return compression.with_suffix(f"{name}.jsonl", getattr(config.args, 'compression', None))
+
+def open_input_dataset(config, input_path):
+    stream = config.streams.input_for(input_path) if config.streams else None
+    if stream is not None:
+        return StreamDataSet(stream)
+    return ReadableDataSet(
+        input_path,
+        workers=getattr(config.args, 'workers', DEFAULT_WORKERS),
+        ordered=not getattr(config.args, 'unordered', False)
+    )
+
+def select_fields(config, dataset: ReadableDataSet, prompt: str) -> Optional[List[str]]:
+    # Picks the fields to materialize and show the model. 'auto' keeps the
+    # fields whose names the prompt mentions, or all of them if it mentions
+    # none.
+    spec = getattr(config.args, 'fields', None)
+    if not spec:
+        return None
+    if spec != 'auto':
+        return [field.strip() for field in spec.split(',') if field.strip()]
+
+    lowered = prompt.lower()
+    referenced = [
+        name for name in dataset.field_names()
+        if re.search(rf"\b{re.escape(name.lower())}\b", lowered) or re.search(rf"\b{re.escape(name.lower().replace('_', ' '))}\b", lowered)
+    ]
+    return referenced or None
+
+def entry_compactor(config) -> EntryCompactor:
+    exclude = getattr(config.args, 'exclude_fields', None)
+    return EntryCompactor(
+        exclude=[field.strip() for field in exclude.split(',') if field.strip()] if exclude else (),
+        strip_whitespace=getattr(config.args, 'strip_whitespace', False),
+        max_value_tokens=getattr(config.args, 'max_value_tokens', None),
+        model=config.fast_model
+    )
+
+def indexed_dataset(dataset, option: str) -> ReadableDataSet:
+    if not isinstance(dataset, ReadableDataSet) or not dataset.indexable():
+        raise ValueError(f"{option} needs an uncompressed JSONL input; convert it first")
+    return dataset
+
+def shard_records(config, dataset: ReadableDataSet, start: Optional[Position] = None) -> Iterator[Record]:
+    # The records of this run's --shard, or of the whole dataset, from `start`
+    spec = getattr(config.args, 'shard', None)
+    if not spec:
+        return dataset.records(start)
+    number, count = parse_shard(spec)
+    total = len(indexed_dataset(dataset, '--shard'))
+    first = total * number // count if start is None else dataset.line_number(start)
+    return dataset.slice(first, total * (number + 1) // count)
+
+def shard_output(config, path) -> Path:
+    spec = getattr(config.args, 'shard', None)
+    return shard_path(path, *parse_shard(spec)) if spec else Path(path)
+
+def sharded_config(config):
+    # Each shard writes (and checkpoints) its own reasons file
+    if not getattr(config.args, 'shard', None):
+        return config
+    args = argparse.Namespace(**vars(config.args))
+    args.reasons_output = str(shard_output(config, args.reasons_output))
+    return dataclasses.replace(config, args=args)
+
+def matching_records(config, dataset: ReadableDataSet, start: Optional[Position] = None,
+                     compactor: Optional[EntryCompactor] = None,
+                     source: Optional[Iterable[Record]] = None) -> Iterator[Record]:
+    # Applies the --where pre-filter, so entries it rejects never cost an LLM
+    # request. Fields the expression needs are read even if --fields leaves
+    # them out, but the model still only sees the selected fields, compacted
+    # as the prompt options ask.
+    expression = getattr(config.args, 'where', None)
+    predicate = Predicate(expression) if expression else None
+    compactor = compactor or entry_compactor(config)
+    columns = dataset.columns
+    if predicate is not None and columns is not None:
+        dataset.columns = columns + sorted(predicate.fields - set(columns))
+
+    skipped = 0
+    try:
+        for record in source if source is not None else shard_records(config, dataset, start):
+            if predicate is not None and not predicate(record.entry):
+                skipped += 1
+                continue
+            entry = record.entry
+            if dataset.columns != columns:
+                entry = {name: entry[name] for name in columns if name in entry}
+            if compactor.active:
+                entry = compactor(entry)
+            yield record if entry is record.entry else record._replace(entry=entry)
+    finally:
+        dataset.columns = columns
+    if predicate is not None:
+        print(f"Skipped {skipped} entries not matching --where {expression}")
+
+def answer_entries(config, dataset: ReadableDataSet, question: str,
+                   single_question: Callable[[Dict[str, Any]], str],
+                   start: Optional[Position] = None, need_reasons: bool = True,
+                   records: Optional[Iterable[Record]] = None, ordered: bool = True) -> Iterator[Tuple[Record, Dict[str, Any]]]:
+    # Answers the question for `records`, or for the dataset's matching
+    # records from `start`. Unordered results arrive as soon as they are
+    # ready, and closing the iterator early cancels requests not yet sent.
+    concurrency = getattr(config.args, 'concurrency', DEFAULT_CONCURRENCY)
+    entries_per_request = getattr(config.args, 'entries_per_request', DEFAULT_ENTRIES_PER_REQUEST)
+    if records is None:
+        records = matching_records(config, dataset, start)
+    mapper = map_ordered if ordered else map_unordered
+
+    if getattr(config.args, 'cascade', False):
+        yield from cascade_entries(config, question, single_question, records, mapper)
+    elif entries_per_request > 1:
+        def batch_processor(records):
+            results = ask_yes_no_batch(config, question, [record.entry for record in records], single_question)
+            return list(zip(records, results))
+
+        for results in mapper(batch_processor, chunked(records, entries_per_request), concurrency):
+            yield from results
+    elif getattr(config.args, 'stream', False):
+        def processor(record):
+            return record, ask_yes_no_question_streaming(config, single_question(record.entry), need_reason=need_reasons)
+
+        yield from mapper(processor, records, concurrency)
+    else:
+        def processor(record):
+            return record, ask_yes_no_question(config, single_question(record.entry))
+
+        yield from mapper(processor, records, concurrency)
+
+def cascade_entries(config, question: str, single_question: Callable[[Dict[str, Any]], str],
+                    records: Iterable[Record], mapper=map_ordered) -> Iterator[Tuple[Record, Dict[str, Any]]]:
+    # Asks the fast model first, with a confidence for each answer, and only
+    # sends the entries it is unsure about to the smart model.
+    concurrency = getattr(config.args, 'concurrency', DEFAULT_CONCURRENCY)
+    entries_per_request = max(getattr(config.args, 'entries_per_request', DEFAULT_ENTRIES_PER_REQUEST), 1)
+    threshold = getattr(config.args, 'confidence_threshold', DEFAULT_CONFIDENCE_THRESHOLD)
+
+    def processor(records):
+        entries = [record.entry for record in records]
+        results = ask_yes_no_batch(config, question, entries, single_question, confidence=True)
+        uncertain = [i for i, result in enumerate(results) if result.get('confidence', 0.0) < threshold]
+        if uncertain:
+            escalated = ask_yes_no_batch(config, question, [entries[i] for i in uncertain], single_question, smart=True)
+            for i, result in zip(uncertain, escalated):
+                results[i] = dict(result, escalated=True)
+        return list(zip(records, results))
+
+    total = escalated_count = 0
+    for results in mapper(processor, chunked(records, entries_per_request), concurrency):
+        for record, result in results:
+            total += 1
+            escalated_count += bool(result.get('escalated'))
+            yield record, result
+    print(f"Escalated {escalated_count} of {total} entries from {config.fast_model} to {config.smart_model}")
+
+def open_checkpoint(config, output_path) -> Tuple[Optional[Checkpoint], Optional[Dict[str, Any]]]:
+    interval = getattr(config.args, 'checkpoint_interval', DEFAULT_CHECKPOINT_INTERVAL)
+    if not interval or config.streams:
+        # Steps connected to others in memory can't be resumed on their own
+        return None, None
+    if compression.compression_for_name(output_path) or Path(output_path).suffix == parquet.SUFFIX:
+        # Compressed and Parquet files can't be truncated back to a checkpoint
+        print(f"Checkpoints are disabled for output {output_path}")
+        return None, None
+
+    checkpoint = Checkpoint(output_path, config.args.input_path, interval)
+    if not getattr(config.args, 'resume', False):
+        # A fresh run rewrites the output, so an older run's checkpoint no
+        # longer describes it
+        checkpoint.remove()
+        return checkpoint, None
+    state = checkpoint.load()
+    if state:
+        print(f"Resuming from {state['position'][0]} at byte {state['position'][1]} ({state['processed']} entries done)")
+    return checkpoint, state
+
+def batch_export_args(config) -> Dict[str, Any]:
+    return {name: value for name, value in vars(config.args).items() if name not in ('func', 'batch_export')}
+
+def yes_no_requests(config, dataset: ReadableDataSet, question: str,
+                    single_question: Callable[[Dict[str, Any]], str],
+                    compactor: Optional[EntryCompactor] = None) -> Iterator[Tuple[Dict[str, Any], int]]:
+    # The requests a run would make, each with its number of entries, without
+    # sending any of them.
+    entries_per_request = getattr(config.args, 'entries_per_request', DEFAULT_ENTRIES_PER_REQUEST)
+    cascade = getattr(config.args, 'cascade', False)
+
+    matching = (record.entry for record in matching_records(config, dataset, compactor=compactor))
+    for entries in chunked(matching, max(entries_per_request, 1)):
+        if cascade:
+            # Only the fast model's pass is planned; escalations depend on its answers
+            yield build_yes_no_batch_request(config, question, entries, confidence=True), len(entries)
+        elif len(entries) == 1:
+            yield build_yes_no_request(config, single_question(entries[0])), 1
+        else:
+            yield build_yes_no_batch_request(config, question, entries), len(entries)
+
+def export_yes_no_requests(config, operation: str, dataset: ReadableDataSet, question: str,
+                           single_question: Callable[[Dict[str, Any]], str]) -> bool:
+    with BatchRequestWriter(config.args.batch_export, operation, batch_export_args(config)) as writer:
+        for request, _ in yes_no_requests(config, dataset, question, single_question):
+            writer.write(request)
+
+    print(f"Wrote {writer.count} batch requests to {config.args.batch_export}")
+    return True
+
+def report_tokens(config, dataset: ReadableDataSet, question: str,
+                  single_question: Callable[[Dict[str, Any]], str]) -> bool:
+    compactor = entry_compactor(config)
+    requests = entries = tokens = largest = 0
+    for request, count in yes_no_requests(config, dataset, question, single_question, compactor):
+        request_tokens = count_request_tokens(request)
+        requests += 1
+        entries += count
+        tokens += request_tokens
+        largest = max(largest, request_tokens)
+
+    print(f"Projected prompt tokens for {entries} entries in {requests} requests to {config.fast_model}: {tokens}")
+    if requests:
+        print(f"Average {tokens // requests} tokens per request, largest {largest}")
+    if compactor.truncated:
+        print(f"Truncated {compactor.truncated} string values to {compactor.max_value_tokens} tokens")
+    print(f"Tokens were counted with {counter_name()}")
+    return True
 
-def process_entries(dataset: ReadableDataSet, processor, config) -> Tuple[bool, List[str], str]:
-    all_yes = True
+def process_entries(results, config, checkpoint: Optional[Checkpoint] = None,
+                    state: Optional[Dict[str, Any]] = None) -> Tuple[bool, List[str], str]:
+    all_yes = state['all_yes'] if state else True
     reasons = []
-    current_chunk = []
-    current_summary = ""
+    processed = state['processed'] if state else 0
+    summarizer = ReasonSummarizer(
+        config,
+        mode=getattr(config.args, 'summarize', SUMMARIZE_NO),
+        concurrency=getattr(config.args, 'concurrency', DEFAULT_CONCURRENCY),
+        state=state['summarizer'] if state else None
+    )
     
-    with open(config.args.reasons_output, 'w') as reasons_file:
-        for result in dataset.process(processor):
-            if not result['answer']:
-                all_yes = False
-            
-            reason_entry = {"answer": result['answer'], "reason": result['reason']}
-            json.dump(reason_entry, reasons_file)
-            reasons_file.write('\n')
-            
-            current_chunk.append(result['reason'])
-            
-            if len(current_chunk) >= CHUNK_SIZE:
-                chunk_summary = summarize_reasons(config, current_chunk)
-                if current_summary:
-                    current_summary = update_summary(config, current_summary, chunk_summary)
-                else:
-                    current_summary = chunk_summary
-                current_chunk.clear()
-    
-    # Process any remaining reasons in the last chunk
-    if current_chunk:
-        chunk_summary = summarize_reasons(config, current_chunk)
-        if current_summary:
-            current_summary = update_summary(config, current_summary, chunk_summary)
-        else:
-            current_summary = chunk_summary
+    resume_at = state['outputs']['reasons'] if state else None
+    try:
+        with open_output_dataset(config, config.args.reasons_output, resume_at=resume_at) as reasons_file:
+            for record, result in results:
+                if not result['answer']:
+                    all_yes = False
+                
+                reason_entry = {"answer": result['answer'], "reason": result['reason']}
+                reasons_file.write(reason_entry)
+                
+                summarizer.add(result['answer'], result['reason'])
+                
+                processed += 1
+                if checkpoint and checkpoint.due():
+                    checkpoint.save({
+                        "position": [record.path, record.offset],
+                        "processed": processed,
+                        "outputs": {"reasons": reasons_file.sync()},
+                        "all_yes": all_yes,
+                        "summarizer": summarizer.state()
+                    })
+        
+        summary = summarizer.result()
+    finally:
+        summarizer.close()
     
-    return all_yes, reasons, current_summary
+    if checkpoint:
+        checkpoint.remove()
+    
+    return all_yes, reasons, summary
 
 def ask_operation(config) -> bool:
-    dataset = ReadableDataSet(config.args.input_path)
+    config = sharded_config(config)
+    dataset = open_input_dataset(config, config.args.input_path)
+    dataset.columns = select_fields(config, dataset, config.args.raw_user_prompt)
+    
+    def single_question(entry):
+        return f"{config.args.raw_user_prompt}\nContext: {format_entry(entry)}"
     
-    def processor(entry):
-        return ask_yes_no_question(config, f"{config.args.raw_user_prompt}\nContext: {json.dumps(entry)}")
+    if getattr(config.args, 'batch_export', None):
+        return export_yes_no_requests(config, 'ask', dataset, config.args.raw_user_prompt, single_question)
+
+    if getattr(config.args, 'token_report', False):
+        return report_tokens(config, dataset, config.args.raw_user_prompt, single_question)
+
+    if getattr(config.args, 'work_dir', None):
+        return work_queue_operation(config, 'ask', dataset, config.args.raw_user_prompt, single_question)
     
-    all_yes, reasons, summary = process_entries(dataset, processor, config)
+    checkpoint, state = open_checkpoint(config, config.args.reasons_output)
+    start = tuple(state['position']) if state else None
+    results = answer_entries(config, dataset, config.args.raw_user_prompt, single_question, start)
+    all_yes, reasons, summary = process_entries(results, config, checkpoint, state)
     
     if all_yes:
         print("Yes, that is the case for all entries.")
@@ -71,12 +354,32 @@ def ask_operation(config) -> bool:
     return all_yes
 
 def assert_operation(config) -> bool:
-    dataset = ReadableDataSet(config.args.input_path)
+    config = sharded_config(config)
+    dataset = open_input_dataset(config, config.args.input_path)
+    dataset.columns = select_fields(config, dataset, config.args.raw_user_prompt)
     
-    def processor(entry):
-        return ask_yes_no_question(config, f"{config.args.raw_user_prompt}\nContext: {json.dumps(entry)}")
+    def single_question(entry):
+        return f"{config.args.raw_user_prompt}\nContext: {format_entry(entry)}"
     
-    all_yes, reasons, summary = process_entries(dataset, processor, config)
+    if getattr(config.args, 'batch_export', None):
+        return export_yes_no_requests(config, 'assert', dataset, config.args.raw_user_prompt, single_question)
+
+    if getattr(config.args, 'token_report', False):
+        return report_tokens(config, dataset, config.args.raw_user_prompt, single_question)
+
+    if getattr(config.args, 'work_dir', None):
+        return work_queue_operation(config, 'assert', dataset, config.args.raw_user_prompt, single_question)
+    
+    if getattr(config.args, 'sample', None):
+        return assert_sample(config, dataset, single_question)
+
+    if getattr(config.args, 'fail_fast', False):
+        return assert_fail_fast(config, dataset, single_question)
+    
+    checkpoint, state = open_checkpoint(config, config.args.reasons_output)
+    start = tuple(state['position']) if state else None
+    results = answer_entries(config, dataset, config.args.raw_user_prompt, single_question, start)
+    all_yes, reasons, summary = process_entries(results, config, checkpoint, state)
     
     if all_yes:
         print("Assertion passed: The condition is true for all entries.")
@@ -87,32 +390,187 @@ def assert_operation(config) -> bool:
     
     return all_yes
 
+def assert_fail_fast(config, dataset, single_question) -> bool:
+    # Answers arrive in completion order and the first "no" decides the
+    # result; requests that haven't been sent yet are cancelled.
+    results = answer_entries(config, dataset, config.args.raw_user_prompt, single_question, ordered=False)
+    checked = 0
+    try:
+        for record, result in results:
+            checked += 1
+            if not result['answer']:
+                print(f"Assertion failed: The condition is not true for this entry (found after {checked} entries):")
+                print(format_entry(record.entry))
+                print(f"\nReason: {result['reason']}")
+                return False
+    finally:
+        results.close()
+
+    print(f"Assertion passed: The condition is true for all {checked} entries.")
+    return True
+
+def assert_sample(config, dataset, single_question) -> bool:
+    # Checks a random (or stratified) sample in random order and stops as
+    # soon as the failure rate is shown to be within, or above, the allowed
+    # rate at the requested confidence.
+    rng = random.Random(getattr(config.args, 'seed', None))
+    stratify = getattr(config.args, 'stratify', None)
+    if stratify and dataset.columns is not None and stratify not in dataset.columns:
+        dataset.columns = dataset.columns + [stratify]
+    if not stratify and not getattr(config.args, 'where', None) and isinstance(dataset, ReadableDataSet) and dataset.indexable():
+        # The line index samples without parsing every entry
+        compactor = entry_compactor(config)
+        sample = dataset.sample(config.args.sample, rng)
+        rng.shuffle(sample)
+        if compactor.active:
+            sample = [record._replace(entry=compactor(record.entry)) for record in sample]
+    else:
+        key = (lambda record: codec.dumps_canonical(record.entry.get(stratify))) if stratify else None
+        sample = reservoir_sample(matching_records(config, dataset), config.args.sample, rng, key)
+
+    max_failure_rate = getattr(config.args, 'max_failure_rate', DEFAULT_MAX_FAILURE_RATE)
+    confidence = getattr(config.args, 'confidence', DEFAULT_CONFIDENCE)
+    test = SequentialTest(max_failure_rate, confidence)
+    decision = None
+    results = answer_entries(config, dataset, config.args.raw_user_prompt, single_question, records=sample)
+    try:
+        for record, result in results:
+            decision = test.update(result['answer'])
+            if decision is not None:
+                break
+    finally:
+        results.close()
+    if decision is None:
+        decision = test.finish()
+
+    low, high = test.interval
+    print(f"Checked {test.n} of {len(sample)} sampled entries, {test.failures} failed. "
+          f"The failure rate is between {low:.2%} and {high:.2%} at {test.interval_confidence:.2%} confidence "
+          f"(--confidence {confidence:.0%}, split over {test.looks} looks at the sample).")
+    if decision:
+        print(f"Assertion passed: The condition fails for at most {max_failure_rate:.2%} of entries.")
+    elif decision is False:
+        print(f"Assertion failed: The condition fails for more than {max_failure_rate:.2%} of entries.")
+    else:
+        print("Assertion inconclusive: The sample is too small to bound the failure rate; increase --sample.")
+    return bool(decision)
+
+def work_queue_operation(config, operation: str, dataset: ReadableDataSet, question: str,
+                         single_question: Callable[[Dict[str, Any]], str]) -> bool:
+    # Works through the chunks of the input that no other worker has claimed,
+    # writing one output per chunk: the kept entries for filter, the answers
+    # and reasons for ask and assert. `dset gather` merges them in order.
+    if getattr(config.args, 'shard', None):
+        raise ValueError("--shard and --work-dir cannot be combined")
+    total = len(indexed_dataset(dataset, '--work-dir'))
+    chunk_size = max(getattr(config.args, 'chunk_size', DEFAULT_CHUNK_SIZE), 1)
+    queue = WorkQueue(config.args.work_dir, lease_timeout=getattr(config.args, 'lease_timeout', DEFAULT_LEASE_TIMEOUT))
+    plan = queue.create_plan({
+        "operation": operation,
+        "input": os.path.abspath(config.args.input_path),
+        "prompt": config.args.raw_user_prompt,
+        "entries": total,
+        "chunk_size": chunk_size,
+        "chunks": -(-total // chunk_size)
+    })
+
+    processed = 0
+    for chunk in queue.claimed():
+        first = chunk * chunk_size
+        records = matching_records(config, dataset, source=dataset.slice(first, min(first + chunk_size, total)))
+        output = queue.temporary_output_path(chunk)
+        summary = {"entries": 0, "kept": 0, "all_yes": True}
+        try:
+            with open_output_dataset(config, output) as output_dataset:
+                for record, result in answer_entries(config, dataset, question, single_question, records=records,
+                                                     need_reasons=operation != 'filter'):
+                    summary['entries'] += 1
+                    if operation == 'filter':
+                        if result['answer']:
+                            output_dataset.write_record(record)
+                            summary['kept'] += 1
+                    else:
+                        summary['all_yes'] = summary['all_yes'] and result['answer']
+                        output_dataset.write({"answer": result['answer'], "reason": result['reason']})
+        except BaseException:
+            output.unlink(missing_ok=True)
+            raise
+        queue.complete(chunk, output, summary)
+        processed += 1
+
+    print(f"Processed {processed} chunks; {len(queue.pending())} of {plan['chunks']} not yet done in {queue.dir}")
+    return True
+
+def gather_operation(config) -> bool:
+    source = Path(config.args.source)
+    summaries = None
+    if WorkQueue.exists(source):
+        queue = WorkQueue(source)
+        plan = queue.load_plan()
+        pending = queue.pending()
+        if pending:
+            print(f"{len(pending)} of {plan['chunks']} chunks are not done yet, starting with chunk {pending[0]}")
+            return False
+        parts = [queue.output_path(chunk) for chunk in range(plan['chunks'])]
+        summaries = queue.summaries()
+    else:
+        try:
+            parts = shard_paths(source)
+        except ValueError as e:
+            print(e)
+            return False
+
+    output_file = resolve_output_file(config, config.args.output_path, "gathered")
+    with open_output_dataset(config, output_file) as output_dataset:
+        for part in parts:
+            for record in ReadableDataSet(part).records():
+                output_dataset.write_record(record)
+
+    if summaries is None:
+        print(f"Gathered {len(parts)} shards into {output_file}")
+        return True
+    entries = sum(summary['entries'] for summary in summaries)
+    if plan['operation'] == 'filter':
+        print(f"Gathered {sum(summary['kept'] for summary in summaries)} of {entries} entries into {output_file}")
+        return True
+    all_yes = all(summary['all_yes'] for summary in summaries)
+    print(f"Gathered the answers for {entries} entries into {output_file}")
+    print("The condition is true for all entries." if all_yes else "The condition is not true for some entries.")
+    return all_yes
+
+def index_operation(config) -> bool:
+    dataset = ReadableDataSet(config.args.input_path, keep_index=True)
+    try:
+        count = len(dataset)
+    except ValueError as e:
+        print(e)
+        return False
+    print(f"Indexed {count} entries in {len(dataset.files())} files")
+    return True
+
 def split_operation(config) -> bool:
     input_dataset = ReadableDataSet(config.args.input_path)
-    output_datasets = []
-    current_size = 0
-    current_dataset = None
-    file_count = 0
-    
-    for entry in input_dataset.process(lambda x: x):
-        if current_size == 0 or current_size >= config.args.max_size:
-            if current_dataset:
-                current_dataset.__exit__(None, None, None)
-                output_datasets.append(current_dataset)
-            file_count += 1
-            output_path = Path(config.args.output_path) / f"split_{file_count}.jsonl"
-            current_dataset = WriteableDataSet(output_path)
-            current_dataset.__enter__()
-            current_size = 0
-        
-        current_dataset.write(entry)
-        current_size += len(json.dumps(entry)) + 1  # +1 for newline
+    max_size = getattr(config.args, 'max_size', None)
+    max_lines = getattr(config.args, 'max_lines', None)
+    shards = getattr(config.args, 'shards', None)
     
-    if current_dataset:
-        current_dataset.__exit__(None, None, None)
-        output_datasets.append(current_dataset)
+    if sum(option is not None for option in (max_size, max_lines, shards)) != 1:
+        print("Specify exactly one of max_size, --max-lines or --shards")
+        return False
     
-    print(f"Split into {len(output_datasets)} datasets")
+    output_paths = split_files(
+        input_dataset.files(),
+        Path(config.args.output_path),
+        max_bytes=max_size,
+        max_lines=max_lines,
+        shards=shards,
+        workers=getattr(config.args, 'workers', DEFAULT_WORKERS),
+        compression=getattr(config.args, 'compression', None),
+        level=getattr(config.args, 'compression_level', None),
+        threads=getattr(config.args, 'compression_threads', 0)
+    )
+    
+    print(f"Split into {len(output_paths)} datasets")
     return True
 
 def filter_operation(config) -> bool:
@@ -125,22 +583,48 @@ def filter_operation(config) -> bool:
     if input_path.is_dir() and not output_path.is_dir():
         raise ValueError("Cannot output to a file when input is a directory")
     
-    if not output_path.exists():
-        output_path.mkdir(parents=True, exist_ok=True)
-    
-    filtered_count = 0
-    if output_path.is_dir():
-        output_file = output_path / "filtered.jsonl"
-    else:
-        output_file = output_path
-    
-    input_dataset = ReadableDataSet(input_path)
-    with WriteableDataSet(output_file) as output_dataset:
-        for entry in input_dataset.process(lambda x: x):
-            include = ask_yes_no_question(config, f"Does the following entry meet this requirement: '{config.args.raw_user_prompt}'?\nEntry: {json.dumps(entry)}")['answer']
-            if include:
-                output_dataset.write(entry)
+    def single_question(entry):
+        return f"Does the following entry meet this requirement: '{config.args.raw_user_prompt}'?\nEntry: {format_entry(entry)}"
+
+    question = f"Does the entry meet this requirement: '{config.args.raw_user_prompt}'?"
+
+    input_dataset = open_input_dataset(config, input_path)
+    input_dataset.columns = select_fields(config, input_dataset, config.args.raw_user_prompt)
+
+    if getattr(config.args, 'batch_export', None):
+        return export_yes_no_requests(config, 'filter', input_dataset, question, single_question)
+
+    if getattr(config.args, 'token_report', False):
+        return report_tokens(config, input_dataset, question, single_question)
+
+    if getattr(config.args, 'work_dir', None):
+        return work_queue_operation(config, 'filter', input_dataset, question, single_question)
+
+    # Resolved only now, so that runs which don't write it don't create its directory
+    output_file = shard_output(config, resolve_output_file(config, output_path, OUTPUT_NAMES['filter']))
+    checkpoint, state = open_checkpoint(config, output_file)
+    start = tuple(state['position']) if state else None
+    resume_at = state['outputs']['output'] if state else None
+    filtered_count = state['filtered'] if state else 0
+    processed = state['processed'] if state else 0
+
+    with open_output_dataset(config, output_file, resume_at=resume_at) as output_dataset:
+        for record, result in answer_entries(config, input_dataset, question, single_question, start, need_reasons=False):
+            if result['answer']:
+                output_dataset.write_record(record)
                 filtered_count += 1
+
+            processed += 1
+            if checkpoint and checkpoint.due():
+                checkpoint.save({
+                    "position": [record.path, record.offset],
+                    "processed": processed,
+                    "outputs": {"output": output_dataset.sync()},
+                    "filtered": filtered_count
+                })
+    
+    if checkpoint:
+        checkpoint.remove()
     
     print(f"Filtered {filtered_count} entries into {output_file}")
     return True
@@ -148,27 +632,38 @@ def filter_operation(config) -> bool:
 def merge_operation(config) -> bool:
     print(f"Merging data from {config.args.input_path} to {config.args.output_path}")
     
-    output_path = Path(config.args.output_path)
-    output_path.mkdir(parents=True, exist_ok=True)
-    
-    if output_path.is_dir():
-        output_file = output_path / "merged.jsonl"
-    else:
-        output_file = output_path
+    output_file = resolve_output_file(config, config.args.output_path, OUTPUT_NAMES['merge'])
     
     merged_count = 0
-    seen_entries = set()
+    deduplicator = Deduplicator(
+        memory_budget=getattr(config.args, 'dedup_memory', DEFAULT_MEMORY_BUDGET // (1024 * 1024)) * 1024 * 1024,
+        spill_dir=getattr(config.args, 'spill_dir', None),
+        bloom=getattr(config.args, 'bloom', False)
+    )
     
-    with WriteableDataSet(output_file) as output_dataset:
+    near_duplicates = None
+    if getattr(config.args, 'near_dup', False):
+        fields = getattr(config.args, 'near_dup_fields', None)
+        near_duplicates = NearDuplicateIndex(
+            threshold=getattr(config.args, 'near_dup_threshold', DEFAULT_THRESHOLD),
+            num_perm=getattr(config.args, 'num_perm', DEFAULT_NUM_PERM),
+            shingle_size=getattr(config.args, 'shingle_size', DEFAULT_SHINGLE_SIZE),
+            fields=[field.strip() for field in fields.split(',')] if fields else None,
+            memory_budget=deduplicator.memory_budget,
+            spill_dir=deduplicator.spill_parent
+        )
+    
+    with deduplicator, near_duplicates or contextlib.nullcontext(), open_output_dataset(config, output_file) as output_dataset:
         input_paths = [Path(p.strip()) for p in config.args.input_path.split(',')]
         for input_path in input_paths:
-            input_dataset = ReadableDataSet(input_path)
-            for entry in input_dataset.process(lambda x: x):
-                entry_str = json.dumps(entry, sort_keys=True)
-                if entry_str not in seen_entries:
-                    seen_entries.add(entry_str)
-                    output_dataset.write(entry)
-                    merged_count += 1
+            input_dataset = open_input_dataset(config, input_path)
+            for record in input_dataset.records():
+                if not deduplicator.add(codec.dumps_canonical(record.entry)):
+                    continue
+                if near_duplicates is not None and not near_duplicates.add(record.entry):
+                    continue
+                output_dataset.write_record(record)
+                merged_count += 1
     
     print(f"Merged {merged_count} unique entries into {output_file}")
     return True
@@ -177,24 +672,88 @@ def generate_operation(config) -> bool:
     print(f"Generating {config.args.num_entries} entries to {config.args.output_path}")
     print(f"Prompt: {config.args.raw_user_prompt}")
     
-    output_path = Path(config.args.output_path)
-    output_path.mkdir(parents=True, exist_ok=True)
-    
-    if output_path.is_dir():
-        output_file = output_path / "generated.jsonl"
-    else:
-        output_file = output_path
-    
-    with WriteableDataSet(output_file) as output_dataset:
-        for _ in range(config.args.num_entries):
-            entry = generate_entry(config)
-            output_dataset.write(entry)
-    
-    print(f"Generated {config.args.num_entries} entries into {output_file}")
+    prompt = generate_entry_prompt(config)
+    per_request = max(getattr(config.args, 'entries_per_request', DEFAULT_ENTRIES_PER_GENERATION), 1)
+
+    if getattr(config.args, 'batch_export', None):
+        with BatchRequestWriter(config.args.batch_export, 'generate', batch_export_args(config)) as writer:
+            for seed, count in plan_generation(config.args.num_entries, per_request):
+                writer.write(build_generate_batch_request(config, prompt, count, seed))
+        print(f"Wrote {writer.count} batch requests to {config.args.batch_export}")
+        return True
+
+    output_file = resolve_output_file(config, config.args.output_path, OUTPUT_NAMES['generate'])
+    concurrency = getattr(config.args, 'concurrency', DEFAULT_CONCURRENCY)
+    generated = requests = duplicates = 0
+    next_seed = 0
+
+    def generate(call):
+        seed, count = call
+        return generate_entries(config, prompt, count, seed)
+
+    with Deduplicator() as deduplicator, open_output_dataset(config, output_file) as output_dataset:
+        # Each round asks for just enough entries to cover what is still
+        # missing; duplicates and unusable replies are made up in the next
+        # round, until a round adds nothing new.
+        while generated < config.args.num_entries:
+            calls = plan_generation(config.args.num_entries - generated, per_request, next_seed)
+            next_seed += len(calls)
+            added = 0
+            for entries in map_ordered(generate, calls, concurrency):
+                requests += 1
+                for entry in entries:
+                    if generated >= config.args.num_entries:
+                        break
+                    if not deduplicator.add(codec.dumps_canonical(entry)):
+                        duplicates += 1
+                        continue
+                    output_dataset.write(entry)
+                    generated += 1
+                    added += 1
+            if not added:
+                break
+
+    print(f"Generated {generated} entries into {output_file} with {requests} requests ({duplicates} duplicates dropped)")
+    if generated < config.args.num_entries:
+        print(f"Stopped short of {config.args.num_entries} entries: the last round produced no new entries")
+        return False
     return True
 
-def generate_entry(config):
-    return json.loads(generate_text(config, f"Generate a JSON entry based on this prompt: {config.args.raw_user_prompt}"))
+def plan_generation(count: int, per_request: int, first_seed: int = 0) -> List[Tuple[int, int]]:
+    # (seed, number of entries) for each request needed to generate `count`
+    return [(first_seed + i, min(per_request, count - i * per_request)) for i in range(-(-count // per_request))]
+
+def generate_entry_prompt(config) -> str:
+    return f"Generate JSON entries based on this prompt: {config.args.raw_user_prompt}"
+
+def ingest_operation(config) -> bool:
+    print(f"Ingesting batch results from {config.args.results_file} for {config.args.requests_file}")
+
+    try:
+        manifest = read_manifest(config.args.requests_file)
+    except (OSError, ValueError) as e:
+        print(f"Error reading batch manifest: {e}")
+        return False
+
+    operation = manifest['operation']
+    func = globals().get(f"{operation}_operation")
+    if not func:
+        print(f"Unknown operation: {operation}")
+        return False
+
+    results = BatchResults.load(config.args.results_file)
+    print(f"Loaded {len(results)} of {manifest['requests']} results")
+
+    config.client.replay = results
+    try:
+        success = func(dataclasses.replace(config, args=argparse.Namespace(**manifest['args'])))
+    finally:
+        config.client.replay = None
+
+    # Requests without a usable result (and follow-up calls such as reason
+    # summaries) fall through to the live API.
+    print(f"Replayed {results.hits} responses, {results.misses} requests went to the API")
+    return success
 
 def batch_operation(config) -> bool:
     print(f"Executing batch operations from {config.args.yaml_file}")
@@ -211,23 +770,63 @@ def batch_operation(config) -> bool:
         return False
 
     for step in batch_config['steps']:
-        if 'operation' not in step:
+        if not isinstance(step, dict) or 'operation' not in step:
             print(f"Invalid step: {step}")
             return False
+        if not globals().get(f"{step['operation']}_operation"):
+            print(f"Unknown operation: {step['operation']}")
+            return False
 
-        operation = step['operation']
-        args = argparse.Namespace(**step)
-        args.func = globals().get(f"{operation}_operation")
+    try:
+        steps = plan_steps(batch_config['steps'], STEP_DEFAULTS)
+    except ValueError as e:
+        print(f"Invalid step: {e}")
+        return False
+    streams = connect_steps(steps)
 
-        if not args.func:
-            print(f"Unknown operation: {operation}")
-            return False
+    # Every step runs on its own thread as soon as the steps it depends on
+    # have finished; steps fed in memory start right away and consume their
+    # input as it is produced.
+    with ThreadPoolExecutor(max_workers=len(steps) or 1) as executor:
+        futures = []
+        for step in steps:
+            futures.append(executor.submit(run_step, config, step, streams[step.index], [futures[i] for i in sorted(step.after)]))
+        results = [future.result() for future in futures]
 
-        print(f"Executing {operation} operation")
-        success = args.func(argparse.Namespace(**step))
-        if not success:
-            print(f"Operation {operation} failed")
-            return False
+    if not all(results):
+        return False
 
     print("Batch operations completed successfully")
     return True
+
+def step_args(step) -> argparse.Namespace:
+    # YAML steps name their files `input` and `output`, like the CLI's
+    # positional arguments; defaults that the operations don't supply
+    # themselves are filled in here.
+    args = dict(STEP_DEFAULTS, **step.args)
+    if 'input' in args:
+        args.setdefault('input_path', args['input'])
+    if 'output' in args:
+        args.setdefault('output_path', args['output'])
+    return argparse.Namespace(**args)
+
+def run_step(config, step, streams: StepStreams, dependencies) -> bool:
+    success = False
+    try:
+        if not all(dependency.result() for dependency in dependencies):
+            print(f"Skipping {step.operation} step {step.name}: an earlier step failed")
+            return False
+
+        print(f"Executing {step.operation} operation")
+        func = globals()[f"{step.operation}_operation"]
+        success = bool(func(dataclasses.replace(config, args=step_args(step), streams=streams)))
+        if not success:
+            print(f"Operation {step.operation} failed")
+        return success
+    except Exception as e:
+        print(f"Operation {step.operation} failed: {e}")
+        return False
+    finally:
+        # Release whichever side of each pipe this step didn't get to close
+        streams.finish(None if success else f"{step.operation} step {step.name} failed")
+        streams.abandon()
@@ -0,0 +1,122 @@
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+SUFFIX = '.parquet'
+MAGIC = b'PAR1'
+BATCH_SIZE = 65536  # Rows per record batch read or written
+
+def is_parquet(path) -> bool:
+    path = Path(path)
+    if path.suffix == SUFFIX:
+        return True
+    if not path.is_file():
+        return False
+    with open(path, 'rb') as f:
+        return f.read(4) == MAGIC
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Reading or writing .parquet datasets requires the 'pyarrow' package")
+
+def field_names(path) -> List[str]:
+    _require_pyarrow()
+    return list(pq.read_schema(path).names)
+
+def read_rows(path, columns: Optional[List[str]] = None, skip: int = 0) -> Iterator[Tuple[int, Dict[str, Any], Any, int]]:
+    # Yields (row number after this row, projected entry, full record batch,
+    # index in batch). Only the projected columns are converted to Python
+    # objects; the full batch is kept so that the whole row can still be
+    # written out without materializing it.
+    _require_pyarrow()
+    parquet_file = pq.ParquetFile(path)
+    available = set(parquet_file.schema_arrow.names)
+    projection = [column for column in columns if column in available] if columns else None
+
+    row = 0
+    for batch in parquet_file.iter_batches(batch_size=BATCH_SIZE):
+        if row + batch.num_rows <= skip:
+            row += batch.num_rows
+            continue
+        entries = batch.select(projection).to_pylist() if projection is not None else batch.to_pylist()
+        for index, entry in enumerate(entries):
+            row += 1
+            if row > skip:
+                yield row, entry, batch, index
+
+class ParquetSink:
+    # Buffers rows (Python dicts or rows of Arrow batches) and writes them
+    # out as record batches. Rows taken from the same source batch are
+    # gathered with a single `take`. The schema is taken from the first rows
+    # written.
+    def __init__(self, path, batch_size: int = BATCH_SIZE):
+        _require_pyarrow()
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.writer = None
+        self.schema = None
+        self.pending_rows: List[Dict[str, Any]] = []
+        self.pending_source = None
+        self.pending_indices: List[int] = []
+        self.pending_batches = []
+        self.pending_count = 0
+
+    def _flush_rows(self):
+        if self.pending_rows:
+            self.pending_batches.append(pa.RecordBatch.from_pylist(self.pending_rows, schema=self.schema))
+            self.pending_rows = []
+
+    def _flush_indices(self):
+        if self.pending_indices:
+            self.pending_batches.append(self.pending_source.take(pa.array(self.pending_indices, type=pa.int64())))
+            self.pending_source = None
+            self.pending_indices = []
+
+    def write_entry(self, entry: Dict[str, Any]):
+        self._flush_indices()
+        self.pending_rows.append(entry)
+        self._added()
+
+    def write_slice(self, batch, index: int):
+        self._flush_rows()
+        if batch is not self.pending_source:
+            self._flush_indices()
+            self.pending_source = batch
+        self.pending_indices.append(index)
+        self._added()
+
+    def _added(self):
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self._flush_rows()
+        self._flush_indices()
+        if not self.pending_batches:
+            return
+        if self.schema is None:
+            self.schema = self.pending_batches[0].schema
+        table = pa.Table.from_batches([
+            batch if batch.schema.equals(self.schema) else pa.Table.from_batches([batch]).cast(self.schema).to_batches()[0]
+            for batch in self.pending_batches
+        ], schema=self.schema)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(str(self.path), self.schema)
+        self.writer.write_table(table)
+        self.pending_batches = []
+        self.pending_count = 0
+
+    def close(self):
+        self.flush()
+        if self.writer is None and self.schema is None:
+            # Nothing was written; still leave a valid (empty) file behind
+            self.writer = pq.ParquetWriter(str(self.path), pa.schema([]))
+        if self.writer is not None:
+            self.writer.close()
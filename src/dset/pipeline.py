@@ -0,0 +1,281 @@
+import os
+import queue
+import threading
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+from dset import codec
+from dset.dataset import Record, WriteableDataSet, Position
+
+STREAM_BUFFER = 1024  # Entries a producing step may run ahead of its consumer
+
+# Steps whose output is written through open_output_dataset, and steps that
+# only ever read their input front to back, so the two can be connected in
+# memory instead of through a finished file.
+STREAM_PRODUCERS = {'generate', 'filter', 'merge'}
+STREAM_CONSUMERS = {'filter', 'ask', 'assert', 'merge'}
+
+_END = object()
+
+def normalize(path) -> str:
+    return os.path.normpath(str(path))
+
+class StreamError(RuntimeError):
+    pass
+
+class EntryStream:
+    # A bounded in-memory pipe of records from one step to another. A
+    # consumer that stops reading abandons the stream, so the producer never
+    # blocks on it forever.
+    def __init__(self, path: str, buffer: int = STREAM_BUFFER):
+        self.path = path
+        self.queue = queue.Queue(maxsize=buffer)
+        self.abandoned = threading.Event()
+        self.finished = False
+        self.error = None
+
+    def _put(self, item):
+        while not self.abandoned.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def put(self, record: Record):
+        self._put(record)
+
+    def finish(self, error: Optional[str] = None):
+        if not self.finished:
+            self.finished = True
+            self.error = error
+            self._put(_END)
+
+    def abandon(self):
+        self.abandoned.set()
+
+    def __iter__(self) -> Iterator[Record]:
+        while True:
+            item = self.queue.get()
+            if item is _END:
+                if self.error:
+                    raise StreamError(f"Input {self.path} is incomplete: {self.error}")
+                return
+            yield item
+
+class StreamDataSet:
+    # Reads a step's input from an EntryStream with the same interface the
+    # operations use on a ReadableDataSet.
+    def __init__(self, stream: EntryStream, columns: Optional[List[str]] = None):
+        self.stream = stream
+        self.path = stream.path
+        self.columns = columns
+        self._iterator = iter(stream)
+        self._peeked: List[Record] = []
+
+    def files(self):
+        raise ValueError(f"Input {self.path} is streamed from an earlier step and has no files")
+
+    def field_names(self) -> List[str]:
+        if not self._peeked:
+            self._peeked.extend(self._take(1))
+        return list(self._peeked[0].entry.keys()) if self._peeked else []
+
+    def _take(self, count: int) -> List[Record]:
+        return [record for _, record in zip(range(count), self._iterator)]
+
+    def records(self, start: Optional[Position] = None) -> Iterator[Record]:
+        if start is not None:
+            raise ValueError("Streamed inputs can't be resumed")
+        while self._peeked:
+            yield self._project(self._peeked.pop(0))
+        for record in self._iterator:
+            yield self._project(record)
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        for record in self.records():
+            yield record.entry
+
+    def _project(self, record: Record) -> Record:
+        if self.columns is None:
+            return record
+        return record._replace(entry={column: record.entry[column] for column in self.columns if column in record.entry})
+
+class TeeDataSet(WriteableDataSet):
+    # Writes a step's output file as usual and also hands every entry to the
+    # steps reading it, which don't have to wait for the file to be finished.
+    def __init__(self, path, streams: List[EntryStream], **kwargs):
+        super().__init__(path, **kwargs)
+        self.streams = streams
+        self.count = 0
+
+    def _publish(self, entry: Dict[str, Any], line: bytes):
+        self.count += 1
+        record = Record(str(self.path), self.count, entry, line)
+        for stream in self.streams:
+            stream.put(record)
+
+    def write(self, entry: Dict[str, Any]):
+        super().write(entry)
+        self._publish(entry, codec.dumps(entry))
+
+    def write_raw(self, line: bytes):
+        super().write_raw(line)
+        self._publish(codec.loads(line), line)
+
+    def write_record(self, record: Record):
+        if self.sink and record.source is not None:
+            super().write_record(record)
+            batch, index = record.source
+            entry = batch.slice(index, 1).to_pylist()[0]
+            self._publish(entry, codec.dumps(entry))
+        else:
+            super().write_record(record)  # Published through write or write_raw
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super().__exit__(exc_type, exc_val, exc_tb)
+        for stream in self.streams:
+            stream.finish(f"{exc_type.__name__}: {exc_val}" if exc_type else None)
+
+class StepStreams:
+    # The in-memory inputs and outputs of one pipeline step, keyed by the
+    # normalized paths the step's arguments name.
+    def __init__(self):
+        self.inputs: Dict[str, EntryStream] = {}
+        self.outputs: Dict[str, List[EntryStream]] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.inputs or self.outputs)
+
+    def input_for(self, path) -> Optional[EntryStream]:
+        return self.inputs.get(normalize(path))
+
+    def outputs_for(self, path) -> List[EntryStream]:
+        # Outputs named as a directory are matched by the file written in it
+        path = normalize(path)
+        return self.outputs.get(path) or self.outputs.get(os.path.dirname(path)) or []
+
+    def finish(self, error: Optional[str] = None):
+        for streams in self.outputs.values():
+            for stream in streams:
+                stream.finish(error)
+
+    def abandon(self):
+        for stream in self.inputs.values():
+            stream.abandon()
+
+# The file each producer writes when its output names a directory, as
+# resolve_output_file picks it
+OUTPUT_NAMES = {'generate': 'generated', 'filter': 'filtered', 'merge': 'merged'}
+
+class Step(NamedTuple):
+    index: int
+    name: str
+    operation: str
+    args: Dict[str, Any]
+    inputs: List[str]
+    outputs: List[str]
+    after: Set[int]  # Steps that must finish before this one starts
+    streamed_from: Optional[int]  # Step whose output is piped into this one
+
+def is_directory_output(path: str) -> bool:
+    # Like resolve_output_file: an existing directory, or a path without an extension
+    return os.path.isdir(path) or not os.path.splitext(path)[1]
+
+def _paths(value) -> List[str]:
+    return [normalize(path.strip()) for path in str(value).split(',') if path.strip()] if value else []
+
+def step_files(step: Dict[str, Any]) -> Optional[Tuple[List[str], List[str]]]:
+    # The paths a step reads and writes, a directory standing for everything
+    # in it, or None if they can't be told from its arguments
+    operation = step['operation']
+    reads = _paths(step.get('input'))
+    writes = _paths(step.get('batch_export')) + _paths(step.get('work_dir'))
+    if operation in ('filter', 'merge', 'generate'):
+        writes += _paths(step.get('output'))
+    elif operation in ('ask', 'assert'):
+        writes += _paths(step.get('reasons_output'))
+    elif operation == 'split':
+        # Outputs are named by a prefix, so claim its whole directory
+        writes += [os.path.dirname(path) or '.' for path in _paths(step.get('output'))]
+    elif operation == 'index':
+        writes += reads  # The .idx sidecars sit next to the input files
+    elif operation == 'gather':
+        reads += _paths(step.get('source'))
+        writes += _paths(step.get('output'))
+    else:
+        return None
+    if (operation != 'generate' and not reads) or not writes:
+        return None
+    return reads, writes
+
+def _overlap(first: List[str], second: List[str]) -> bool:
+    for a in map(os.path.abspath, first):
+        for b in map(os.path.abspath, second):
+            if a == b or a.startswith(b.rstrip(os.sep) + os.sep) or b.startswith(a.rstrip(os.sep) + os.sep):
+                return True
+    return False
+
+def _conflict(earlier, later) -> bool:
+    # Unknown file effects keep the YAML order
+    if earlier is None or later is None:
+        return True
+    (earlier_reads, earlier_writes), (later_reads, later_writes) = earlier, later
+    return _overlap(earlier_writes, later_reads + later_writes) or _overlap(earlier_reads, later_writes)
+
+def _streams_output(producer: Step, path: str) -> bool:
+    output = producer.outputs[0] if producer.outputs else None
+    if output is None:
+        return False
+    if path == output:
+        return True
+    name = OUTPUT_NAMES.get(producer.operation)
+    return (name is not None and is_directory_output(output) and os.path.dirname(path) == output
+            and os.path.basename(path).startswith(f"{name}.jsonl"))
+
+def plan_steps(steps: List[Dict[str, Any]], defaults: Optional[Dict[str, Any]] = None) -> List[Step]:
+    # A step runs after every earlier step whose files overlap its own: one
+    # writes what the other reads or writes, where a directory covers the
+    # files in it. Steps whose files can't be told apart keep the YAML
+    # order, as do steps naming others in `after`. A step with exactly one
+    # dependency, on a step that can stream the output it reads, reads it in
+    # memory while it is produced; limiting pipes to single-input steps
+    # means a step never waits on one input while another backs up, so a
+    # pipeline can't deadlock.
+    planned: List[Step] = []
+    files: List[Optional[Tuple[List[str], List[str]]]] = []
+    names: Dict[str, int] = {}
+
+    for index, step in enumerate(steps):
+        name = str(step.get('name', index))
+        effects = step_files(dict(defaults or {}, **step))
+        inputs = _paths(step.get('input'))
+        outputs = _paths(step.get('output'))
+
+        after = {earlier for earlier in range(index) if _conflict(files[earlier], effects)}
+        explicit = step.get('after', [])
+        for dependency in [explicit] if isinstance(explicit, (str, int)) else explicit:
+            if str(dependency) not in names:
+                raise ValueError(f"Step {name} runs after unknown step {dependency}")
+            after.add(names[str(dependency)])
+
+        streamed_from = None
+        if len(after) == 1 and len(inputs) == 1 and not explicit and step['operation'] in STREAM_CONSUMERS:
+            producer = planned[next(iter(after))]
+            if producer.operation in STREAM_PRODUCERS and _streams_output(producer, inputs[0]):
+                streamed_from = producer.index
+                after = set()
+
+        planned.append(Step(index, name, step['operation'], step, inputs, outputs, after, streamed_from))
+        files.append(effects)
+        names[name] = index
+
+    return planned
+
+def connect_steps(steps: List[Step], buffer: int = STREAM_BUFFER) -> List[StepStreams]:
+    streams = [StepStreams() for _ in steps]
+    for step in steps:
+        if step.streamed_from is not None:
+            producer = steps[step.streamed_from]
+            stream = EntryStream(step.inputs[0], buffer)
+            streams[step.index].inputs[step.inputs[0]] = stream
+            streams[producer.index].outputs.setdefault(producer.outputs[0], []).append(stream)
+    return streams
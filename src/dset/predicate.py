@@ -0,0 +1,153 @@
+import ast
+import operator
+import re
+from typing import Any, Callable, Dict, Set
+
+# A small, safe expression language for cheap checks on entries, e.g.
+#   age >= 18 and has(name) and type_of(tags) == 'array' and len(tags) > 0
+# Bare names are entry fields (missing fields are None), `entry['some key']`
+# reaches fields that aren't identifiers, and `a.b` / `a[0]` walk into nested
+# values. Anything that fails to evaluate counts as not matching.
+
+TYPE_NAMES = [
+    (bool, 'boolean'),
+    ((int, float), 'number'),
+    (str, 'string'),
+    (list, 'array'),
+    (dict, 'object'),
+    (type(None), 'null'),
+]
+
+def type_of(value: Any) -> str:
+    for types, name in TYPE_NAMES:
+        if isinstance(value, types):
+            return name
+    return 'unknown'
+
+FUNCTIONS: Dict[str, Callable[..., Any]] = {
+    'len': len,
+    'abs': abs,
+    'min': min,
+    'max': max,
+    'int': int,
+    'float': float,
+    'str': str,
+    'lower': lambda value: value.lower(),
+    'upper': lambda value: value.upper(),
+    'strip': lambda value: value.strip(),
+    'type_of': type_of,
+    'matches': lambda value, pattern: re.search(pattern, value) is not None,
+}
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+}
+
+class PredicateError(ValueError):
+    pass
+
+class Predicate:
+    def __init__(self, expression: str):
+        self.expression = expression
+        try:
+            self.tree = ast.parse(expression, mode='eval').body
+        except SyntaxError as e:
+            raise PredicateError(f"Invalid expression {expression!r}: {e.msg}") from None
+        self.fields: Set[str] = set()
+        self._validate(self.tree)
+
+    def _validate(self, node: ast.AST):
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or (node.func.id not in FUNCTIONS and node.func.id != 'has') or node.keywords:
+                raise PredicateError(f"Unsupported function call in {self.expression!r}")
+            if node.func.id == 'has':
+                if len(node.args) != 1 or not isinstance(node.args[0], (ast.Name, ast.Constant)):
+                    raise PredicateError("has() takes a single field name")
+                self.fields.add(node.args[0].id if isinstance(node.args[0], ast.Name) else str(node.args[0].value))
+                return
+            for arg in node.args:
+                self._validate(arg)
+            return
+        if isinstance(node, ast.Name):
+            if node.id != 'entry':
+                self.fields.add(node.id)
+            return
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == 'entry':
+            if not isinstance(node.slice, ast.Constant):
+                raise PredicateError("entry[...] needs a constant field name")
+            self.fields.add(str(node.slice.value))
+            return
+        if isinstance(node, ast.Attribute) and node.attr.startswith('_'):
+            raise PredicateError(f"Unsupported attribute {node.attr!r} in {self.expression!r}")
+        allowed = (ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd, ast.BinOp, ast.Compare,
+                   ast.Constant, ast.Attribute, ast.Subscript, ast.List, ast.Tuple, ast.Load) + \
+            tuple(BINARY_OPERATORS) + tuple(COMPARISONS)
+        if not isinstance(node, allowed):
+            raise PredicateError(f"Unsupported syntax {type(node).__name__} in {self.expression!r}")
+        for child in ast.iter_child_nodes(node):
+            self._validate(child)
+
+    def __call__(self, entry: Dict[str, Any]) -> bool:
+        try:
+            return bool(self._eval(self.tree, entry))
+        except Exception:
+            return False
+
+    def _eval(self, node: ast.AST, entry: Dict[str, Any]) -> Any:
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            return entry if node.id == 'entry' else entry.get(node.id)
+        if isinstance(node, ast.BoolOp):
+            if isinstance(node.op, ast.And):
+                return all(self._eval(value, entry) for value in node.values)
+            return any(self._eval(value, entry) for value in node.values)
+        if isinstance(node, ast.UnaryOp):
+            operand = self._eval(node.operand, entry)
+            if isinstance(node.op, ast.Not):
+                return not operand
+            return -operand if isinstance(node.op, ast.USub) else +operand
+        if isinstance(node, ast.BinOp):
+            return BINARY_OPERATORS[type(node.op)](self._eval(node.left, entry), self._eval(node.right, entry))
+        if isinstance(node, ast.Compare):
+            left = self._eval(node.left, entry)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self._eval(comparator, entry)
+                if not COMPARISONS[type(op)](left, right):
+                    return False
+                left = right
+            return True
+        if isinstance(node, ast.Call):
+            if node.func.id == 'has':
+                arg = node.args[0]
+                name = arg.id if isinstance(arg, ast.Name) else str(arg.value)
+                return entry.get(name) is not None
+            return FUNCTIONS[node.func.id](*(self._eval(arg, entry) for arg in node.args))
+        if isinstance(node, ast.Attribute):
+            value = self._eval(node.value, entry)
+            return value.get(node.attr) if isinstance(value, dict) else None
+        if isinstance(node, ast.Subscript):
+            value = self._eval(node.value, entry)
+            index = self._eval(node.slice, entry)
+            return value.get(index) if isinstance(value, dict) else value[index]
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return [self._eval(element, entry) for element in node.elts]
+        raise PredicateError(f"Unsupported syntax {type(node).__name__}")
@@ -0,0 +1,83 @@
+import json
+import functools
+from typing import Any, Dict, Iterable, Optional
+
+# Count tokens with tiktoken when it's installed, otherwise estimate them at
+# about four characters each, which is close for English text and JSON.
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD = 4  # Tokens each chat message costs beyond its content
+TRUNCATION_MARKER = "…"
+DEFAULT_ENCODING = "cl100k_base"
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: Optional[str]):
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(DEFAULT_ENCODING)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+def counter_name() -> str:
+    return "tiktoken" if tiktoken is not None else f"an estimate of {CHARS_PER_TOKEN} characters per token"
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def count_request_tokens(data: Dict[str, Any]) -> int:
+    model = data.get("model")
+    return sum(count_tokens(str(message.get("content", "")), model) + MESSAGE_OVERHEAD for message in data.get("messages", []))
+
+def truncate(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    if tiktoken is not None:
+        tokens = _encoding(model).encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return _encoding(model).decode(tokens[:max_tokens]) + TRUNCATION_MARKER
+    limit = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:limit] + TRUNCATION_MARKER
+
+def format_entry(entry: Dict[str, Any]) -> str:
+    # Compact separators and raw Unicode cost noticeably fewer tokens than
+    # json.dumps' defaults.
+    return json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+
+class EntryCompactor:
+    # Shrinks entries before they're shown to the model: drops excluded
+    # fields, collapses runs of whitespace in strings and cuts string values
+    # down to a token budget. The dataset's own rows are never modified.
+    def __init__(self, exclude: Iterable[str] = (), strip_whitespace: bool = False,
+                 max_value_tokens: Optional[int] = None, model: Optional[str] = None):
+        self.exclude = set(exclude)
+        self.strip_whitespace = strip_whitespace
+        self.max_value_tokens = max_value_tokens
+        self.model = model
+        self.truncated = 0
+
+    @property
+    def active(self) -> bool:
+        return bool(self.exclude or self.strip_whitespace or self.max_value_tokens)
+
+    def __call__(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: self._value(value) for name, value in entry.items() if name not in self.exclude}
+
+    def _value(self, value: Any) -> Any:
+        if isinstance(value, str):
+            if self.strip_whitespace:
+                value = " ".join(value.split())
+            if self.max_value_tokens:
+                shortened = truncate(value, self.max_value_tokens, self.model)
+                if shortened is not value:
+                    self.truncated += 1
+                value = shortened
+            return value
+        if isinstance(value, dict):
+            return {name: self._value(item) for name, item in value.items()}
+        if isinstance(value, list):
+            return [self._value(item) for item in value]
+        return value
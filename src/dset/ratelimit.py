@@ -0,0 +1,131 @@
+import re
+import time
+import random
+import threading
+from typing import Any, Dict, Mapping, Optional
+from dset.prompt import count_request_tokens
+
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BASE_DELAY = 1.0  # seconds
+DEFAULT_MAX_DELAY = 60.0  # seconds
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    # Parses the reset times OpenAI sends, like "20ms", "1s" or "6m0s"
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+def estimate_request_tokens(data: Dict[str, Any]) -> int:
+    # A rough upper bound for budgeting before the request is sent; the real
+    # count from the response's `usage` replaces it afterwards.
+    return count_request_tokens(data) + data.get("max_tokens", 0)
+
+class TokenBucket:
+    # Refills continuously at `per_minute` units a minute up to one minute's
+    # worth. Callers reserve units up front and wait out any deficit, so
+    # concurrent workers are served in the order they asked.
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self.lock:
+            self._refill(time.monotonic())
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount: float):
+        with self.lock:
+            self.level = min(self.capacity, self.level + amount)
+
+    def observe(self, remaining: int, reset: Optional[float] = None):
+        # The server's count is authoritative, e.g. when other clients share
+        # the account, so never believe there is more budget than it reports.
+        with self.lock:
+            self._refill(time.monotonic())
+            if remaining < self.level:
+                self.level = float(remaining)
+                if reset and remaining <= 0:
+                    self.level = -reset * self.rate
+
+class RateLimiter:
+    # Shared by all worker threads of a client. Budgets that aren't given are
+    # learned from the x-ratelimit-limit-* headers of the first response.
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        self.buckets = {
+            "requests": TokenBucket(requests_per_minute) if requests_per_minute else None,
+            "tokens": TokenBucket(tokens_per_minute) if tokens_per_minute else None,
+        }
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        delays = [self.paused_until - time.monotonic()]
+        if self.buckets["requests"] is not None:
+            delays.append(self.buckets["requests"].reserve(1))
+        if self.buckets["tokens"] is not None:
+            delays.append(self.buckets["tokens"].reserve(tokens))
+        delay = max(delays)
+        if delay > 0:
+            time.sleep(delay)
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        if actual is not None and self.buckets["tokens"] is not None:
+            self.buckets["tokens"].refund(estimated - actual)
+
+    def pause(self, seconds: float):
+        # Backs off every worker at once, not just the one that was throttled
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update(self, headers: Mapping[str, str]):
+        for kind in ("requests", "tokens"):
+            limit = _parse_int(headers.get(f"x-ratelimit-limit-{kind}"))
+            remaining = _parse_int(headers.get(f"x-ratelimit-remaining-{kind}"))
+            if self.buckets[kind] is None and limit:
+                with self.lock:
+                    if self.buckets[kind] is None:
+                        self.buckets[kind] = TokenBucket(limit)
+            if self.buckets[kind] is not None and remaining is not None:
+                self.buckets[kind].observe(remaining, parse_duration(headers.get(f"x-ratelimit-reset-{kind}")))
+
+class RetryPolicy:
+    def __init__(self, max_retries: int = DEFAULT_MAX_RETRIES, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, headers: Optional[Mapping[str, str]] = None) -> float:
+        # Full jitter keeps workers that failed together from retrying together,
+        # but never earlier than the server asked.
+        jittered = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if headers is not None:
+            requested = parse_duration(headers.get("retry-after")) or parse_duration(headers.get("x-ratelimit-reset-requests"))
+            if requested is not None:
+                return max(jittered, min(requested, self.max_delay))
+        return jittered
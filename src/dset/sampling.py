@@ -0,0 +1,89 @@
+import math
+import random
+from statistics import NormalDist
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_MAX_FAILURE_RATE = 0.01
+DEFAULT_CONFIDENCE = 0.95
+FIRST_LOOK = 16  # Sample size at which the stopping rule is first checked
+
+def reservoir_sample(items: Iterable[Any], size: int, rng: random.Random,
+                     key: Optional[Callable[[Any], Any]] = None) -> List[Any]:
+    # A uniform random sample of `size` items in one pass. With `key`, each
+    # stratum is sampled separately and gets a share of the sample in
+    # proportion to its size (at least one item), so small strata are never
+    # missed entirely.
+    reservoirs: Dict[Any, List[Any]] = {}
+    counts: Dict[Any, int] = {}
+    for item in items:
+        stratum = key(item) if key else None
+        seen = counts.get(stratum, 0)
+        counts[stratum] = seen + 1
+        reservoir = reservoirs.setdefault(stratum, [])
+        if seen < size:
+            reservoir.append(item)
+        else:
+            slot = rng.randrange(seen + 1)
+            if slot < size:
+                reservoir[slot] = item
+
+    total = sum(counts.values())
+    sample = []
+    for stratum, reservoir in reservoirs.items():
+        share = max(1, round(size * counts[stratum] / total)) if key else size
+        sample.extend(rng.sample(reservoir, min(share, len(reservoir))))
+    rng.shuffle(sample)
+    return sample
+
+def wilson_interval(failures: int, n: int, confidence: float) -> Tuple[float, float]:
+    # Two-sided Wilson score interval for a binomial proportion
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    p = failures / n
+    centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+class SequentialTest:
+    # Decides whether the failure rate is below `max_failure_rate` while the
+    # sample is still being checked. The bound is only evaluated at sample
+    # sizes 16, 32, 64, ..., and the k-th look spends 1/2^k of the error
+    # budget, so stopping at any look keeps the overall error rate within
+    # 1 - confidence.
+    def __init__(self, max_failure_rate: float = DEFAULT_MAX_FAILURE_RATE,
+                 confidence: float = DEFAULT_CONFIDENCE):
+        self.max_failure_rate = max_failure_rate
+        self.confidence = confidence
+        self.n = 0
+        self.failures = 0
+        self.next_look = FIRST_LOOK
+        self.looks = 0
+        self.interval = (0.0, 1.0)
+        self.interval_confidence = confidence  # The level `interval` was computed at
+
+    def update(self, passed: bool) -> Optional[bool]:
+        # Returns True once the rate is shown to be within the limit, False
+        # once it is shown to exceed it, and None while undecided.
+        self.n += 1
+        self.failures += not passed
+        if self.n < self.next_look:
+            return None
+        self.next_look *= 2
+        self.looks += 1
+        return self.decide(1 - (1 - self.confidence) / 2 ** self.looks)
+
+    def finish(self) -> Optional[bool]:
+        # A last look once the sample is used up
+        self.looks += 1
+        return self.decide(1 - (1 - self.confidence) / 2 ** self.looks)
+
+    def decide(self, confidence: Optional[float] = None) -> Optional[bool]:
+        self.interval_confidence = confidence or self.confidence
+        self.interval = wilson_interval(self.failures, self.n, self.interval_confidence)
+        low, high = self.interval
+        if high <= self.max_failure_rate:
+            return True
+        if low > self.max_failure_rate:
+            return False
+        return None
@@ -0,0 +1,236 @@
+import itertools
+import mmap
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from dset import codec, parquet
+from dset import compression as compression_formats
+from dset.executor import map_ordered
+
+Segment = Tuple[str, int, int]  # (file path, start byte, end byte)
+
+SCAN_BLOCK = 4 * 1024 * 1024  # Bytes scanned at a time when counting lines
+COPY_CHUNK = 64 * 1024 * 1024  # Largest single copy request handed to the kernel
+
+def _open_map(path) -> Optional[mmap.mmap]:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _fit_bytes(mm: mmap.mmap, start: int, budget: int, must_advance: bool) -> int:
+    # End of the last whole line starting at `start` that fits in `budget`
+    # bytes. When nothing fits, returns `start`, or the end of the first line
+    # if the caller has to make progress anyway.
+    size = len(mm)
+    if start + budget >= size:
+        return size
+    newline = mm.rfind(b'\n', start, start + budget)
+    if newline >= 0:
+        return newline + 1
+    if not must_advance:
+        return start
+    newline = mm.find(b'\n', start + budget)
+    return size if newline < 0 else newline + 1
+
+def _skip_lines(mm: mmap.mmap, start: int, lines: int) -> Tuple[int, int]:
+    # Returns (end, lines skipped), counting newlines a block at a time
+    size = len(mm)
+    position = start
+    skipped = 0
+    while position < size:
+        block = mm[position:position + SCAN_BLOCK]
+        count = block.count(b'\n')
+        if skipped + count < lines:
+            skipped += count
+            position += len(block)
+            continue
+        index = -1
+        for _ in range(lines - skipped):
+            index = block.find(b'\n', index + 1)
+        return position + index + 1, lines
+    # A final line without a trailing newline still counts as a line
+    if size > start and mm[size - 1:size] != b'\n':
+        skipped += 1
+    return size, skipped
+
+def _line_start_at_or_after(mm: mmap.mmap, offset: int) -> int:
+    if offset <= 0:
+        return 0
+    newline = mm.find(b'\n', offset - 1)
+    return len(mm) if newline < 0 else newline + 1
+
+def _needs_newline(mm: mmap.mmap, end: int) -> bool:
+    return end > 0 and mm[end - 1:end] != b'\n'
+
+def plan_split(files: List[Path], max_bytes: Optional[int] = None, max_lines: Optional[int] = None,
+               shards: Optional[int] = None) -> List[List[Segment]]:
+    # Works out which byte ranges of which input files make up each output
+    # file, only ever cutting just after a newline. Inputs are treated as
+    # one concatenated stream, so outputs can span files. Exactly one of
+    # max_bytes, max_lines and shards is used.
+    if shards:
+        return _plan_shards(files, shards)
+    if max_bytes is None and max_lines is None:
+        raise ValueError("One of max_bytes, max_lines or shards is required")
+
+    outputs: List[List[Segment]] = []
+    current: List[Segment] = []
+    used_bytes = 0
+    used_lines = 0
+
+    for path in files:
+        mm = _open_map(path)
+        if mm is None:
+            continue
+        with mm:
+            position = 0
+            size = len(mm)
+            while position < size:
+                if max_bytes is not None:
+                    end = _fit_bytes(mm, position, max_bytes - used_bytes, must_advance=not current)
+                    if end == position:
+                        outputs.append(current)
+                        current, used_bytes = [], 0
+                        continue
+                    used_bytes += end - position + (1 if _needs_newline(mm, end) else 0)
+                    full = used_bytes >= max_bytes
+                else:
+                    end, lines = _skip_lines(mm, position, max_lines - used_lines)
+                    used_lines += lines
+                    full = used_lines >= max_lines
+
+                current.append((str(path), position, end))
+                position = end
+                if full:
+                    outputs.append(current)
+                    current, used_bytes, used_lines = [], 0, 0
+
+    if current:
+        outputs.append(current)
+    return outputs
+
+def _plan_shards(files: List[Path], shards: int) -> List[List[Segment]]:
+    sizes = [path.stat().st_size for path in files]
+    total = sum(sizes)
+    cuts = [total * k // shards for k in range(1, shards)]
+
+    outputs: List[List[Segment]] = [[] for _ in range(shards)]
+    stream_offset = 0
+    for path, size in zip(files, sizes):
+        mm = _open_map(path)
+        if mm is None:
+            continue
+        with mm:
+            # Boundaries falling inside this file, moved forward to line starts
+            boundaries = [0]
+            for cut in cuts:
+                if stream_offset < cut < stream_offset + size:
+                    boundaries.append(_line_start_at_or_after(mm, cut - stream_offset))
+                else:
+                    boundaries.append(0 if cut <= stream_offset else size)
+            boundaries.append(size)
+            for shard in range(shards):
+                start, end = boundaries[shard], boundaries[shard + 1]
+                if end > start:
+                    outputs[shard].append((str(path), start, end))
+        stream_offset += size
+
+    return [segments for segments in outputs if segments]
+
+def copy_range(src_fd: int, dst_fd: int, start: int, length: int):
+    # Copy bytes between files inside the kernel where the platform allows it
+    copied = 0
+    while copied < length:
+        count = min(length - copied, COPY_CHUNK)
+        if hasattr(os, 'copy_file_range'):
+            try:
+                written = os.copy_file_range(src_fd, dst_fd, count, start + copied)
+            except OSError:
+                written = _sendfile_or_copy(src_fd, dst_fd, start + copied, count)
+        else:
+            written = _sendfile_or_copy(src_fd, dst_fd, start + copied, count)
+        if written == 0:
+            raise IOError(f"Unexpected end of input while copying at byte {start + copied}")
+        copied += written
+
+def _sendfile_or_copy(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    if hasattr(os, 'sendfile'):
+        try:
+            return os.sendfile(dst_fd, src_fd, offset, count)
+        except OSError:
+            pass
+    data = os.pread(src_fd, count, offset)
+    os.write(dst_fd, data)
+    return len(data)
+
+def write_output(task: Tuple[Path, List[Segment]]) -> Path:
+    output_path, segments = task
+    with open(output_path, 'wb') as output_file:
+        for path, start, end in segments:
+            with open(path, 'rb') as input_file:
+                copy_range(input_file.fileno(), output_file.fileno(), start, end - start)
+                # Keep lines separate when an input file lacks a final newline
+                if os.pread(input_file.fileno(), 1, end - 1) != b'\n':
+                    os.write(output_file.fileno(), b'\n')
+    return output_path
+
+def _stream_lines(files: List[Path]) -> Iterator[bytes]:
+    for path in files:
+        if parquet.is_parquet(path):
+            for _, entry, _, _ in parquet.read_rows(path):
+                yield codec.dumps(entry) + b'\n'
+            continue
+        with compression_formats.open_read(path) as f:
+            for line in f:
+                yield line if line.endswith(b'\n') else line + b'\n'
+
+def split_stream(files: List[Path], output_names: Iterator[Path], max_bytes: Optional[int] = None,
+                 max_lines: Optional[int] = None, shards: Optional[int] = None,
+                 level: Optional[int] = None, threads: int = 0) -> List[Path]:
+    # Line-by-line fallback for compressed or Parquet inputs and compressed
+    # outputs, which can't be memory-mapped or copied as raw byte ranges. Sizes count uncompressed
+    # bytes, so limits mean the same thing as for plain files.
+    if shards:
+        total = sum(len(line) for line in _stream_lines(files))
+        cuts = [total * k // shards for k in range(1, shards)] + [total]
+
+    outputs = []
+    current = None
+    used_bytes = used_lines = stream_offset = 0
+    try:
+        for line in _stream_lines(files):
+            if current is not None:
+                if shards:
+                    full = stream_offset >= cuts[len(outputs) - 1]
+                elif max_bytes is not None:
+                    full = used_bytes + len(line) > max_bytes
+                else:
+                    full = used_lines >= max_lines
+                if full:
+                    current.close()
+                    current = None
+            if current is None:
+                outputs.append(next(output_names))
+                current = compression_formats.open_write(outputs[-1], 'wb', level, threads)
+                used_bytes = used_lines = 0
+            current.write(line)
+            used_bytes += len(line)
+            used_lines += 1
+            stream_offset += len(line)
+    finally:
+        if current is not None:
+            current.close()
+    return outputs
+
+def split_files(files: List[Path], output_dir: Path, max_bytes: Optional[int] = None, max_lines: Optional[int] = None,
+                shards: Optional[int] = None, workers: int = 1, prefix: str = "split",
+                compression: Optional[str] = None, level: Optional[int] = None, threads: int = 0) -> List[Path]:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if compression_formats.SUFFIXES.get(compression) or any(parquet.is_parquet(path) or compression_formats.detect(path) for path in files):
+        names = (output_dir / compression_formats.with_suffix(f"{prefix}_{i}.jsonl", compression) for i in itertools.count(1))
+        return split_stream(files, names, max_bytes=max_bytes, max_lines=max_lines, shards=shards, level=level, threads=threads)
+
+    plan = plan_split(files, max_bytes=max_bytes, max_lines=max_lines, shards=shards)
+    tasks = [(output_dir / f"{prefix}_{i + 1}.jsonl", segments) for i, segments in enumerate(plan)]
+    return list(map_ordered(write_output, tasks, workers))
@@ -0,0 +1,88 @@
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from dset.openai_api import generate_text
+from dset.executor import DEFAULT_CONCURRENCY, chunked, map_ordered
+
+CHUNK_SIZE = 10  # Number of reasons to collect before summarizing
+MERGE_FAN_IN = 4  # Number of summaries combined per merge request
+
+SUMMARIZE_ALL = 'all'
+SUMMARIZE_NO = 'no'
+SUMMARIZE_NONE = 'none'
+SUMMARIZE_CHOICES = [SUMMARIZE_ALL, SUMMARIZE_NO, SUMMARIZE_NONE]
+
+def summarize_reasons(config, reasons: List[str]) -> str:
+    prompt = f"Summarize the following reasons:\n\n" + "\n".join(reasons)
+    return generate_text(config, prompt)
+
+def merge_summaries(config, summaries: List[str]) -> str:
+    if len(summaries) == 1:
+        return summaries[0]
+    numbered = "\n\n".join(f"Summary {i + 1}: {summary}" for i, summary in enumerate(summaries))
+    prompt = f"Combine and summarize these summaries:\n\n{numbered}"
+    return generate_text(config, prompt)
+
+class ReasonSummarizer:
+    # Summarizes reasons as a tree: every CHUNK_SIZE distinct reasons are
+    # summarized in the background as soon as the chunk fills, and the chunk
+    # summaries are combined MERGE_FAN_IN at a time in parallel rounds at the
+    # end, so the LLM calls form a log-depth tree instead of a serial fold.
+    def __init__(self, config, mode: str = SUMMARIZE_ALL, concurrency: int = DEFAULT_CONCURRENCY,
+                 state: Optional[Dict[str, Any]] = None):
+        self.config = config
+        self.mode = mode
+        self.concurrency = max(concurrency, 1)
+        self.chunk = list(state['chunk']) if state else []
+        self.summaries: List[Future] = []
+        for summary in (state['summaries'] if state else []):
+            self.summaries.append(self._completed(summary))
+        # Only reasons seen in this process are deduplicated; a resumed run
+        # may summarize a reason again, which is harmless.
+        self.seen = set()
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    @staticmethod
+    def _completed(value) -> Future:
+        future = Future()
+        future.set_result(value)
+        return future
+
+    def add(self, answer: bool, reason: str):
+        if self.mode == SUMMARIZE_NONE or (self.mode == SUMMARIZE_NO and answer):
+            return
+
+        reason = reason.strip()
+        if not reason:
+            return
+        digest = hashlib.blake2b(reason.lower().encode('utf-8'), digest_size=16).digest()
+        if digest in self.seen:
+            return
+        self.seen.add(digest)
+
+        self.chunk.append(reason)
+        if len(self.chunk) >= CHUNK_SIZE:
+            self.summaries.append(self.executor.submit(summarize_reasons, self.config, self.chunk))
+            self.chunk = []
+
+    def state(self) -> Dict[str, Any]:
+        return {"chunk": list(self.chunk), "summaries": [future.result() for future in self.summaries]}
+
+    def result(self) -> str:
+        try:
+            if self.chunk:
+                self.summaries.append(self.executor.submit(summarize_reasons, self.config, self.chunk))
+                self.chunk = []
+
+            summaries = [future.result() for future in self.summaries]
+            while len(summaries) > 1:
+                groups = chunked(summaries, MERGE_FAN_IN)
+                summaries = list(map_ordered(lambda group: merge_summaries(self.config, group), groups, self.concurrency))
+            return summaries[0] if summaries else ""
+        finally:
+            self.close()
+
+    def close(self):
+        for future in self.summaries:
+            future.cancel()
+        self.executor.shutdown(wait=False)
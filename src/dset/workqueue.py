@@ -0,0 +1,215 @@
+import os
+import re
+import json
+import time
+import uuid
+import socket
+import threading
+import contextlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_CHUNK_SIZE = 10000  # Entries per work item
+DEFAULT_LEASE_TIMEOUT = 300.0  # Seconds without a heartbeat before a lease may be taken over
+
+PLAN = 'plan.json'
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    # "i/N", counting shards from 0
+    try:
+        number, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard {spec!r}, expected i/N") from None
+    if count < 1 or not 0 <= number < count:
+        raise ValueError(f"Invalid shard {spec!r}, expected 0 <= i < N")
+    return number, count
+
+def shard_path(path, number: int, count: int) -> Path:
+    # out/filtered.jsonl.gz -> out/filtered.shard-1-of-4.jsonl.gz
+    path = Path(path)
+    stem, dot, suffixes = path.name.partition('.')
+    return path.with_name(f"{stem}.shard-{number}-of-{count}{dot}{suffixes}")
+
+def shard_paths(path) -> List[Path]:
+    # The files written by every shard of a sharded output, in shard order
+    path = Path(path)
+    stem, dot, suffixes = path.name.partition('.')
+    pattern = re.compile(re.escape(stem) + r'\.shard-(\d+)-of-(\d+)' + re.escape(dot + suffixes) + '$')
+    found = {}
+    for candidate in path.parent.glob(f"{stem}.shard-*"):
+        match = pattern.match(candidate.name)
+        if match:
+            found[(int(match.group(2)), int(match.group(1)))] = candidate
+    counts = {count for count, _ in found}
+    if len(counts) != 1:
+        raise ValueError(f"Expected the shards of one run for {path}, found {len(counts)}")
+    count = counts.pop()
+    missing = [number for number in range(count) if (count, number) not in found]
+    if missing:
+        raise ValueError(f"Missing shards {missing} of {count} for {path}")
+    return [found[(count, number)] for number in range(count)]
+
+def _write_atomically(path: Path, data: bytes):
+    temporary = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(temporary, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+class WorkQueue:
+    # A coordinator-free queue of input chunks in a directory that all
+    # workers can reach. A worker owns a chunk while it holds its lease file,
+    # created with O_EXCL so exactly one worker wins it, and keeps the lease
+    # fresh while it works. A lease that goes stale (its worker died) is
+    # renamed away, which only one worker can do, and checked afterwards to
+    # still be the stale one, since it may have been replaced in between;
+    # otherwise it is put back. Leases record their worker, and a worker only
+    # renews or removes its own. A chunk is finished once its `.done` file
+    # exists; its output is renamed into place just before that.
+    def __init__(self, work_dir, lease_timeout: float = DEFAULT_LEASE_TIMEOUT, worker: Optional[str] = None):
+        self.dir = Path(work_dir)
+        self.leases = self.dir / 'leases'
+        self.chunks_dir = self.dir / 'chunks'
+        self.leases.mkdir(parents=True, exist_ok=True)
+        self.chunks_dir.mkdir(parents=True, exist_ok=True)
+        self.lease_timeout = lease_timeout
+        self.worker = worker or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.plan: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def exists(cls, work_dir) -> bool:
+        return (Path(work_dir) / PLAN).exists()
+
+    def create_plan(self, plan: Dict[str, Any]) -> Dict[str, Any]:
+        # The first worker's plan wins; later workers must agree with it
+        path = self.dir / PLAN
+        temporary = path.with_name(f"{PLAN}.{uuid.uuid4().hex}.tmp")
+        temporary.write_text(json.dumps(plan))
+        try:
+            os.link(temporary, path)
+        except FileExistsError:
+            pass
+        finally:
+            temporary.unlink()
+        self.plan = self.load_plan()
+        if self.plan != plan:
+            raise ValueError(f"Work directory {self.dir} holds a different job: {self.plan}")
+        return self.plan
+
+    def load_plan(self) -> Dict[str, Any]:
+        self.plan = json.loads((self.dir / PLAN).read_text())
+        return self.plan
+
+    def output_path(self, chunk: int) -> Path:
+        return self.chunks_dir / f"{chunk:08d}.jsonl"
+
+    def temporary_output_path(self, chunk: int) -> Path:
+        return self.chunks_dir / f"{chunk:08d}.{uuid.uuid4().hex}.tmp.jsonl"
+
+    def _done_path(self, chunk: int) -> Path:
+        return self.chunks_dir / f"{chunk:08d}.done"
+
+    def _lease_path(self, chunk: int) -> Path:
+        return self.leases / f"{chunk:08d}.lease"
+
+    def is_done(self, chunk: int) -> bool:
+        return self._done_path(chunk).exists()
+
+    def claim(self, chunk: int) -> bool:
+        if self.is_done(chunk):
+            return False
+        lease = self._lease_path(chunk)
+        for _ in range(2):
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._break_stale(lease):
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.worker)
+            if self.is_done(chunk):
+                # Finished by the previous holder between our checks
+                self._release(lease)
+                return False
+            return True
+        return False
+
+    @staticmethod
+    def _read_lease(lease: Path) -> Optional[Tuple[str, int]]:
+        # (owner, mtime in ns) of a lease, or None if there is none
+        try:
+            with open(lease) as f:
+                return f.read(), os.fstat(f.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _take(self, lease: Path, expected: Tuple[str, int]) -> bool:
+        # Moves the lease aside, which only one worker can do, and keeps it
+        # there only if it is still the one `expected`; a lease renewed or
+        # replaced in the meantime is put back. True if no lease is left.
+        aside = lease.with_name(f"{lease.name}.{uuid.uuid4().hex}.taken")
+        try:
+            os.rename(lease, aside)
+        except FileNotFoundError:
+            return True
+        taken = self._read_lease(aside) == expected
+        if not taken:
+            with contextlib.suppress(FileExistsError):
+                os.link(aside, lease)  # Unless a newer lease already took its place
+        aside.unlink()
+        return taken
+
+    def _break_stale(self, lease: Path) -> bool:
+        current = self._read_lease(lease)
+        if current is None:
+            return True  # Released meanwhile, try again
+        if time.time() - current[1] / 1e9 < self.lease_timeout:
+            return False
+        return self._take(lease, current)
+
+    def _release(self, lease: Path):
+        # Only ever removes this worker's own lease
+        current = self._read_lease(lease)
+        if current is not None and current[0] == self.worker:
+            self._take(lease, current)
+
+    @contextlib.contextmanager
+    def _heartbeat(self, chunk: int):
+        lease = self._lease_path(chunk)
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_timeout / 3):
+                current = self._read_lease(lease)
+                if current is not None and current[0] == self.worker:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.utime(lease)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            self._release(lease)
+
+    def claimed(self) -> Iterator[int]:
+        # Yields each chunk this worker wins, holding its lease until the
+        # caller asks for the next one
+        for chunk in range(self.plan['chunks']):
+            if self.claim(chunk):
+                with self._heartbeat(chunk):
+                    yield chunk
+
+    def complete(self, chunk: int, output: Path, summary: Dict[str, Any]):
+        os.replace(output, self.output_path(chunk))
+        _write_atomically(self._done_path(chunk), json.dumps(dict(summary, worker=self.worker)).encode())
+
+    def pending(self) -> List[int]:
+        return [chunk for chunk in range(self.plan['chunks']) if not self.is_done(chunk)]
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        return [json.loads(self._done_path(chunk).read_text()) for chunk in range(self.plan['chunks'])]
@@ -1,7 +1,11 @@
+import json
 import tempfile
+import time
 import yaml
+from pathlib import Path
 from unittest.mock import patch
-from dset.operations import batch_operation
+from dset.operations import batch_operation, STEP_DEFAULTS
+from dset.pipeline import plan_steps
 from dset.config import Config
 import argparse
 
@@ -42,13 +46,13 @@ def test_batch_operation():
             mock_filter.assert_called_once()
 
             # Check the arguments passed to generate_operation
-            generate_args = mock_generate.call_args[0][0]
+            generate_args = mock_generate.call_args[0][0].args
             assert generate_args.output == "generated_data.jsonl"
             assert generate_args.raw_user_prompt == "Generate a simple profile with name, age (over 30), and favorite color"
             assert generate_args.num_entries == 5
 
             # Check the arguments passed to filter_operation
-            filter_args = mock_filter.call_args[0][0]
+            filter_args = mock_filter.call_args[0][0].args
             assert filter_args.input == "generated_data.jsonl"
             assert filter_args.output == "verified_data.jsonl"
             assert filter_args.raw_user_prompt == "Verify that all fields (name, age, favorite color) are populated, the entry looks correct according to the prompt, and the age is over 30"
@@ -58,6 +62,157 @@ def test_batch_operation():
         import os
         os.unlink(temp_file_path)
 
+def write_steps(yaml_content):
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as temp_file:
+        temp_file.write(yaml_content)
+    return temp_file.name
+
+def test_batch_operation_streams_generated_entries_into_filter():
+    work_dir = Path(tempfile.mkdtemp())
+    yaml_file = write_steps(f"""
+    steps:
+      - operation: generate
+        output: {work_dir / "generated.jsonl"}
+        raw_user_prompt: "Profiles"
+        num_entries: 6
+        entries_per_request: 1
+      - operation: filter
+        input: {work_dir / "generated.jsonl"}
+        output: {work_dir / "verified.jsonl"}
+        raw_user_prompt: "Has an even id"
+    """)
+    events = []
+
+    def generate(config, prompt, count, seed):
+        time.sleep(0.02)
+        events.append("generate")
+        return [{"id": seed}]
+
+    def ask(config, question):
+        events.append("filter")
+        return {"answer": json.loads(question.split("Entry: ")[1])["id"] % 2 == 0, "reason": "Mock reason"}
+
+    config = Config(args=argparse.Namespace(yaml_file=yaml_file), smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+    with patch('dset.operations.generate_entries', side_effect=generate), \
+         patch('dset.operations.ask_yes_no_question', side_effect=ask):
+        assert batch_operation(config)
+
+    # filter scored entries while generate was still producing them
+    assert events.index("filter") < len(events) - 1 - events[::-1].index("generate")
+    with open(work_dir / "generated.jsonl") as f:
+        assert [json.loads(line)["id"] for line in f] == list(range(6))
+    with open(work_dir / "verified.jsonl") as f:
+        assert [json.loads(line)["id"] for line in f] == [0, 2, 4]
+
+def test_batch_operation_runs_independent_steps_concurrently():
+    yaml_file = write_steps("""
+    steps:
+      - operation: generate
+        name: a
+        output: a.jsonl
+      - operation: generate
+        name: b
+        output: b.jsonl
+      - operation: merge
+        input: a.jsonl,b.jsonl
+        output: merged.jsonl
+    """)
+    running = []
+    overlapped = []
+
+    def generate(config):
+        running.append(config.args.output)
+        time.sleep(0.1)
+        overlapped.append(len(running) == 2)
+        return True
+
+    def merge(config):
+        assert len(overlapped) == 2
+        return True
+
+    config = Config(args=argparse.Namespace(yaml_file=yaml_file), smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+    with patch('dset.operations.generate_operation', side_effect=generate), \
+         patch('dset.operations.merge_operation', side_effect=merge) as mock_merge:
+        assert batch_operation(config)
+
+    assert all(overlapped)
+    mock_merge.assert_called_once()
+
+def test_batch_operation_fails_consumer_when_producer_fails():
+    work_dir = Path(tempfile.mkdtemp())
+    yaml_file = write_steps(f"""
+    steps:
+      - operation: generate
+        output: {work_dir / "generated.jsonl"}
+        raw_user_prompt: "Profiles"
+        num_entries: 3
+        entries_per_request: 1
+      - operation: filter
+        input: {work_dir / "generated.jsonl"}
+        output: {work_dir / "verified.jsonl"}
+        raw_user_prompt: "Anything"
+    """)
+
+    def generate(config, prompt, count, seed):
+        if seed == 1:
+            raise RuntimeError("API down")
+        return [{"id": seed}]
+
+    config = Config(args=argparse.Namespace(yaml_file=yaml_file), smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+    with patch('dset.operations.generate_entries', side_effect=generate):
+        assert not batch_operation(config)
+
+def test_batch_operation_waits_for_directory_outputs():
+    work_dir = Path(tempfile.mkdtemp())
+    yaml_file = write_steps(f"""
+    steps:
+      - operation: generate
+        output: {work_dir / "data"}
+        raw_user_prompt: "Profiles"
+        num_entries: 4
+        entries_per_request: 1
+      - operation: filter
+        input: {work_dir / "data" / "generated.jsonl"}
+        output: {work_dir / "verified.jsonl"}
+        raw_user_prompt: "Anything"
+    """)
+
+    def generate(config, prompt, count, seed):
+        time.sleep(0.02)
+        return [{"id": seed}]
+
+    config = Config(args=argparse.Namespace(yaml_file=yaml_file), smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+    with patch('dset.operations.generate_entries', side_effect=generate), \
+         patch('dset.operations.ask_yes_no_question', return_value={"answer": True, "reason": "Mock reason"}):
+        assert batch_operation(config)
+
+    with open(work_dir / "verified.jsonl") as f:
+        assert [json.loads(line)["id"] for line in f] == list(range(4))
+
+def test_plan_steps_orders_steps_with_overlapping_files():
+    steps = plan_steps([
+        {"operation": "ask", "input": "a.jsonl"},
+        {"operation": "assert", "input": "b.jsonl"},
+        {"operation": "assert", "input": "b.jsonl", "reasons_output": "b-reasons.jsonl"},
+        {"operation": "split", "input": "a.jsonl", "output": "out/part"},
+        {"operation": "merge", "input": "out", "output": "merged.jsonl"},
+        {"operation": "ingest", "requests_file": "requests.jsonl", "results_file": "results.jsonl"},
+        {"operation": "filter", "input": "c.jsonl", "output": "d.jsonl"},
+    ], STEP_DEFAULTS)
+
+    # Both default to reasons.jsonl
+    assert steps[1].after == {0}
+    assert steps[2].after == set()
+    assert steps[4].after == {3}
+    # Nothing is known about what ingest touches, so it keeps the YAML order
+    assert steps[5].after == {0, 1, 2, 3, 4}
+    assert steps[6].after == {5}
+
 if __name__ == "__main__":
     test_batch_operation()
+    test_batch_operation_streams_generated_entries_into_filter()
+    test_batch_operation_runs_independent_steps_concurrently()
+    test_batch_operation_fails_consumer_when_producer_fails()
+    test_batch_operation_waits_for_directory_outputs()
+    test_plan_steps_orders_steps_with_overlapping_files()
     print("All tests passed!")
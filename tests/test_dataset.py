@@ -0,0 +1,183 @@
+import json
+import random
+import tempfile
+import pytest
+from pathlib import Path
+from unittest.mock import patch
+from dset import index
+from dset.dataset import ReadableDataSet, WriteableDataSet
+
+def create_test_directory(files):
+    temp_dir = Path(tempfile.mkdtemp())
+    for name, data in files.items():
+        with open(temp_dir / name, 'w') as f:
+            for item in data:
+                json.dump(item, f)
+                f.write('\n')
+    return temp_dir
+
+def test_parallel_read_matches_serial_read():
+    files = {f"part_{i}.jsonl": [{"file": i, "id": j, "text": "x" * (j % 7)} for j in range(40)] for i in range(3)}
+    input_dir = create_test_directory(files)
+    serial = list(ReadableDataSet(input_dir).entries())
+
+    with patch('dset.dataset.RANGE_SIZE', 97):
+        ordered = list(ReadableDataSet(input_dir, workers=3).entries())
+        unordered = list(ReadableDataSet(input_dir, workers=3, ordered=False).entries())
+
+    assert len(serial) == 120
+    assert ordered == serial
+    assert sorted(unordered, key=lambda e: (e["file"], e["id"])) == serial
+
+def test_codec_backends_agree():
+    from dset import codec
+    entry = {"b": 1, "a": ["ü", 2.5, None], "big": 2 ** 70}
+    encoded = codec.dumps(entry)
+    canonical = codec.dumps_canonical(entry)
+
+    with patch('dset.codec.orjson', None), patch('dset.codec.msgspec', None):
+        assert codec.dumps(entry) == encoded
+        assert codec.dumps_canonical(entry) == canonical
+        assert codec.loads(encoded) == entry
+
+    assert codec.loads(encoded) == entry
+    assert canonical.startswith(b'{"a":')
+
+    # The fast encoders write non-finite floats as null, which would make
+    # NaN and None compare equal when deduplicating
+    for value in (float("nan"), float("inf"), float("-inf")):
+        entry = {"x": [{"y": value}]}
+        encoded = codec.dumps(entry)
+        canonical = codec.dumps_canonical(entry)
+        with patch('dset.codec.orjson', None), patch('dset.codec.msgspec', None):
+            assert codec.dumps(entry) == encoded
+            assert codec.dumps_canonical(entry) == canonical
+        assert canonical != codec.dumps_canonical({"x": [{"y": None}]})
+        assert repr(codec.loads(encoded)) == repr(entry)
+
+def test_big_integers_and_nan_survive_parsing():
+    from dset import codec
+    directory = create_test_directory({})
+    with open(directory / "data.jsonl", "w") as f:
+        f.write('{"id": 18446744073709551617}\n{"id": 18446744073709551618}\n{"id": NaN, "x": Infinity}\n')
+
+    entries = list(ReadableDataSet(directory).entries())
+    assert [entry["id"] for entry in entries[:2]] == [18446744073709551617, 18446744073709551618]
+    assert all(isinstance(entry["id"], int) for entry in entries[:2])
+    assert codec.dumps_canonical(entries[0]) != codec.dumps_canonical(entries[1])
+    assert entries[2]["x"] == float("inf")
+
+def test_resume_past_end_of_output_is_refused():
+    path = create_test_directory({"out.jsonl": [{"id": 1}]}) / "out.jsonl"
+    size = path.stat().st_size
+    with pytest.raises(ValueError, match="Cannot resume"):
+        with WriteableDataSet(path, resume_at=size + 100):
+            pass
+    assert path.stat().st_size == size
+
+def test_records_keep_raw_lines():
+    input_dir = Path(tempfile.mkdtemp())
+    raw = b'{"b": 1,   "a": 2}\n{"c":3}'
+    (input_dir / "data.jsonl").write_bytes(raw)
+
+    records = list(ReadableDataSet(input_dir).records())
+    assert [r.entry for r in records] == [{"b": 1, "a": 2}, {"c": 3}]
+    assert b"".join(r.line for r in records) == raw
+    assert records[-1].offset == len(raw)
+
+def test_compressed_datasets_round_trip():
+    from dset import compression
+    from dset.dataset import WriteableDataSet
+    entries = [{"id": i, "text": "compress me " * 10} for i in range(50)]
+    output_dir = Path(tempfile.mkdtemp())
+
+    suffixes = [".jsonl", ".jsonl.gz"] + ([".jsonl.zst"] if compression.zstandard else [])
+    for suffix in suffixes:
+        with WriteableDataSet(output_dir / f"data{suffix}", threads=2) as output_dataset:
+            for entry in entries:
+                output_dataset.write(entry)
+
+    assert list(ReadableDataSet(output_dir / "data.jsonl.gz").entries()) == entries
+    assert list(ReadableDataSet(output_dir).entries()) == entries * len(suffixes)
+    assert (output_dir / "data.jsonl.gz").stat().st_size < (output_dir / "data.jsonl").stat().st_size
+
+    # Detected by magic bytes even without the extension
+    (output_dir / "data.jsonl.gz").rename(output_dir / "renamed.bin")
+    assert list(ReadableDataSet(output_dir / "renamed.bin").entries()) == entries
+
+    with patch('dset.dataset.RANGE_SIZE', 97):
+        assert list(ReadableDataSet(output_dir, workers=2).entries()) == entries * (len(suffixes) - 1)
+
+def test_parquet_round_trip_with_projection():
+    import pytest
+    pytest.importorskip("pyarrow")
+    from dset.dataset import WriteableDataSet
+    entries = [{"id": i, "name": f"person {i}", "age": 20 + i} for i in range(10)]
+    output_dir = Path(tempfile.mkdtemp())
+
+    with WriteableDataSet(output_dir / "data.parquet") as output_dataset:
+        for entry in entries:
+            output_dataset.write(entry)
+
+    dataset = ReadableDataSet(output_dir / "data.parquet", columns=["age"])
+    records = list(dataset.records())
+    assert dataset.field_names() == ["id", "name", "age"]
+    assert [r.entry for r in records] == [{"age": e["age"]} for e in entries]
+    assert list(dataset.records(start=(str(output_dir / "data.parquet"), 7)))[0].entry == {"age": 27}
+
+    # Projected records still write out whole rows, in either format
+    with WriteableDataSet(output_dir / "copy.parquet") as parquet_copy, WriteableDataSet(output_dir / "copy.jsonl") as jsonl_copy:
+        for record in records[::2]:
+            parquet_copy.write_record(record)
+            jsonl_copy.write_record(record)
+
+    assert list(ReadableDataSet(output_dir / "copy.parquet").entries()) == entries[::2]
+    assert list(ReadableDataSet(output_dir / "copy.jsonl").entries()) == entries[::2]
+
+def test_parquet_sink_gathers_rows_in_order():
+    pa = pytest.importorskip("pyarrow")
+    from dset import parquet
+    first = pa.RecordBatch.from_pylist([{"id": i, "name": f"a{i}"} for i in range(6)])
+    second = pa.RecordBatch.from_pylist([{"id": 100 + i, "name": f"b{i}"} for i in range(4)])
+    path = Path(tempfile.mkdtemp()) / "out.parquet"
+
+    sink = parquet.ParquetSink(path, batch_size=4)
+    for batch, index in [(first, 1), (first, 4), (second, 0), (first, 5), (second, 3)]:
+        sink.write_slice(batch, index)
+    sink.write_entry({"id": 7, "name": "dict"})
+    sink.write_slice(second, 2)
+    sink.close()
+
+    assert [entry["id"] for entry in ReadableDataSet(path).entries()] == [1, 4, 100, 5, 103, 7, 102]
+
+def test_line_index_random_access_and_invalidation():
+    directory = create_test_directory({"a.jsonl": [{"id": i} for i in range(5)]})
+    with open(directory / "b.jsonl", "w") as f:
+        f.write('{"id": 5}\n{"id": 6}')  # No trailing newline
+
+    dataset = ReadableDataSet(directory)
+    assert len(dataset) == 7
+    assert dataset[0] == {"id": 0} and dataset[5] == {"id": 5} and dataset[-1] == {"id": 6}
+    assert dataset[3:6] == [{"id": 3}, {"id": 4}, {"id": 5}]
+    assert dataset[::3] == [{"id": 0}, {"id": 3}, {"id": 6}]
+    assert [record.entry["id"] for number in range(3) for record in dataset.shard(number, 3)] == list(range(7))
+    assert [dataset.line_number((record.path, record.offset)) for record in dataset.records()] == list(range(1, 8))
+    sample = dataset.sample(4, random.Random(0))
+    assert len({record.entry["id"] for record in sample}) == 4
+    # Sidecars are only written when asked for, as `dset index` does
+    assert not (directory / "a.jsonl.idx").exists()
+    assert len(ReadableDataSet(directory, keep_index=True)) == 7
+    assert (directory / "a.jsonl.idx").exists()
+
+    with open(directory / "a.jsonl", "a") as f:
+        f.write('{"id": 99}\n')
+    assert len(ReadableDataSet(directory)) == 8
+    assert ReadableDataSet(directory)[5] == {"id": 99}
+
+def test_line_index_scans_agree_without_numpy():
+    path = create_test_directory({"data.jsonl": [{"text": "x" * i} for i in range(50)]}) / "data.jsonl"
+    with_numpy = index.LineIndex.build(path, persist=True)
+    with patch.object(index, 'np', None):
+        without_numpy = index.LineIndex.build(path)
+        assert [without_numpy.span(i) for i in range(50)] == [with_numpy.span(i) for i in range(50)]
+        assert len(index.LineIndex.load(path)) == 50
@@ -0,0 +1,56 @@
+import random
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+from dset.dedup import Deduplicator, BYTES_PER_HASH
+from dset.neardup import MinHasher, NearDuplicateIndex, shingles
+
+def test_deduplicator_spills_to_disk():
+    spill_parent = tempfile.mkdtemp()
+    with Deduplicator(memory_budget=10 * BYTES_PER_HASH, spill_dir=spill_parent) as deduplicator:
+        assert all(deduplicator.add(f"entry {i}".encode()) for i in range(100))
+        assert deduplicator.spilled >= 90
+        assert not any(deduplicator.add(f"entry {i}".encode()) for i in range(100))
+        assert deduplicator.add(b"entry 100")
+    assert list(Path(spill_parent).iterdir()) == []
+
+def test_deduplicator_with_bloom_filter():
+    with Deduplicator(memory_budget=40 * BYTES_PER_HASH, bloom=True) as deduplicator:
+        assert all(deduplicator.add(f"entry {i}".encode()) for i in range(200))
+        assert not any(deduplicator.add(f"entry {i}".encode()) for i in range(200))
+        assert all(deduplicator.add(f"other {i}".encode()) for i in range(200))
+
+def test_near_duplicate_index():
+    base = "the quick brown fox jumps over the lazy dog while the cat sleeps in the warm afternoon sun by the old barn"
+    near = base.replace("old barn", "old red barn")
+    other = "an entirely different sentence about datasets, language models and the cost of deduplication at scale"
+
+    with NearDuplicateIndex(threshold=0.7, shingle_size=3, fields=["text"]) as index:
+        assert index.add({"id": 1, "text": base})
+        assert not index.add({"id": 2, "text": near})
+        assert index.add({"id": 3, "text": other})
+
+def test_near_duplicate_index_keeps_entries_without_text():
+    with NearDuplicateIndex(fields=["text"]) as index:
+        assert all(index.add({"id": i}) for i in range(5))
+        assert all(index.add({"id": i, "text": " ... "}) for i in range(5))
+
+def test_near_duplicate_index_checks_candidate_similarity():
+    rng = random.Random(3)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    kept = 0
+    with NearDuplicateIndex(threshold=0.8, shingle_size=1, fields=["text"]) as index:
+        for _ in range(200):
+            words = rng.sample(vocabulary, 40)
+            # 32 of 40 words shared: Jaccard 2/3, often sharing a band but below 0.8
+            variant = words[:32] + rng.sample(vocabulary, 8)
+            kept += index.add({"text": " ".join(words)})
+            kept += index.add({"text": " ".join(variant)})
+    assert kept == 400
+
+def test_minhash_numpy_and_python_agree():
+    hashes = shingles("one two three four five six seven eight", 3)
+    hasher = MinHasher(64)
+    vectorized = hasher.signature(hashes)
+    with patch('dset.neardup.np', None):
+        assert hasher.signature(hashes) == vectorized
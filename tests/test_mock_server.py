@@ -0,0 +1,68 @@
+import json
+import time
+import socket
+import struct
+from argparse import Namespace
+from dset.config import Config
+from dset.mock_server import MockServer, percentile
+from dset.openai_api import OpenAIClient, ask_yes_no_question, ask_yes_no_question_streaming, ask_yes_no_batch, generate_entries
+from dset.ratelimit import RetryPolicy
+
+def make_config(server):
+    client = OpenAIClient(base_url=server.url, retry_policy=RetryPolicy(max_retries=20, base_delay=0.001, max_delay=0.01))
+    return Config(args=Namespace(), smart_model="gpt-4", fast_model="gpt-3.5-turbo", client=client)
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([3, 1, 2], 0.5) == 2
+    assert percentile(list(range(1, 101)), 0.99) == 99
+
+def test_mock_server_answers_every_request_shape():
+    with MockServer(latency=0.001, distribution='exponential', seed=1) as server:
+        config = make_config(server)
+        answer = ask_yes_no_question(config, "Is it?")
+        assert isinstance(answer["answer"], bool) and answer["reason"] == "Mock reason."
+        assert ask_yes_no_question_streaming(config, "Is it?") == answer
+
+        entries = [{"id": i} for i in range(20)]
+        answers = ask_yes_no_batch(config, "Is it?", entries, str, confidence=True)
+        assert len(answers) == 20 and 0 < sum(result["answer"] for result in answers) < 20
+        assert all(result["confidence"] in (0.5, 1.0) for result in answers)
+        assert ask_yes_no_batch(config, "Is it?", entries, str) == [{k: v for k, v in result.items() if k != "confidence"} for result in answers]
+
+        generated = generate_entries(config, "People", 5, seed=3)
+        assert len(generated) == 5 and generated == generate_entries(config, "People", 5, seed=3)
+        assert server.stats()["statuses"] == {200: 6}
+
+def test_mock_server_failures_are_retried():
+    with MockServer(latency=0, distribution='fixed', error_rate=0.2, rate_limit_rate=0.2, retry_after=0.001, seed=2) as server:
+        config = make_config(server)
+        for i in range(30):
+            ask_yes_no_question(config, f"Question {i}?")
+        stats = server.stats()
+        assert stats["statuses"][200] == 30 and stats["statuses"][429] > 0 and stats["statuses"][500] > 0
+        assert stats["p50"] <= stats["p99"]
+
+def test_mock_server_responds_without_delayed_acks():
+    # Headers and body are written separately; with Nagle's algorithm on, each
+    # response would wait about 40 ms for the client's delayed ACK
+    with MockServer(latency=0, distribution='fixed') as server:
+        config = make_config(server)
+        ask_yes_no_question(config, "Warm up?")
+        started = time.monotonic()
+        for i in range(20):
+            ask_yes_no_question(config, f"Question {i}?")
+        assert (time.monotonic() - started) / 20 < 0.02
+
+def test_mock_server_ignores_clients_hanging_up(capsys):
+    with MockServer(latency=0, distribution='fixed') as server:
+        host, port = server.server.server_address[:2]
+        body = json.dumps({"messages": [{"role": "user", "content": "Is it?"}]}).encode()
+        with socket.create_connection((host, port)) as connection:
+            connection.sendall(b"POST /v1/chat/completions HTTP/1.1\r\nHost: mock\r\n"
+                               + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            assert connection.recv(4096).startswith(b"HTTP/1.1 200")
+            # Close with a reset rather than a FIN, like a killed client
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        time.sleep(0.1)
+    assert "Traceback" not in capsys.readouterr().err
@@ -0,0 +1,159 @@
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from argparse import Namespace
+from unittest.mock import patch, MagicMock
+from dset.cache import ResponseCache, make_cache_key
+from dset.config import Config
+from dset.openai_api import ask_yes_no_question, ask_yes_no_question_streaming, ask_yes_no_batch, generate_entries, OpenAIClient, DEFAULT_BASE_URL
+
+def mock_response(content, status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = {}
+    response.json.return_value = {"choices": [{"message": {"content": content}}]}
+    return response
+
+def test_ask_yes_no_question_uses_cache():
+    cache = ResponseCache(tempfile.mkdtemp())
+    client = OpenAIClient(api_key="test-key", cache=cache)
+    config = Config(args=Namespace(), smart_model="gpt-4", fast_model="gpt-3.5-turbo", cache=cache, client=client)
+
+    with patch.object(client.session, 'post', return_value=mock_response("No\nToo young")) as mock_post:
+        first = ask_yes_no_question(config, "Is Bob over 30?")
+        second = ask_yes_no_question(config, "Is Bob over 30?")
+
+    assert first == second == {"answer": False, "reason": "Too young"}
+    mock_post.assert_called_once()
+
+def test_client_uses_base_url_and_shared_session():
+    with patch.dict('os.environ', {"OPENAI_API_KEY": "env-key", "OPENAI_BASE_URL": "http://localhost:8000/v1/"}):
+        client = OpenAIClient.from_env(pool_size=4, timeout=5)
+
+    assert client.base_url == "http://localhost:8000/v1"
+    assert client.session.headers["Authorization"] == "Bearer env-key"
+    assert not client.is_mock
+
+    with patch.object(client.session, 'post', return_value=mock_response("Yes\nFine")) as mock_post:
+        assert client.chat_completion({"model": "m", "messages": []}) == "Yes\nFine"
+        assert client.chat_completion({"model": "m", "messages": []}) == "Yes\nFine"
+
+    assert mock_post.call_count == 2
+    assert mock_post.call_args[0][0] == "http://localhost:8000/v1/chat/completions"
+    assert mock_post.call_args[1]["timeout"] == 5
+
+    assert OpenAIClient().is_mock
+    assert not OpenAIClient(base_url="http://localhost:8000/v1").is_mock
+    assert OpenAIClient(base_url=DEFAULT_BASE_URL).is_mock
+
+def test_ask_yes_no_batch_falls_back_to_smaller_batches():
+    client = OpenAIClient(api_key="test-key")
+    config = Config(args=Namespace(), smart_model="gpt-4", fast_model="gpt-3.5-turbo", client=client)
+    entries = [{"age": age} for age in (25, 35, 45, 15)]
+
+    def answer(url, **kwargs):
+        data = kwargs["json"]
+        if "response_format" not in data:
+            return mock_response("No\nSingle fallback")
+        lines = data["messages"][1]["content"].split("identified by id:\n")[1].split("\n")
+        batch = [json.loads(line) for line in lines]
+        if len(batch) > 2:
+            return mock_response("not json")
+        answers = [{"id": item["id"], "answer": item["entry"]["age"] > 30, "reason": "batched"} for item in batch]
+        return mock_response(json.dumps({"answers": answers}))
+
+    with patch.object(client.session, 'post', side_effect=answer) as mock_post:
+        results = ask_yes_no_batch(config, "Is the person over 30?", entries, lambda entry: f"Over 30? {entry}")
+
+    assert [r["answer"] for r in results] == [False, True, True, False]
+    assert all(r["reason"] == "batched" for r in results)
+    assert mock_post.call_count == 3
+
+def test_generate_entries_only_uses_json_schema_for_several_entries():
+    # gpt-3.5-turbo and gpt-4 reject json_schema response formats
+    client = OpenAIClient(api_key="test-key")
+    config = Config(args=Namespace(), smart_model="gpt-4", fast_model="gpt-3.5-turbo", client=client)
+
+    with patch.object(client.session, 'post', return_value=mock_response('{"name": "Alice"}')) as mock_post:
+        assert generate_entries(config, "People", 1, seed=7) == [{"name": "Alice"}]
+    data = mock_post.call_args.kwargs["json"]
+    assert "response_format" not in data and data["seed"] == 7
+
+    with patch.object(client.session, 'post', return_value=mock_response('{"entries": [{"name": "Alice"}, {"name": "Bob"}]}')) as mock_post:
+        assert generate_entries(config, "People", 2, seed=8) == [{"name": "Alice"}, {"name": "Bob"}]
+    assert mock_post.call_args.kwargs["json"]["response_format"]["type"] == "json_schema"
+
+def test_cache_key_depends_on_model_and_prompt():
+    base = {"model": "gpt-4", "messages": [{"role": "user", "content": "a"}]}
+    assert make_cache_key(base) == make_cache_key(dict(reversed(list(base.items()))))
+    assert make_cache_key(base) != make_cache_key({**base, "model": "gpt-3.5-turbo"})
+    assert make_cache_key(base) != make_cache_key({**base, "temperature": 0})
+
+def test_cache_evicts_by_size_and_age():
+    cache = ResponseCache(tempfile.mkdtemp(), max_size=10)
+    cache.put("old", "12345678")
+    time.sleep(0.01)
+    cache.put("new", "12345678")
+    cache.evict()
+    assert cache.get("old") is None
+    assert cache.get("new") == "12345678"
+
+    cache = ResponseCache(tempfile.mkdtemp(), max_age=0)
+    cache.put("key", "value")
+    time.sleep(0.01)
+    assert cache.get("key") is None
+
+def start_sse_server(chunks, pause):
+    # Streams `chunks` as chat completion deltas, stalling for `pause` seconds
+    # after the first line so an early stop is measurable.
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_event(self, data):
+            event = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            assert body["stream"] is True
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for chunk in chunks:
+                    self.send_event(json.dumps({"choices": [{"delta": {"content": chunk}}]}))
+                    if chunk.endswith("\n"):
+                        time.sleep(pause)
+                self.send_event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def test_streaming_answer_stops_after_first_line():
+    server, url = start_sse_server(["Y", "es\n", "Because ", "it is."], pause=0.5)
+    try:
+        cache = ResponseCache(tempfile.mkdtemp())
+        config = Config(args=Namespace(), smart_model="gpt-4", fast_model="gpt-3.5-turbo", client=OpenAIClient(base_url=url, cache=cache))
+
+        started = time.monotonic()
+        assert ask_yes_no_question_streaming(config, "Is it?", need_reason=False) == {"answer": True, "reason": ""}
+        assert time.monotonic() - started < 0.4
+
+        # Partial replies aren't cached, so the full reply is fetched and then served from the cache
+        assert ask_yes_no_question_streaming(config, "Is it?") == {"answer": True, "reason": "Because it is."}
+        server.shutdown()
+        assert ask_yes_no_question(config, "Is it?") == {"answer": True, "reason": "Because it is."}
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -1,10 +1,13 @@
 import tempfile
 import json
+import random
+import time
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 from argparse import Namespace
 from dset.config import Config
-from dset.operations import filter_operation, merge_operation, split_operation, ask_operation, generate_operation
+from dset.openai_api import OpenAIClient
+from dset.operations import filter_operation, merge_operation, split_operation, ask_operation, assert_operation, generate_operation, ingest_operation, gather_operation
 
 def create_test_data(data, is_dir=False):
     if is_dir:
@@ -89,6 +92,39 @@ def test_generate_operation(mock_generate_text):
     
     assert generate_operation(config)
 
+def test_generate_operation_without_api_key_fills_partial_rounds():
+    output_file = Path(tempfile.mkdtemp()) / "people.jsonl"
+    args = Namespace(output_path=output_file, raw_user_prompt="People", num_entries=25)
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo", client=OpenAIClient())
+
+    assert generate_operation(config)
+    with open(output_file) as f:
+        assert len(f.readlines()) == 25
+
+def test_generate_operation_batches_and_drops_duplicates():
+    output_dir = tempfile.mkdtemp()
+    calls = []
+
+    def generate(config, prompt, count, seed):
+        calls.append((seed, count))
+        # Every call of more than one entry repeats the same last entry
+        entries = [{"n": seed * 100 + i + 1} for i in range(count)]
+        if count > 1:
+            entries[-1] = {"n": 0}
+        return entries
+
+    args = Namespace(output_path=Path(output_dir), raw_user_prompt="Numbers", num_entries=7, entries_per_request=3, concurrency=2)
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+
+    with patch('dset.operations.generate_entries', side_effect=generate):
+        assert generate_operation(config)
+
+    with open(Path(output_dir) / "generated.jsonl") as f:
+        entries = [json.loads(line) for line in f]
+    assert len(entries) == 7 and len({entry["n"] for entry in entries}) == 7
+    assert calls[:3] == [(0, 3), (1, 3), (2, 1)]
+    assert len(calls) == 4
+
 def test_merge_operation_with_empty_file():
     test_data1 = [{"id": 1, "name": "Alice"}, {"id": 2, "name": "Bob"}]
     test_data2 = []
@@ -127,13 +163,310 @@ def test_filter_operation_error_with_file_output_for_directory_input():
     else:
         assert False, "Expected ValueError was not raised"
 
+def test_filter_operation_concurrent_preserves_order():
+    test_data = [{"id": i, "age": 20 + i} for i in range(50)]
+    input_file = create_test_data(test_data)
+    output_dir = tempfile.mkdtemp()
+
+    def slow_ask(config, question):
+        entry = json.loads(question.split("Entry: ", 1)[1])
+        time.sleep(random.uniform(0, 0.01))
+        return {"answer": entry["age"] % 2 == 0, "reason": "Mock reason"}
+
+    args = Namespace(input_path=Path(input_file), output_path=Path(output_dir), raw_user_prompt="age is even", concurrency=8)
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+
+    with patch('dset.operations.ask_yes_no_question', side_effect=slow_ask):
+        assert filter_operation(config)
+
+    with open(Path(output_dir) / "filtered.jsonl") as f:
+        ids = [json.loads(line)["id"] for line in f]
+    assert ids == list(range(0, 50, 2))
+
+def test_filter_operation_batch_export_and_ingest():
+    test_data = [{"name": "Alice", "age": 30}, {"name": "Bob", "age": 25}, {"name": "Charlie", "age": 35}]
+    input_file = create_test_data(test_data)
+    output_dir = Path(tempfile.mkdtemp()) / "filtered"
+    requests_file = Path(tempfile.mkdtemp()) / "requests.jsonl"
+    results_file = Path(tempfile.mkdtemp()) / "results.jsonl"
+
+    args = Namespace(input_path=Path(input_file), output_path=output_dir, raw_user_prompt="age greater than 28", batch_export=str(requests_file))
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+    assert filter_operation(config)
+    # Exporting doesn't write any output, so it doesn't create the output directory either
+    assert not output_dir.exists()
+
+    # Answer the exported requests the way the Batch API would, in shuffled order
+    with open(requests_file) as f:
+        batch_requests = [json.loads(line) for line in f]
+    assert len(batch_requests) == 3
+    assert all(r["url"] == "/v1/chat/completions" for r in batch_requests)
+    random.shuffle(batch_requests)
+    with open(results_file, 'w') as f:
+        for request in batch_requests:
+            entry = json.loads(request["body"]["messages"][1]["content"].split("Entry: ", 1)[1])
+            content = "Yes\nOld enough" if entry["age"] > 28 else "No\nToo young"
+            response = {"status_code": 200, "body": {"choices": [{"message": {"role": "assistant", "content": content}}]}}
+            f.write(json.dumps({"id": "batch_req_1", "custom_id": request["custom_id"], "response": response, "error": None}) + "\n")
+
+    config = Config(args=Namespace(requests_file=str(requests_file), results_file=str(results_file)), smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+    assert ingest_operation(config)
+
+    with open(Path(output_dir) / "filtered.jsonl") as f:
+        assert [json.loads(line)["name"] for line in f] == ["Alice", "Charlie"]
+
+def check_filter_resumes_from_checkpoint(input_file):
+    output_dir = tempfile.mkdtemp()
+    asked = []
+
+    def crashing_ask(config, question):
+        entry = json.loads(question.split("Entry: ", 1)[1])
+        if entry["id"] == 13:
+            raise KeyboardInterrupt
+        asked.append(entry["id"])
+        return {"answer": entry["age"] % 2 == 0, "reason": "Mock reason"}
+
+    args = Namespace(input_path=Path(input_file), output_path=Path(output_dir), raw_user_prompt="age is even", checkpoint_interval=5, resume=False)
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+
+    with patch('dset.operations.ask_yes_no_question', side_effect=crashing_ask):
+        try:
+            filter_operation(config)
+        except KeyboardInterrupt:
+            pass
+        else:
+            assert False, "Expected the run to be interrupted"
+
+    checkpoint_file = Path(output_dir) / "filtered.jsonl.checkpoint.json"
+    assert checkpoint_file.exists()
+
+    asked.clear()
+
+    def ask(config, question):
+        entry = json.loads(question.split("Entry: ", 1)[1])
+        asked.append(entry["id"])
+        return {"answer": entry["age"] % 2 == 0, "reason": "Mock reason"}
+
+    args.resume = True
+    with patch('dset.operations.ask_yes_no_question', side_effect=ask):
+        assert filter_operation(config)
+
+    assert asked == list(range(10, 20))
+    assert not checkpoint_file.exists()
+    with open(Path(output_dir) / "filtered.jsonl") as f:
+        assert [json.loads(line)["id"] for line in f] == list(range(0, 20, 2))
+
+def test_filter_operation_resumes_from_checkpoint():
+    check_filter_resumes_from_checkpoint(create_test_data([{"id": i, "age": 20 + i} for i in range(20)]))
+
+def test_filter_operation_resumes_from_compressed_input():
+    # Decompressing readers can't seek to the checkpoint's offset
+    from dset import compression
+    for name in ["input.jsonl.gz"] + (["input.jsonl.zst"] if compression.zstandard else []):
+        input_file = Path(tempfile.mkdtemp()) / name
+        with compression.open_write(input_file) as f:
+            for i in range(20):
+                f.write(json.dumps({"id": i, "age": 20 + i}).encode() + b"\n")
+        check_filter_resumes_from_checkpoint(input_file)
+
+def test_filter_operation_fresh_run_discards_old_checkpoint():
+    input_file = create_test_data([{"id": i} for i in range(20)])
+    output_dir = tempfile.mkdtemp()
+    output_file = Path(output_dir) / "filtered.jsonl"
+
+    def crash_at(stop):
+        def ask(config, question):
+            if json.loads(question.split("Entry: ", 1)[1])["id"] == stop:
+                raise KeyboardInterrupt
+            return {"answer": True, "reason": "Mock reason"}
+        return ask
+
+    args = Namespace(input_path=Path(input_file), output_path=Path(output_dir), raw_user_prompt="Any", checkpoint_interval=5, resume=False)
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+    # The first run checkpoints; the second starts over and crashes before its first checkpoint
+    for stop in (17, 2):
+        with patch('dset.operations.ask_yes_no_question', side_effect=crash_at(stop)):
+            try:
+                filter_operation(config)
+            except KeyboardInterrupt:
+                pass
+
+    args.resume = True
+    with patch('dset.operations.ask_yes_no_question', return_value={"answer": True, "reason": "Mock reason"}):
+        assert filter_operation(config)
+    assert b"\0" not in output_file.read_bytes()
+    with open(output_file) as f:
+        assert [json.loads(line)["id"] for line in f] == list(range(20))
+
+def test_filter_operation_only_shows_referenced_fields():
+    test_data = [{"name": "Alice", "age": 30, "bio": "x" * 100}, {"name": "Bob", "age": 25, "bio": "y" * 100}]
+    input_file = create_test_data(test_data)
+    output_dir = tempfile.mkdtemp()
+    questions = []
+
+    def ask(config, question):
+        questions.append(question)
+        return {"answer": "30" in question, "reason": "Mock reason"}
+
+    args = Namespace(input_path=Path(input_file), output_path=Path(output_dir), raw_user_prompt="Age greater than 28", fields="auto")
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+
+    with patch('dset.operations.ask_yes_no_question', side_effect=ask):
+        assert filter_operation(config)
+
+    assert all("bio" not in question and "name" not in question for question in questions)
+    with open(Path(output_dir) / "filtered.jsonl") as f:
+        assert [json.loads(line) for line in f] == test_data[:1]
+
+def test_filter_operation_where_skips_llm_for_rejected_entries():
+    test_data = [{"name": "Alice", "age": 30, "bio": "a"}, {"name": "Bob", "age": 15, "bio": "b"}, {"name": "Eve", "bio": "c"}]
+    input_file = create_test_data(test_data)
+    output_dir = tempfile.mkdtemp()
+    questions = []
+
+    def ask(config, question):
+        questions.append(question)
+        return {"answer": True, "reason": "Mock reason"}
+
+    args = Namespace(input_path=Path(input_file), output_path=Path(output_dir), raw_user_prompt="Has a bio",
+                     fields="bio", where="age >= 18")
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+
+    with patch('dset.operations.ask_yes_no_question', side_effect=ask):
+        assert filter_operation(config)
+
+    assert len(questions) == 1 and "age" not in questions[0]
+    with open(Path(output_dir) / "filtered.jsonl") as f:
+        assert [json.loads(line) for line in f] == test_data[:1]
+
+def test_filter_operation_cascade_escalates_low_confidence_entries():
+    test_data = [{"name": "Alice", "age": 40}, {"name": "Bob", "age": 29}, {"name": "Carol", "age": 10}]
+    input_file = create_test_data(test_data)
+    output_dir = tempfile.mkdtemp()
+    models = []
+
+    def answer(url, **kwargs):
+        data = kwargs["json"]
+        models.append(data["model"])
+        response = MagicMock(status_code=200, headers={})
+        if data["model"] == "gpt-4":
+            content = "Yes\nChecked carefully"
+        else:
+            entries = [json.loads(line) for line in data["messages"][1]["content"].split(":\n", 1)[1].split("\n")]
+            answers = [{"id": item["id"], "answer": item["entry"]["age"] > 28, "reason": "quick",
+                        "confidence": 0.5 if item["entry"]["age"] == 29 else 0.95} for item in entries]
+            content = json.dumps({"answers": answers})
+        response.json.return_value = {"choices": [{"message": {"content": content}}]}
+        return response
+
+    args = Namespace(input_path=Path(input_file), output_path=Path(output_dir), raw_user_prompt="Older than 28",
+                     cascade=True, confidence_threshold=0.8, entries_per_request=3)
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+    config.client.api_key = "test-key"
+
+    with patch.object(config.client.session, 'post', side_effect=answer):
+        assert filter_operation(config)
+
+    assert models == ["gpt-3.5-turbo", "gpt-4"]
+    with open(Path(output_dir) / "filtered.jsonl") as f:
+        assert [json.loads(line) for line in f] == test_data[:2]
+
+def test_filter_operation_token_report_makes_no_requests(capsys):
+    test_data = [{"name": "Alice", "bio": "word " * 200, "embedding": [0.5] * 50}, {"name": "Bob", "bio": "short", "embedding": [0.1] * 50}]
+    input_file = create_test_data(test_data)
+    output_dir = tempfile.mkdtemp()
+
+    args = Namespace(input_path=Path(input_file), output_path=Path(output_dir), raw_user_prompt="Has a long bio",
+                     exclude_fields="embedding", strip_whitespace=True, max_value_tokens=20, token_report=True)
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+
+    with patch('dset.operations.ask_yes_no_question') as ask:
+        assert filter_operation(config)
+
+    ask.assert_not_called()
+    output = capsys.readouterr().out
+    assert "for 2 entries in 2 requests" in output
+    assert "Truncated 1 string values" in output
+    assert not (Path(output_dir) / "filtered.jsonl").exists()
+
+def test_assert_operation_fail_fast_stops_at_first_failure():
+    input_file = create_test_data([{"id": i} for i in range(200)])
+    asked = []
+
+    def ask(config, question):
+        asked.append(question)
+        return {"answer": '"id":3}' not in question, "reason": "Mock reason"}
+
+    args = Namespace(input_path=Path(input_file), raw_user_prompt="Ids are small", fail_fast=True, concurrency=2)
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+
+    with patch('dset.operations.ask_yes_no_question', side_effect=ask):
+        assert not assert_operation(config)
+
+    assert len(asked) < 20
+
+def test_assert_operation_sample_bounds_failure_rate():
+    input_file = create_test_data([{"id": i, "kind": "a" if i % 10 else "b"} for i in range(5000)])
+    asked = []
+
+    def ask(config, question):
+        asked.append(question)
+        return {"answer": True, "reason": "Mock reason"}
+
+    args = Namespace(input_path=Path(input_file), raw_user_prompt="Valid", sample=2000, stratify="kind",
+                     max_failure_rate=0.05, confidence=0.95, seed=7)
+    config = Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+
+    with patch('dset.operations.ask_yes_no_question', side_effect=ask):
+        assert assert_operation(config)
+
+    assert len(asked) < 300
+
+def test_filter_operation_shards_and_gather():
+    test_data = [{"id": i} for i in range(10)]
+    input_file = create_test_data(test_data)
+    output_dir = Path(tempfile.mkdtemp())
+    asked = []
+
+    def ask(config, question):
+        asked.append(question)
+        return {"answer": True, "reason": "Mock reason"}
+
+    with patch('dset.operations.ask_yes_no_question', side_effect=ask):
+        for shard in ("2/3", "0/3", "1/3"):
+            args = Namespace(input_path=Path(input_file), output_path=output_dir / "filtered.jsonl", raw_user_prompt="Any", shard=shard)
+            assert filter_operation(Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo"))
+
+    assert len(asked) == 10
+    assert not Path(f"{input_file}.idx").exists()
+    with open(output_dir / "filtered.shard-1-of-3.jsonl") as f:
+        assert [json.loads(line) for line in f] == test_data[3:6]
+
+    args = Namespace(source=output_dir / "filtered.jsonl", output_path=output_dir / "all.jsonl")
+    assert gather_operation(Config(args=args, smart_model="gpt-4", fast_model="gpt-3.5-turbo"))
+    with open(output_dir / "all.jsonl") as f:
+        assert [json.loads(line) for line in f] == test_data
+
 if __name__ == "__main__":
     test_filter_operation()
     test_merge_operation()
     test_split_operation()
     test_ask_operation()
     test_generate_operation()
+    test_generate_operation_without_api_key_fills_partial_rounds()
+    test_generate_operation_batches_and_drops_duplicates()
     test_merge_operation_with_empty_file()
     test_split_operation_with_small_file()
     test_filter_operation_error_with_file_output_for_directory_input()
+    test_filter_operation_concurrent_preserves_order()
+    test_filter_operation_batch_export_and_ingest()
+    test_filter_operation_resumes_from_checkpoint()
+    test_filter_operation_resumes_from_compressed_input()
+    test_filter_operation_fresh_run_discards_old_checkpoint()
+    test_filter_operation_only_shows_referenced_fields()
+    test_filter_operation_where_skips_llm_for_rejected_entries()
+    test_filter_operation_cascade_escalates_low_confidence_entries()
+    test_assert_operation_fail_fast_stops_at_first_failure()
+    test_assert_operation_sample_bounds_failure_rate()
+    test_filter_operation_shards_and_gather()
     print("All tests passed!")
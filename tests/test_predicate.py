@@ -0,0 +1,21 @@
+import pytest
+from dset.predicate import Predicate, PredicateError
+
+def test_predicate_evaluates_fields_and_helpers():
+    entry = {"name": "Alice", "age": 30, "tags": ["a", "b"], "address": {"city": "Paris"}, "full name": "Alice A"}
+
+    assert Predicate("age >= 18 and has(name)")(entry)
+    assert Predicate("type_of(tags) == 'array' and len(tags) == 2 and tags[0] == 'a'")(entry)
+    assert Predicate("address.city == 'Paris' and lower(name) in ['alice', 'bob']")(entry)
+    assert Predicate("matches(entry['full name'], '^Alice')")(entry)
+    assert not Predicate("has(email) or 10 < age < 20")(entry)
+    assert Predicate("email is None and not has(email)")(entry)
+
+def test_predicate_treats_evaluation_errors_as_no_match():
+    assert not Predicate("age > 18")({"age": "thirty"})
+    assert not Predicate("len(tags) > 0")({})
+
+def test_predicate_rejects_unsafe_expressions():
+    for expression in ("__import__('os').system('true')", "name.__class__", "[x for x in tags]", "lambda: 1", "age >"):
+        with pytest.raises(PredicateError):
+            Predicate(expression)
@@ -0,0 +1,27 @@
+from unittest.mock import patch
+from dset import prompt
+from dset.prompt import EntryCompactor, count_tokens, format_entry, truncate
+
+def test_compactor_excludes_strips_and_truncates():
+    compactor = EntryCompactor(exclude=["embedding"], strip_whitespace=True, max_value_tokens=2)
+    entry = {"id": 7, "embedding": [0.1, 0.2], "title": "  a\n\n b  ", "body": {"text": "x" * 400, "tags": ["  t  "]}}
+
+    compacted = compactor(entry)
+
+    assert "embedding" not in compacted and compacted["id"] == 7
+    assert compacted["title"] == "a b"
+    assert compacted["body"]["tags"] == ["t"]
+    assert compacted["body"]["text"].endswith(prompt.TRUNCATION_MARKER)
+    assert count_tokens(compacted["body"]["text"]) < count_tokens(entry["body"]["text"])
+    assert compactor.truncated == 1
+    assert entry["title"] == "  a\n\n b  "
+
+def test_estimator_is_used_without_tiktoken():
+    with patch.object(prompt, 'tiktoken', None):
+        assert count_tokens("abcdefgh") == 2
+        assert count_tokens("abcdefghi") == 3
+        assert truncate("abcdefghij", 2) == "abcdefgh" + prompt.TRUNCATION_MARKER
+        assert truncate("abc", 2) == "abc"
+
+def test_format_entry_is_compact():
+    assert format_entry({"name": "Zoë", "tags": [1, 2]}) == '{"name":"Zoë","tags":[1,2]}'
@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from dset.config import Config
+from dset.openai_api import OpenAIClient, OpenAIError, ask_yes_no_question
+from dset.ratelimit import RateLimiter, RetryPolicy, TokenBucket, parse_duration
+
+class StubServer:
+    # A local OpenAI-compatible endpoint that answers with a scripted list of
+    # status codes, then 200s, and records when each request arrived.
+    def __init__(self, statuses, headers=None):
+        self.statuses = list(statuses)
+        self.headers = headers or {}
+        self.arrivals = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                stub.arrivals.append(time.monotonic())
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                body = json.dumps({"choices": [{"message": {"content": "Yes\nStub"}}], "usage": {"total_tokens": 5}}).encode()
+                self.send_response(status)
+                for name, value in stub.headers.items():
+                    self.send_header(name, value)
+                if status == 429:
+                    self.send_header("Retry-After", "0.05")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def make_config(url, **client_options):
+    client = OpenAIClient(base_url=url, retry_policy=RetryPolicy(max_retries=3, base_delay=0.01), **client_options)
+    return Config(args=Namespace(), smart_model="gpt-4", fast_model="gpt-3.5-turbo", client=client)
+
+def test_client_retries_rate_limits_and_server_errors():
+    stub = StubServer([429, 503, 500])
+    try:
+        config = make_config(stub.url)
+        assert ask_yes_no_question(config, "Is it?") == {"answer": True, "reason": "Stub"}
+        assert len(stub.arrivals) == 4
+        assert stub.arrivals[1] - stub.arrivals[0] >= 0.05  # Retry-After is honored
+    finally:
+        stub.close()
+
+def test_client_raises_instead_of_inventing_answers():
+    stub = StubServer([500] * 10)
+    try:
+        with pytest.raises(OpenAIError):
+            ask_yes_no_question(make_config(stub.url), "Is it?")
+        assert len(stub.arrivals) == 4
+    finally:
+        stub.close()
+
+def test_rate_limiter_spaces_requests_across_threads():
+    stub = StubServer([])
+    try:
+        config = make_config(stub.url, rate_limiter=RateLimiter(requests_per_minute=600))
+        config.client.rate_limiter.buckets["requests"].level = 1  # Start with an almost empty bucket
+        threads = [threading.Thread(target=ask_yes_no_question, args=(config, "Is it?")) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 600 a minute is one every 0.1 seconds after the first
+        assert stub.arrivals[-1] - stub.arrivals[0] >= 0.25
+    finally:
+        stub.close()
+
+def test_rate_limiter_learns_limits_from_headers():
+    limiter = RateLimiter()
+    limiter.update({"x-ratelimit-limit-requests": "60", "x-ratelimit-remaining-requests": "0",
+                    "x-ratelimit-reset-requests": "2s", "x-ratelimit-limit-tokens": "1000"})
+    assert limiter.buckets["tokens"].capacity == 1000
+    assert limiter.buckets["requests"].reserve(1) == pytest.approx(3.0, abs=0.1)
+
+def test_token_bucket_and_durations():
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("1.5") == 1.5
@@ -0,0 +1,38 @@
+import random
+from collections import Counter
+import pytest
+from dset.sampling import SequentialTest, reservoir_sample, wilson_interval
+
+def test_wilson_interval():
+    low, high = wilson_interval(0, 100, 0.95)
+    assert low == 0 and high == pytest.approx(0.037, abs=0.001)
+    low, high = wilson_interval(50, 100, 0.95)
+    assert low == pytest.approx(0.404, abs=0.001) and high == pytest.approx(0.596, abs=0.001)
+
+def test_reservoir_sample_is_uniform_and_stratified():
+    rng = random.Random(1)
+    counts = Counter(item for _ in range(2000) for item in reservoir_sample(range(10), 3, rng))
+    assert all(500 < count < 700 for count in counts.values())
+
+    items = [("common", i) for i in range(990)] + [("rare", i) for i in range(10)]
+    sample = reservoir_sample(items, 50, rng, key=lambda item: item[0])
+    strata = Counter(stratum for stratum, _ in sample)
+    assert strata["rare"] >= 1 and strata["common"] == 50
+
+def test_sequential_test_stops_early():
+    passing = SequentialTest(max_failure_rate=0.05, confidence=0.95)
+    decisions = [passing.update(True) for _ in range(1024)]
+    assert True in decisions and decisions.index(True) < 300
+
+    failing = SequentialTest(max_failure_rate=0.05, confidence=0.95)
+    decisions = [failing.update(i % 3 != 0) for i in range(64)]
+    assert decisions.index(False) == 15
+    # The first look spends half the error budget, so its interval is wider
+    first_look = SequentialTest(max_failure_rate=0.05, confidence=0.95)
+    assert [first_look.update(i % 3 != 0) for i in range(16)][-1] is False
+    assert first_look.interval_confidence == 0.975
+    assert first_look.interval == wilson_interval(first_look.failures, 16, 0.975)
+
+    undecided = SequentialTest(max_failure_rate=0.05, confidence=0.95)
+    assert all(undecided.update(True) is None for _ in range(20))
+    assert undecided.finish() is None
@@ -0,0 +1,62 @@
+import json
+import tempfile
+from pathlib import Path
+from dset.splitter import split_files
+
+def write_lines(path, lines, trailing_newline=True):
+    data = "\n".join(lines) + ("\n" if trailing_newline else "")
+    path.write_bytes(data.encode())
+    return data.encode()
+
+def read_outputs(paths):
+    return [path.read_bytes() for path in paths]
+
+def make_input(count=100):
+    input_dir = Path(tempfile.mkdtemp())
+    lines = [json.dumps({"id": i, "text": "x" * (i % 13)}) for i in range(count)]
+    data = write_lines(input_dir / "data.jsonl", lines)
+    return input_dir / "data.jsonl", lines, data
+
+def test_split_by_bytes_is_byte_exact():
+    input_file, lines, data = make_input()
+    outputs = read_outputs(split_files([input_file], Path(tempfile.mkdtemp()), max_bytes=300))
+
+    assert b"".join(outputs) == data
+    assert all(len(output) <= 300 for output in outputs)
+    assert all(output.endswith(b"\n") for output in outputs)
+
+def test_split_by_lines_and_shards():
+    input_file, lines, data = make_input()
+
+    outputs = read_outputs(split_files([input_file], Path(tempfile.mkdtemp()), max_lines=30))
+    assert [output.count(b"\n") for output in outputs] == [30, 30, 30, 10]
+    assert b"".join(outputs) == data
+
+    outputs = read_outputs(split_files([input_file], Path(tempfile.mkdtemp()), shards=4, workers=4))
+    assert len(outputs) == 4
+    assert b"".join(outputs) == data
+    assert max(map(len, outputs)) - min(map(len, outputs)) < 100
+
+def test_split_across_files_without_trailing_newline():
+    input_dir = Path(tempfile.mkdtemp())
+    write_lines(input_dir / "a.jsonl", ['{"id": 1}', '{"id": 2}'], trailing_newline=False)
+    write_lines(input_dir / "b.jsonl", ['{"id": 3}', '{"id": 4}'])
+
+    outputs = read_outputs(split_files(sorted(input_dir.glob("*.jsonl")), Path(tempfile.mkdtemp()), max_lines=3))
+    assert outputs == [b'{"id": 1}\n{"id": 2}\n{"id": 3}\n', b'{"id": 4}\n']
+
+def test_split_compressed_input_and_output():
+    import gzip
+    input_file, lines, data = make_input()
+    compressed = input_file.with_name("data.jsonl.gz")
+    with gzip.open(compressed, 'wb') as f:
+        f.write(data)
+
+    output_dir = Path(tempfile.mkdtemp())
+    outputs = split_files([compressed], output_dir, max_lines=30, compression="gzip")
+    assert [path.name for path in outputs] == [f"split_{i}.jsonl.gz" for i in range(1, 5)]
+    assert b"".join(gzip.decompress(path.read_bytes()) for path in outputs) == data
+
+    outputs = split_files([compressed], Path(tempfile.mkdtemp()), shards=3)
+    assert len(outputs) == 3
+    assert b"".join(read_outputs(outputs)) == data
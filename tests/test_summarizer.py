@@ -0,0 +1,36 @@
+from argparse import Namespace
+from unittest.mock import patch
+from dset.config import Config
+from dset.summarizer import ReasonSummarizer, SUMMARIZE_ALL, SUMMARIZE_NO
+
+def mock_generate_text(config, prompt):
+    if prompt.startswith("Combine"):
+        return f"merged({prompt.count('Summary ')})"
+    return f"leaf({prompt.count(chr(10)) - 1})"
+
+def test_summarizer_builds_tree_and_skips_duplicates():
+    config = Config(args=Namespace(), smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+
+    with patch('dset.summarizer.generate_text', side_effect=mock_generate_text) as mock_generate:
+        summarizer = ReasonSummarizer(config, mode=SUMMARIZE_ALL, concurrency=4)
+        for i in range(200):
+            summarizer.add(i % 2 == 0, f"reason {i % 100}")
+        summary = summarizer.result()
+
+    # 100 distinct reasons -> 10 leaf summaries -> 3 merges -> 1 final merge
+    prompts = [call.args[1] for call in mock_generate.call_args_list]
+    assert sum(p.startswith("Summarize") for p in prompts) == 10
+    assert sum(p.startswith("Combine") for p in prompts) == 4
+    assert summary == "merged(3)"
+
+def test_summarizer_only_no_answers():
+    config = Config(args=Namespace(), smart_model="gpt-4", fast_model="gpt-3.5-turbo")
+
+    with patch('dset.summarizer.generate_text', side_effect=mock_generate_text) as mock_generate:
+        summarizer = ReasonSummarizer(config, mode=SUMMARIZE_NO)
+        for i in range(30):
+            summarizer.add(i != 7, f"reason {i}")
+        summary = summarizer.result()
+
+    assert summary == "leaf(1)"
+    mock_generate.assert_called_once()
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from pathlib import Path
+import pytest
+from dset.workqueue import WorkQueue, parse_shard, shard_path, shard_paths
+
+def test_parse_shard():
+    assert parse_shard("0/4") == (0, 4)
+    assert parse_shard("3/4") == (3, 4)
+    for spec in ("4/4", "-1/4", "1/0", "1", "a/b"):
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+
+def test_shard_paths_are_found_in_order():
+    directory = Path(tempfile.mkdtemp())
+    assert shard_path(directory / "out.jsonl.gz", 1, 3) == directory / "out.shard-1-of-3.jsonl.gz"
+    for number in (2, 0, 1):
+        shard_path(directory / "out.jsonl", number, 3).touch()
+    assert shard_paths(directory / "out.jsonl") == [shard_path(directory / "out.jsonl", number, 3) for number in range(3)]
+
+    (directory / "out.shard-1-of-3.jsonl").unlink()
+    with pytest.raises(ValueError, match="Missing shards"):
+        shard_paths(directory / "out.jsonl")
+
+def test_leases_are_exclusive_until_stale():
+    work_dir = tempfile.mkdtemp()
+    first = WorkQueue(work_dir, lease_timeout=60, worker="first")
+    second = WorkQueue(work_dir, lease_timeout=60, worker="second")
+    first.create_plan({"chunks": 2})
+    second.create_plan({"chunks": 2})
+    with pytest.raises(ValueError):
+        WorkQueue(work_dir).create_plan({"chunks": 3})
+
+    assert first.claim(0)
+    assert not second.claim(0)
+
+    # The first worker went quiet: its lease can be taken over, once
+    lease = Path(work_dir) / "leases" / "00000000.lease"
+    os.utime(lease, (time.time() - 120, time.time() - 120))
+    assert second.claim(0)
+    assert not first.claim(0)
+
+    output = second.temporary_output_path(0)
+    output.write_text('{"id": 0}\n')
+    second.complete(0, output, {"entries": 1})
+    assert second.pending() == [1]
+    assert not first.claim(0)
+
+def test_stale_lease_takeover_is_checked():
+    work_dir = tempfile.mkdtemp()
+    first = WorkQueue(work_dir, lease_timeout=60, worker="first")
+    second = WorkQueue(work_dir, lease_timeout=60, worker="second")
+    dead = WorkQueue(work_dir, lease_timeout=60, worker="dead")
+    for queue in (first, second, dead):
+        queue.create_plan({"chunks": 1})
+    lease = Path(work_dir) / "leases" / "00000000.lease"
+
+    assert dead.claim(0)
+    os.utime(lease, (time.time() - 120, time.time() - 120))
+    stale = first._read_lease(lease)
+
+    # The second worker takes over first, so the first finds a fresh lease in its place
+    assert second.claim(0)
+    assert not first._take(lease, stale)
+    assert lease.read_text() == "second"
+
+    # Only the owner removes a lease
+    first._release(lease)
+    dead._release(lease)
+    assert lease.read_text() == "second"
+    second._release(lease)
+    assert not lease.exists()
+    assert not list((Path(work_dir) / "leases").iterdir())
+
+def test_workers_share_a_work_dir():
+    directory = Path(tempfile.mkdtemp())
+    input_file = directory / "input.jsonl"
+    with open(input_file, "w") as f:
+        for i in range(95):
+            f.write(json.dumps({"id": i}) + "\n")
+    work_dir = directory / "work"
+
+    env = dict(os.environ, PYTHONPATH=str(Path(__file__).parent.parent / "src"))
+    env.pop("OPENAI_API_KEY", None)
+    env.pop("OPENAI_BASE_URL", None)
+    command = [sys.executable, "-m", "dset", "--no-cache", "filter", str(input_file), str(directory / "out"), "Any entry",
+               "--work-dir", str(work_dir), "--chunk-size", "10"]
+    workers = [subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL) for _ in range(3)]
+    assert all(worker.wait(timeout=120) == 0 for worker in workers)
+
+    summaries = [json.loads(path.read_text()) for path in sorted((work_dir / "chunks").glob("*.done"))]
+    assert len(summaries) == 10 and sum(summary["entries"] for summary in summaries) == 95
+    assert not list((work_dir / "leases").iterdir())
+    assert json.loads((work_dir / "plan.json").read_text())["input"] == str(input_file)
+
+    gather = subprocess.run([sys.executable, "-m", "dset", "gather", str(work_dir), str(directory / "merged.jsonl")],
+                            env=env, stdout=subprocess.DEVNULL)
+    assert gather.returncode == 0
+    with open(directory / "merged.jsonl") as f:
+        assert [json.loads(line)["id"] for line in f] == list(range(95))